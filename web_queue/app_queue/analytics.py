@@ -0,0 +1,312 @@
+from datetime import timedelta
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Max, Q, Sum, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Queues, QueueEvent, QueueRollup
+
+#: Buckets of the wait-time histogram: the longest wait counted by each bucket in seconds (None
+#: for the last one), the field of :class:`app_queue.models.QueueRollup` counting it and its label
+WAIT_BUCKETS = [
+    (60, 'wait_1m', 'Up to 1 min'),
+    (300, 'wait_5m', '1 to 5 min'),
+    (900, 'wait_15m', '5 to 15 min'),
+    (1800, 'wait_30m', '15 to 30 min'),
+    (3600, 'wait_1h', '30 min to 1 h'),
+    (None, 'wait_longer', 'Over 1 h'),
+]
+
+#: Fields of the rollups summed up over hours
+COUNTERS = ['enqueued', 'removed', 'total_wait', *(field for _, field, _ in WAIT_BUCKETS)]
+
+
+def hour_of(at):
+    """
+    Returns the start of the hour of a time
+
+    :param at: The time
+    :type at: datetime.datetime
+
+    :return: The time with the minutes, seconds and microseconds cleared
+    :rtype: datetime.datetime
+    """
+    return at.replace(minute=0, second=0, microsecond=0)
+
+
+class Tally:
+    """
+    Joins and removals summed up in memory, to be added to a rollup
+    """
+    def __init__(self):
+        """
+        Initializes an empty tally
+        """
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.max_wait = 0.0
+
+    def add(self, enqueued=0, waits=()):
+        """
+        Counts joins, and removals by the time the users waited
+
+        :param enqueued: Number of users who joined
+        :type enqueued: int
+        :param waits: Time each user who left spent in the queue, in seconds
+        :type waits: collections.abc.Iterable
+        """
+        self.counts['enqueued'] += enqueued
+        for wait in waits:
+            wait = max(wait, 0.0)
+            self.counts['removed'] += 1
+            self.counts['total_wait'] += wait
+            self.counts[next(field for bound, field, _ in WAIT_BUCKETS if bound is None or wait <= bound)] += 1
+            self.max_wait = max(self.max_wait, wait)
+
+    def rollup(self, **fields):
+        """
+        Returns a new rollup holding the tally
+
+        :param fields: The queue or the group and the hour of the rollup
+        :type fields: dict
+
+        :return: The unsaved rollup
+        :rtype: app_queue.models.QueueRollup
+        """
+        return QueueRollup(**fields, **self.counts, max_wait=self.max_wait)
+
+
+def _add(scope, hour, tally):
+    """
+    Adds a tally to a rollup with a single UPDATE, creating the rollup on the first change of
+    the hour
+
+    :param scope: The 'queue_id' or the 'group_id' of the rollup
+    :type scope: dict
+    :param hour: Start of the hour of the rollup
+    :type hour: datetime.datetime
+    :param tally: The changes
+    :type tally: app_queue.analytics.Tally
+    """
+    rollups = QueueRollup.objects.filter(hour=hour, **scope)
+    increments = {field: F(field) + n for field, n in tally.counts.items() if n}
+    increments['max_wait'] = Greatest('max_wait', Value(tally.max_wait))
+    if rollups.update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            tally.rollup(hour=hour, **scope).save()
+    except IntegrityError:
+        # Another queue of the group created the rollup of the group in the meantime
+        rollups.update(**increments)
+
+
+def record(queues, enqueued=0, joined=(), at=None):
+    """
+    Adds joins and removals of a queue to the rollups of the queue and of its group
+
+    Called by :mod:`app_queue.services` in the transaction of the change, while the queue is
+    locked, so each change costs one UPDATE per rollup whatever the length of the queue
+
+    :param queues: The changed queue, with its ``group_id`` loaded
+    :type queues: app_queue.models.Queues
+    :param enqueued: Number of users who joined the queue
+    :type enqueued: int
+    :param joined: Time each user who left the queue had joined it
+    :type joined: collections.abc.Iterable
+    :param at: Time of the change, the current time by default
+    :type at: datetime.datetime or None
+    """
+    record_many([(queues, enqueued, joined)], at)
+
+
+def record_many(changes, at=None):
+    """
+    Adds joins and removals of several queues to their rollups and to those of their groups
+
+    The rollups of the queues are written first, then those of the groups, once per group and
+    in the order of the group IDs. The rollup of a group is shared by all its queues, so
+    transactions changing queues of the same groups always lock the group rollups in the
+    same order and cannot deadlock on them
+
+    :param changes: Triples of a queue locked by the caller with its ``group_id`` loaded, the
+                    number of users who joined it and the time each user who left it had joined
+    :type changes: list
+    :param at: Time of the changes, the current time by default
+    :type at: datetime.datetime or None
+    """
+    at = at or timezone.now()
+    groups = {}
+    for queues, enqueued, joined in changes:
+        waits = [(at - enqueued_at).total_seconds() for enqueued_at in joined]
+        tally = Tally()
+        tally.add(enqueued, waits)
+        _add({'queue_id': queues.pk}, hour_of(at), tally)
+        if queues.group_id is not None:
+            groups.setdefault(queues.group_id, Tally()).add(enqueued, waits)
+    for group_id in sorted(groups):
+        _add({'group_id': group_id}, hour_of(at), groups[group_id])
+
+
+def dashboard(queue_id=None, group_id=None, hours=24, now=None):
+    """
+    Reads the analytics of a queue or of a group from its rollups alone, with two queries
+
+    The length of the queue (or of every queue of the group) at the end of each hour is the
+    number of joins less the number of removals counted by the rollups up to that hour
+
+    :param queue_id: ID of the queue, or None for a group
+    :type queue_id: int or None
+    :param group_id: ID of the group, if no queue is given
+    :type group_id: int or None
+    :param hours: Number of hours listed, ending with the current one
+    :type hours: int
+    :param now: The current time, by default read from the clock
+    :type now: datetime.datetime or None
+
+    :return: Dictionary with the 'totals' of every hour (the ``COUNTERS``, 'max_wait',
+             'mean_wait' and the current 'length'), the 'histogram' of the waits as pairs of
+             a label and a count, and the listed 'hours', each holding the 'hour',
+             'enqueued', 'removed', 'mean_wait', 'max_wait' and 'length'
+    :rtype: dict
+    """
+    rollups = QueueRollup.objects.filter(**({'queue_id': queue_id} if queue_id is not None else {'group_id': group_id}))
+    end = hour_of(now or timezone.now())
+    since = end - timedelta(hours=hours - 1)
+    # The aliases shadow the fields, so the sum referring to two of them comes first
+    totals = rollups.aggregate(
+        before=Sum(F('enqueued') - F('removed'), filter=Q(hour__lt=since), output_field=models.IntegerField()),
+        **{field: Sum(field) for field in COUNTERS}, max_wait=Max('max_wait'),
+    )
+    totals = {field: value or 0 for field, value in totals.items()}
+    listed = {row['hour']: row for row in rollups.filter(hour__gte=since, hour__lte=end)
+              .values('hour', 'enqueued', 'removed', 'total_wait', 'max_wait')}
+
+    rows, length = [], totals.pop('before')
+    for n in range(hours):
+        hour = since + timedelta(hours=n)
+        row = listed.get(hour, {'enqueued': 0, 'removed': 0, 'total_wait': 0.0, 'max_wait': 0.0})
+        length += row['enqueued'] - row['removed']
+        rows.append({
+            'hour': hour,
+            'enqueued': row['enqueued'],
+            'removed': row['removed'],
+            'mean_wait': row['total_wait'] / row['removed'] if row['removed'] else 0.0,
+            'max_wait': row['max_wait'],
+            # Users who joined before the rollups began may leave afterwards
+            'length': max(length, 0),
+        })
+    totals['mean_wait'] = totals['total_wait'] / totals['removed'] if totals['removed'] else 0.0
+    totals['length'] = max(totals['enqueued'] - totals['removed'], 0)
+    return {
+        'totals': totals,
+        'histogram': [(label, totals[field]) for _, field, label in WAIT_BUCKETS],
+        'hours': rows,
+    }
+
+
+def _rebuild(group_id, queues, chunk_size):
+    """
+    Rebuilds the rollups of some queues, and those of their group, from their event logs
+
+    The queues are locked first, in the order of their IDs as :func:`app_queue.services.dequeue_next`
+    does, so the changes made meanwhile wait until the rollups are replaced and are then added
+    to them by :func:`_add`
+
+    :param group_id: ID of the group of the queues, or None for queues without a group
+    :type group_id: int or None
+    :param queues: The queues
+    :type queues: django.db.models.QuerySet
+    :param chunk_size: Number of events read, and of rollups inserted, at a time
+    :type chunk_size: int
+
+    :return: Number of events read and of rollups written
+    :rtype: tuple
+    """
+    read = written = 0
+    group_tallies = {}
+
+    def flush(queue_id, tallies):
+        QueueRollup.objects.bulk_create([tally.rollup(queue_id=queue_id, hour=hour) for hour, tally in tallies.items()],
+                                        batch_size=chunk_size)
+        return len(tallies)
+
+    with transaction.atomic():
+        queue_ids = list(queues.select_for_update().order_by('pk').values_list('pk', flat=True))
+        QueueRollup.objects.filter(Q(queue__in=queue_ids) | Q(group=group_id) if group_id is not None
+                                   else Q(queue__in=queue_ids)).delete()
+        events = (QueueEvent.objects.filter(queue__in=queue_ids).order_by('queue', 'pk')
+                  .values_list('queue_id', 'kind', 'user_id', 'created_at'))
+
+        current, tallies, joined = None, {}, {}
+        for queue_id, kind, user_id, created_at in events.iterator(chunk_size=chunk_size):
+            read += 1
+            if queue_id != current:
+                written += flush(current, tallies) if tallies else 0
+                current, tallies, joined = queue_id, {}, {}
+            if kind == QueueEvent.Kind.ENQUEUED:
+                joined[user_id] = created_at
+                change = {'enqueued': 1}
+            elif kind == QueueEvent.Kind.REMOVED and user_id in joined:
+                change = {'waits': [(created_at - joined.pop(user_id)).total_seconds()]}
+            else:
+                continue
+            hour = hour_of(created_at)
+            tallies.setdefault(hour, Tally()).add(**change)
+            if group_id is not None:
+                group_tallies.setdefault(hour, Tally()).add(**change)
+        written += flush(current, tallies) if tallies else 0
+
+        QueueRollup.objects.bulk_create([tally.rollup(group_id=group_id, hour=hour) for hour, tally in group_tallies.items()],
+                                        batch_size=chunk_size)
+    return read, written + len(group_tallies)
+
+
+def backfill(group_ids=None, chunk_size=2000, queue_ids=()):
+    """
+    Rebuilds the rollups of queues and of their groups from the event logs
+
+    The events are read in order of queue and ID, ``chunk_size`` at a time, and the rollups of
+    each queue are inserted in batches once its events are read. Those of the group, one per
+    hour, are kept in memory until the end. A user leaving a queue waited since the event that
+    added them; removals of users who joined before the log began are not counted, as in
+    :func:`app_queue.history.replay`.
+
+    Each group is rebuilt in its own transaction, holding the locks of its queues (see
+    :func:`_rebuild`), so its dashboard never shows a partial rebuild and the queues of the
+    other groups can still change. A queue created in the group during the rebuild is not
+    locked; if its first change of an hour makes the rebuild fail on the rollup of the group,
+    the group is rebuilt again
+
+    :param group_ids: IDs of the groups whose queues are rebuilt, every queue by default
+    :type group_ids: list or None
+    :param chunk_size: Number of events read, and of rollups inserted, at a time
+    :type chunk_size: int
+    :param queue_ids: IDs of queues rebuilt in addition to those of the groups, together
+                      with their groups
+    :type queue_ids: collections.abc.Iterable
+
+    :return: Number of events read and of rollups written
+    :rtype: tuple
+    """
+    queue_ids = list(queue_ids)
+    if group_ids is None:
+        group_ids = Queues.objects.filter(group__isnull=False).values_list('group', flat=True)
+        loose = Queues.objects.filter(group__isnull=True)
+    else:
+        group_ids = Queues.objects.filter(Q(group__in=group_ids) | Q(pk__in=queue_ids)).values_list('group', flat=True)
+        loose = Queues.objects.filter(pk__in=queue_ids, group__isnull=True)
+    scopes = [(group_id, Queues.objects.filter(group=group_id))
+              for group_id in sorted(set(group_ids) - {None})] + [(None, loose)]
+
+    read = written = 0
+    for group_id, queues in scopes:
+        for attempt in range(3):
+            try:
+                counts = _rebuild(group_id, queues, chunk_size)
+                break
+            except IntegrityError:
+                if attempt == 2:
+                    raise
+        read, written = read + counts[0], written + counts[1]
+    return read, written
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class AppQueueConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app_queue'
+
+    def ready(self):
+        """
+        Connects the signal receivers and registers the system checks of the application
+        """
+        from . import broadcast, metrics, signals  # noqa: F401
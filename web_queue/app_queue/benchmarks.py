@@ -0,0 +1,822 @@
+import copy
+import http.client
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import global_settings, settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.template.loader import render_to_string
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from . import seeding, services
+from .models import StudyGroup, UserProfile
+
+
+def percentile(samples, fraction):
+    """
+    Returns a percentile of a list of samples, using the nearest-rank method
+
+    :param samples: The samples
+    :type samples: list
+    :param fraction: The percentile as a fraction, e.g. 0.99
+    :type fraction: float
+
+    :return: The percentile, or 0 if there are no samples
+    :rtype: float
+    """
+    if not samples:
+        return 0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def summarize(latencies, errors, elapsed):
+    """
+    Summarizes the results of a load test
+
+    :param latencies: Latencies of the successful requests, in seconds
+    :type latencies: list
+    :param errors: Number of failed requests
+    :type errors: int
+    :param elapsed: Wall time of the whole test, in seconds
+    :type elapsed: float
+
+    :return: Dictionary with the request and error counts, the requests per second and the
+             mean, p50, p95 and p99 latencies in milliseconds
+    :rtype: dict
+    """
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+class HttpSession:
+    """
+    Minimal keep-alive HTTP client remembering the cookies set by the server
+
+    Used to drive a running server from several threads, one session per thread
+    """
+    def __init__(self, base_url, timeout=30):
+        """
+        Initializes the session
+
+        :param base_url: URL of the server, e.g. 'http://127.0.0.1:8000'
+        :type base_url: str
+        :param timeout: Socket timeout in seconds
+        :type timeout: float
+        """
+        parts = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.netloc, timeout=timeout)
+        self.cookies = {}
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Sends a request and reads the whole response
+
+        :param method: HTTP method
+        :type method: str
+        :param path: Path of the request
+        :type path: str
+        :param body: Form fields of the request
+        :type body: dict or None
+        :param headers: Additional request headers
+        :type headers: dict or None
+
+        :return: A tuple of the status code and the response body
+        :rtype: tuple
+        """
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        if body is not None:
+            body = urlencode(body)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            # The server closed the keep-alive connection, retry once on a new one
+            self.connection.close()
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+        content = response.read()
+        for header in response.headers.get_all('Set-Cookie') or []:
+            name, _, value = header.split(';', 1)[0].partition('=')
+            self.cookies[name.strip()] = value.strip()
+        return response.status, content
+
+    def login(self, login_path, username, password):
+        """
+        Logs in through the login form
+
+        :param login_path: Path of the login page
+        :type login_path: str
+        :param username: Username to log in with
+        :type username: str
+        :param password: Password to log in with
+        :type password: str
+
+        :raises RuntimeError: If the credentials are rejected
+        """
+        _, content = self.request('GET', login_path)
+        token = re.search(rb'name="csrfmiddlewaretoken" value="([^"]+)"', content).group(1).decode()
+        status, _ = self.request('POST', login_path, {
+            'csrfmiddlewaretoken': token, 'username': username, 'password': password,
+        }, {'Referer': login_path})
+        if status != 302:
+            raise RuntimeError(f'Login as {username!r} failed with status {status}.')
+
+
+def http_load(base_url, paths, requests=1000, concurrency=20, login=None):
+    """
+    Drives a running server with concurrent keep-alive clients
+
+    Every client thread logs in once (if credentials are given) and then requests the
+    paths round-robin until ``requests`` requests have been sent in total
+
+    :param base_url: URL of the server, e.g. 'http://127.0.0.1:8000'
+    :type base_url: str
+    :param paths: Paths to request
+    :type paths: list
+    :param requests: Total number of requests
+    :type requests: int
+    :param concurrency: Number of concurrent clients
+    :type concurrency: int
+    :param login: Tuple of the login path, username and password, or None to stay anonymous
+    :type login: tuple or None
+
+    :return: Summary of the results as returned by :func:`summarize`
+    :rtype: dict
+    :raises RuntimeError: If a client fails to log in
+    """
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+    latencies = []
+    errors = [0]
+    ready = threading.Barrier(concurrency + 1)
+    failures = []
+
+    def client():
+        session = HttpSession(base_url)
+        try:
+            if login is not None:
+                session.login(*login)
+        except Exception as e:
+            failures.append(e)
+            ready.abort()
+            return
+        try:
+            ready.wait()
+        except threading.BrokenBarrierError:
+            return
+        while True:
+            with counter_lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            began = time.perf_counter()
+            try:
+                status, _ = session.request('GET', paths[n % len(paths)])
+            except (http.client.HTTPException, OSError):
+                status = None
+            latency = time.perf_counter() - began
+            with counter_lock:
+                if status is not None and status < 400:
+                    latencies.append(latency)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        ready.wait()
+    except threading.BrokenBarrierError:
+        raise RuntimeError(f'A client failed to log in: {failures[0] if failures else "unknown error"}')
+    began = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors[0], time.perf_counter() - began)
+
+
+def connection_handshake(iterations=100, alias='default'):
+    """
+    Measures what a request pays for opening a new database connection instead of reusing one
+
+    Runs a trivial query ``iterations`` times on a new connection each time, then as many times
+    on a single connection kept open, like ``CONN_MAX_AGE`` or a connection pool would
+
+    :param iterations: Number of queries in each mode
+    :type iterations: int
+    :param alias: Alias of the database in ``DATABASES``
+    :type alias: str
+
+    :return: Dictionary with the summaries of both modes, as returned by :func:`summarize`,
+             under 'new_connection' and 'reused_connection', and the mean cost of a
+             handshake in milliseconds under 'handshake_ms'
+    :rtype: dict
+    """
+    def timed_query(connection):
+        began = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+        return time.perf_counter() - began
+
+    new = []
+    for _ in range(iterations):
+        connection = connections.create_connection(alias)
+        try:
+            new.append(timed_query(connection))
+        finally:
+            connection.close()
+
+    connection = connections.create_connection(alias)
+    try:
+        timed_query(connection)
+        reused = [timed_query(connection) for _ in range(iterations)]
+    finally:
+        connection.close()
+
+    results = {
+        'new_connection': summarize(new, 0, sum(new)),
+        'reused_connection': summarize(reused, 0, sum(reused)),
+    }
+    results['handshake_ms'] = round(results['new_connection']['mean_ms'] - results['reused_connection']['mean_ms'], 3)
+    return results
+
+
+def seed(groups=2, profiles=50, queues=10, records=20, password='bench', prefix='bench'):
+    """
+    Creates a data set for the benchmarks with the bulk inserts of :mod:`app_queue.seeding`
+
+    Every group gets ``profiles`` profiles and ``queues`` queues holding the first ``records``
+    profiles of the group. Every group also gets spare profiles that are in no queue, used as
+    the acting users of the benchmarks. All usernames start with a prefix unique to the call,
+    so the data set can be removed again by :func:`unseed`
+
+    :param groups: Number of study groups
+    :type groups: int
+    :param profiles: Number of profiles per group
+    :type profiles: int
+    :param queues: Number of queues per group
+    :type queues: int
+    :param records: Number of records per queue, at most ``profiles``
+    :type records: int
+    :param password: Password of every created user
+    :type password: str
+    :param prefix: Prefix of the created usernames and group names
+    :type prefix: str
+
+    :return: Dictionary with the username prefix under 'prefix', the password under 'password',
+             the group IDs under 'groups', the queue IDs under 'queues' and the spare profile IDs
+             under 'actors', the latter two as lists per group
+    :rtype: dict
+    """
+    prefix = f'{prefix}-{uuid.uuid4().hex[:8]}'
+    records = min(records, profiles)
+    spare = 8
+
+    group_names = [f'{prefix}-group-{g}' for g in range(groups)]
+    usernames = [[f'{prefix}-{g}-{p}' for p in range(profiles + spare)] for g in range(groups)]
+    profile_ids = seeding.seed_students([
+        {'username': username, 'password': password, 'group': group_names[g],
+         'first_name': 'Bench', 'last_name': str(g * (profiles + spare) + p)}
+        for g in range(groups) for p, username in enumerate(usernames[g])
+    ], processes=1)
+    group_ids = seeding.seed_groups(group_names)
+
+    queue_ids, actors = [], []
+    for name, group_usernames in zip(group_names, usernames):
+        members = [profile_ids[username] for username in group_usernames]
+        queue_names = [f'{prefix}-queue-{q}' for q in range(queues)]
+        group_queues = seeding.seed_queues(group_ids[name], queue_names, creator_id=members[0])
+        seeding.seed_memberships({group_queues[queue_name]: members[:records] for queue_name in queue_names})
+        queue_ids.append([group_queues[queue_name] for queue_name in queue_names])
+        actors.append(members[profiles:])
+
+    return {
+        'prefix': prefix,
+        'password': password,
+        'groups': [group_ids[name] for name in group_names],
+        'queues': queue_ids,
+        'actors': actors,
+    }
+
+
+def unseed(data):
+    """
+    Removes a data set created by :func:`seed`, including the users registered by the benchmarks
+
+    :param data: The data set returned by :func:`seed`
+    :type data: dict
+    """
+    User.objects.filter(username__startswith=f'{data["prefix"]}-').delete()
+    StudyGroup.objects.filter(pk__in=data['groups']).delete()
+
+
+def _login(data, profile_id):
+    """
+    Returns a test client logged in as the user of a profile
+
+    :param data: The data set returned by :func:`seed`
+    :type data: dict
+    :param profile_id: ID of the profile to log in as
+    :type profile_id: int
+
+    :return: The logged-in client
+    :rtype: django.test.Client
+    """
+    client = Client(raise_request_exception=False)
+    client.force_login(User.objects.get(userprofile=profile_id))
+    return client
+
+
+def _measure(client, method, path, data=None):
+    """
+    Sends a request through the test client, timing it and counting its queries
+
+    :param client: The test client
+    :type client: django.test.Client
+    :param method: 'get' or 'post'
+    :type method: str
+    :param path: Path of the request
+    :type path: str
+    :param data: Form fields of a POST request
+    :type data: dict or None
+
+    :return: A tuple of the status code, the latency in seconds and the number of queries
+    :rtype: tuple
+    """
+    with CaptureQueriesContext(connections['default']) as queries:
+        began = time.perf_counter()
+        response = getattr(client, method)(path, data)
+        latency = time.perf_counter() - began
+    return response.status_code, latency, len(queries)
+
+
+#: Pages requested by :func:`view_latencies` both logged in and anonymously
+READ_PAGES = ('home', 'queues', 'queue')
+
+
+def view_latencies(data, iterations=20, names=None):
+    """
+    Measures the latency and the number of queries of every view of the queue workflow
+
+    The views are requested one at a time through the Django test client, so the full
+    middleware stack is included. Each iteration adds a spare profile to a queue, moves it
+    to the tail and removes it again, leaving the data set as it was, and registers a new user.
+    The ``READ_PAGES`` are also requested by an anonymous client, as '<view> (anonymous)', which
+    :class:`app_queue.middleware.LoginRequiredMiddleware` redirects to the login before the view
+    runs. Compared to the same pages logged in, this is the cost saved on every anonymous request
+
+    :param data: The data set returned by :func:`seed`
+    :type data: dict
+    :param iterations: Number of requests to every view
+    :type iterations: int
+    :param names: Names of the measured cases, every case by default
+    :type names: collections.abc.Iterable or None
+
+    :return: Dictionary mapping the view names to their summaries, as returned by
+             :func:`summarize`, extended with the mean and the maximum number of queries
+             under 'queries_mean' and 'queries'
+    :rtype: dict
+    """
+    actor = data['actors'][0][0]
+    queue_id = data['queues'][0][0]
+    client = _login(data, actor)
+    anonymous = Client()
+    # Registering logs the anonymous client in, so the anonymous pages are requested by another one
+    visitor = Client(raise_request_exception=False)
+    pages = {
+        'home': lambda n: reverse('home'),
+        'queues': lambda n: reverse('queues'),
+        'queue': lambda n: reverse('queue', args=[queue_id]),
+    }
+    cases = [
+        *((name, client, 'get', pages[name], None) for name in READ_PAGES),
+        ('add_user', client, 'post', lambda n: reverse('add_user', args=[queue_id, actor]), None),
+        ('update_user', client, 'post', lambda n: reverse('update_user', args=[queue_id, actor]), None),
+        ('delete_user', client, 'post', lambda n: reverse('delete_user', args=[queue_id, actor]), None),
+        ('profile', client, 'get', lambda n: reverse('profile'), None),
+        ('register', anonymous, 'post', lambda n: reverse('register'), lambda n: {
+            'username': f'{data["prefix"]}-registered-{n}', 'email': '', 'password': data['password'],
+            'group': data['groups'][0], 'first_name': 'Bench', 'last_name': f'Registered {n}',
+        }),
+        *((f'{name} (anonymous)', visitor, 'get', pages[name], None) for name in READ_PAGES),
+    ]
+    if names is not None:
+        names = set(names)
+        cases = [case for case in cases if case[0] in names]
+
+    samples = defaultdict(lambda: ([], [], [0]))
+    began = time.perf_counter()
+    for n in range(iterations):
+        for name, sender, method, path, form in cases:
+            status, latency, queries = _measure(sender, method, path(n), form(n) if form else None)
+            latencies, counts, errors = samples[name]
+            if status < 400:
+                latencies.append(latency)
+                counts.append(queries)
+            else:
+                errors[0] += 1
+        anonymous.logout()
+    elapsed = time.perf_counter() - began
+
+    results = {}
+    for name, (latencies, counts, errors) in samples.items():
+        results[name] = summarize(latencies, errors[0], sum(latencies) or elapsed)
+        results[name]['queries_mean'] = round(sum(counts) / len(counts), 2) if counts else 0
+        results[name]['queries'] = max(counts, default=0)
+    return results
+
+
+def _template_settings(cached):
+    """
+    Returns the template and cache settings of a mode of :func:`render_latencies`
+
+    :param cached: Whether the templates are kept by the cached loader and their fragments
+                   are cached, as in production, or both are read again on every render
+    :type cached: bool
+
+    :return: The TEMPLATES and CACHES settings
+    :rtype: tuple
+    """
+    templates = copy.deepcopy(settings.TEMPLATES)
+    templates[0].pop('APP_DIRS', None)
+    templates[0]['OPTIONS']['loaders'] = (
+        [('django.template.loaders.cached.Loader', settings.TEMPLATE_LOADERS)] if cached else settings.TEMPLATE_LOADERS)
+    fragments = (
+        {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'render-benchmark'} if cached
+        else {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'})
+    return templates, {**settings.CACHES, 'template_fragments': fragments}
+
+
+def render_latencies(data, iterations=200):
+    """
+    Measures the time spent rendering the queue pages, with and without template caching
+
+    The pages are rendered directly from contexts read beforehand, so only the template work
+    is timed. In the 'cached' mode the templates are kept by the cached loader and the page
+    chrome and the rows are served from the fragment cache, warmed by a first render. In the
+    'uncached' mode every render reads and compiles the templates and renders every fragment
+
+    :param data: The data set returned by :func:`seed`
+    :type data: dict
+    :param iterations: Number of renders of every page in every mode
+    :type iterations: int
+
+    :return: Dictionary mapping the page names followed by the mode in parentheses, e.g.
+             'queue (cached)', to their summaries, as returned by :func:`summarize`
+    :rtype: dict
+    """
+    profile = UserProfile.objects.select_related('user').get(pk=data['actors'][0][0])
+    queue_id = data['queues'][0][0]
+    request = RequestFactory().get('/')
+    request.user = profile.user
+    snapshot = services.load_snapshot(queue_id)
+    user_queues, next_cursor = services.group_queues_page(profile.group_id, None, settings.QUEUES_PAGE_SIZE)
+    pages = {
+        'queue': ('app_queue/queue.html', {
+            'entries': snapshot.entries, 'version': snapshot.version, 'queue_pk': queue_id, 'user_pk': profile.pk}),
+        'queues': ('app_queue/queues.html', {'user_queues': user_queues, 'next_cursor': next_cursor}),
+    }
+
+    results = {}
+    for mode in ('uncached', 'cached'):
+        templates, caches = _template_settings(mode == 'cached')
+        with override_settings(TEMPLATES=templates, CACHES=caches):
+            for page, (template_name, context) in pages.items():
+                render_to_string(template_name, context, request)
+                latencies = []
+                for _ in range(iterations):
+                    began = time.perf_counter()
+                    render_to_string(template_name, context, request)
+                    latencies.append(time.perf_counter() - began)
+                results[f'{page} ({mode})'] = summarize(latencies, 0, sum(latencies))
+    return results
+
+
+def auth_throughput(data, iterations=10):
+    """
+    Measures registrations and logins with the password hashers of Django and with the configured ones
+
+    Both requests hash a password, which takes most of their time. They are sent one at a time
+    through the Django test client, so the throughput is the one of a single worker process
+    and CPU; workers hash in parallel, as the hashers release the GIL. Logins check the
+    password of a seeded user, rehashing it first if it was hashed with other settings
+
+    :param data: The data set returned by :func:`seed`
+    :type data: dict
+    :param iterations: Number of registrations and logins with every set of hashers
+    :type iterations: int
+
+    :return: Dictionary mapping the requests followed by the hashers in parentheses, e.g.
+             'login (configured)', to their summaries, as returned by :func:`summarize`
+    :rtype: dict
+    """
+    username = User.objects.get(userprofile=data['actors'][0][0]).username
+    results = {}
+    for name, hashers in (('default', global_settings.PASSWORD_HASHERS), ('configured', settings.PASSWORD_HASHERS)):
+        with override_settings(PASSWORD_HASHERS=hashers):
+            samples = {'register': ([], [0]), 'login': ([], [0])}
+            for n in range(iterations):
+                for case, path, form in (
+                    ('register', reverse('register'), {
+                        'username': f'{data["prefix"]}-reg-{name}-{n}', 'email': '', 'password': data['password'],
+                        'group': data['groups'][0], 'first_name': 'Bench', 'last_name': f'Registered {n}',
+                    }),
+                    ('login', reverse('login'), {'username': username, 'password': data['password']}),
+                ):
+                    # Both views redirect on success and render the form again on failure
+                    status, latency, _ = _measure(Client(), 'post', path, form)
+                    latencies, errors = samples[case]
+                    if status == 302:
+                        latencies.append(latency)
+                    else:
+                        errors[0] += 1
+            for case, (latencies, errors) in samples.items():
+                results[f'{case} ({name})'] = summarize(latencies, errors[0], sum(latencies))
+    return results
+
+
+SESSION_ENGINES = ['db', 'cached_db', 'signed_cookies']
+
+
+def session_queries(data, iterations=20, engines=None):
+    """
+    Measures the latency and the number of queries of the pages behind the login with every
+    session engine
+
+    A client is logged in with each engine of :mod:`django.contrib.sessions` in turn and
+    requests the pages through the Django test client, so the session and the user are loaded
+    by the middleware as in production
+
+    :param data: The data set returned by :func:`seed`
+    :type data: dict
+    :param iterations: Number of requests to every page with every engine
+    :type iterations: int
+    :param engines: Names of the session backends, :data:`SESSION_ENGINES` by default
+    :type engines: list or None
+
+    :return: Dictionary mapping the page names followed by the engine in parentheses, e.g.
+             'queue (cached_db)', to their summaries, as returned by :func:`summarize`,
+             extended with the mean and the maximum number of queries under 'queries_mean'
+             and 'queries'
+    :rtype: dict
+    """
+    queue_id = data['queues'][0][0]
+    pages = {
+        'home': reverse('home'),
+        'queues': reverse('queues'),
+        'queue': reverse('queue', args=[queue_id]),
+        'profile': reverse('profile'),
+    }
+    results = {}
+    for engine in engines or SESSION_ENGINES:
+        with override_settings(SESSION_ENGINE=f'django.contrib.sessions.backends.{engine}'):
+            client = _login(data, data['actors'][0][0])
+            for page, path in pages.items():
+                latencies, counts, errors = [], [], 0
+                for _ in range(iterations):
+                    status, latency, queries = _measure(client, 'get', path)
+                    if status < 400:
+                        latencies.append(latency)
+                        counts.append(queries)
+                    else:
+                        errors += 1
+                summary = results[f'{page} ({engine})'] = summarize(latencies, errors, sum(latencies))
+                summary['queries_mean'] = round(sum(counts) / len(counts), 2) if counts else 0
+                summary['queries'] = max(counts, default=0)
+    return results
+
+
+DEFAULT_MIX = {'home': 1, 'queues': 3, 'queue': 6, 'add_user': 1, 'update_user': 1, 'delete_user': 1}
+
+
+def mixed_workload(data, requests=500, concurrency=4, mix=None, seed=0):
+    """
+    Drives the queue workflow with concurrent clients through the Django test client
+
+    Every client thread is logged in as its own spare profile and picks the views at random,
+    weighted by ``mix``. The mutations act on the client's own profile in the queues of its
+    group: it is moved or removed only in a queue it has been added to
+
+    :param data: The data set returned by :func:`seed`
+    :type data: dict
+    :param requests: Total number of requests
+    :type requests: int
+    :param concurrency: Number of concurrent clients, at most the number of spare profiles
+    :type concurrency: int
+    :param mix: Relative weights of the views, :data:`DEFAULT_MIX` by default
+    :type mix: dict or None
+    :param seed: Seed of the random choices, so runs are repeatable
+    :type seed: int
+
+    :return: Dictionary with the summary of all requests, as returned by :func:`summarize`,
+             under 'overall' and the summaries per view under 'views'
+    :rtype: dict
+    :raises ValueError: If there are fewer spare profiles than clients
+    :raises RuntimeError: If a client fails to log in
+    """
+    mix = mix or DEFAULT_MIX
+    names, weights = list(mix), list(mix.values())
+    actors = [(group, actor) for group, group_actors in enumerate(data['actors']) for actor in group_actors]
+    if concurrency > len(actors):
+        raise ValueError(f'At most {len(actors)} concurrent clients are supported by the data set.')
+    counter = iter(range(requests))
+    lock = threading.Lock()
+    samples = defaultdict(lambda: ([], [0]))
+    ready = threading.Barrier(concurrency + 1)
+    failures = []
+
+    def client(index):
+        group, actor = actors[index]
+        queue_ids = data['queues'][group]
+        choice = random.Random(seed + index)
+        joined = set()
+        try:
+            try:
+                session = _login(data, actor)
+            except Exception as e:
+                failures.append(e)
+                ready.abort()
+                return
+            try:
+                ready.wait()
+            except threading.BrokenBarrierError:
+                return
+            while True:
+                with lock:
+                    n = next(counter, None)
+                if n is None:
+                    return
+                name = choice.choices(names, weights)[0]
+                if name in ('update_user', 'delete_user') and not joined:
+                    name = 'add_user'
+                if name == 'add_user':
+                    queue_id = choice.choice(queue_ids)
+                    joined.add(queue_id)
+                elif name in ('update_user', 'delete_user'):
+                    queue_id = choice.choice(sorted(joined))
+                    if name == 'delete_user':
+                        joined.discard(queue_id)
+                else:
+                    queue_id = choice.choice(queue_ids)
+                args = [queue_id, actor] if name.endswith('_user') else [queue_id] if name == 'queue' else []
+                method = 'post' if name.endswith('_user') else 'get'
+                began = time.perf_counter()
+                status = getattr(session, method)(reverse(name, args=args)).status_code
+                latency = time.perf_counter() - began
+                with lock:
+                    if status < 400:
+                        samples[name][0].append(latency)
+                    else:
+                        samples[name][1][0] += 1
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=client, args=(index,), daemon=True) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        ready.wait()
+    except threading.BrokenBarrierError:
+        raise RuntimeError(f'A client failed to log in: {failures[0] if failures else "unknown error"}')
+    began = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    return {
+        'overall': summarize([latency for latencies, _ in samples.values() for latency in latencies],
+                             sum(errors[0] for _, errors in samples.values()), elapsed),
+        'views': {name: summarize(latencies, errors[0], elapsed) for name, (latencies, errors) in samples.items()},
+    }
+
+
+def compare(results, baseline, tolerance=0.25, min_delta_ms=1.0):
+    """
+    Compares the results of a benchmark with the results of an earlier run
+
+    A view regresses when its p95 latency grows by more than ``tolerance`` (and by more than
+    ``min_delta_ms``, which keeps sub-millisecond noise from failing the comparison), when it
+    runs more queries or when it fails more requests. Views missing from either run are skipped
+
+    :param results: Results of :func:`view_latencies` or :func:`mixed_workload`
+    :type results: dict
+    :param baseline: Results of the same benchmark on the earlier run
+    :type baseline: dict
+    :param tolerance: Allowed relative growth of the p95 latency, e.g. 0.25 for 25%
+    :type tolerance: float
+    :param min_delta_ms: Growth of the p95 latency in milliseconds that is always allowed
+    :type min_delta_ms: float
+
+    :return: Descriptions of the regressions, empty if there are none
+    :rtype: list
+    """
+    current_views = results.get('views', results)
+    baseline_views = baseline.get('views', baseline)
+    regressions = []
+    for name in sorted(current_views.keys() & baseline_views.keys()):
+        current, previous = current_views[name], baseline_views[name]
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance) and \
+                current['p95_ms'] - previous['p95_ms'] > min_delta_ms:
+            regressions.append(f'{name}: p95 latency {previous["p95_ms"]} ms -> {current["p95_ms"]} ms')
+        if 'queries' in current and 'queries' in previous and current['queries'] > previous['queries']:
+            regressions.append(f'{name}: {previous["queries"]} -> {current["queries"]} queries')
+        if current['errors'] > previous['errors']:
+            regressions.append(f'{name}: {previous["errors"]} -> {current["errors"]} errors')
+    return regressions
+
+
+@contextmanager
+def gunicorn(server, port, workers=1):
+    """
+    Runs Gunicorn with the configuration of the project in a subprocess
+
+    :param server: 'wsgi' or 'asgi', passed as ``WEB_SERVER``
+    :type server: str
+    :param port: Port to listen on, on the loopback interface
+    :type port: int
+    :param workers: Number of worker processes
+    :type workers: int
+
+    :return: Context manager yielding the URL of the server and stopping it on exit
+    :raises RuntimeError: If the server does not start within 30 seconds
+    """
+    env = dict(os.environ, WEB_SERVER=server, WEB_CONCURRENCY=str(workers),
+               WEB_BIND=f'127.0.0.1:{port}', WEB_MAX_REQUESTS='0')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', str(settings.BASE_DIR / 'gunicorn.conf.py')],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f'Gunicorn exited with status {process.returncode}.')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError('Gunicorn did not start within 30 seconds.')
+                time.sleep(0.2)
+        yield f'http://127.0.0.1:{port}'
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def server_concurrency(data, levels=(1, 10, 50), requests=500, servers=('wsgi', 'asgi'), port=8765):
+    """
+    Compares how a single Gunicorn worker process scales with the number of concurrent clients
+    when serving the read views over WSGI (threads) and over ASGI (event loop)
+
+    Every server is started with :func:`gunicorn` and driven by :func:`http_load` at each
+    concurrency level, with the clients logged in as a spare profile of the data set
+
+    :param data: The data set returned by :func:`seed`
+    :type data: dict
+    :param levels: Numbers of concurrent clients
+    :type levels: tuple
+    :param requests: Number of requests at each level
+    :type requests: int
+    :param servers: Values of ``WEB_SERVER`` to compare
+    :type servers: tuple
+    :param port: Port the servers listen on
+    :type port: int
+
+    :return: Dictionary mapping '<server>@<level>' to the summaries, as returned by :func:`summarize`
+    :rtype: dict
+    """
+    username = User.objects.get(userprofile=data['actors'][0][0]).username
+    paths = [reverse('home'), reverse('queues'), reverse('queue', args=[data['queues'][0][0]]), reverse('profile')]
+    results = {}
+    for server in servers:
+        with gunicorn(server, port) as url:
+            for level in levels:
+                results[f'{server}@{level}'] = http_load(
+                    url, paths, requests, level, (reverse('login'), username, data['password']))
+    return results
@@ -0,0 +1,211 @@
+import asyncio
+import os
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core import checks
+from django.utils.module_loading import import_string
+
+
+class Subscription:
+    """
+    A subscriber's mailbox for the messages of a single channel.
+
+    Messages are delivered into an :class:`asyncio.Queue` owned by the event loop that created
+    the subscription, so it can be published to from any thread. A subscriber that falls more
+    than ``max_pending`` messages behind gets a single ``{'type': 'resync'}`` message instead of
+    the ones it missed, and is expected to reload the full state.
+    """
+    def __init__(self, hub, channel, max_pending):
+        """
+        Initialize the subscription. Must be called from a running event loop.
+
+        :param hub: The broadcast backend the subscription belongs to.
+        :type hub: app_queue.broadcast.LocalBroadcast
+        :param channel: The channel the subscription listens to.
+        :type channel: hashable
+        :param max_pending: Maximum number of undelivered messages.
+        :type max_pending: int
+        """
+        self.hub = hub
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.messages = asyncio.Queue(maxsize=max_pending)
+
+    def push(self, message):
+        """
+        Deliver a message to the subscriber. Safe to call from any thread.
+
+        :param message: The message to deliver.
+        :type message: dict
+        """
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # The event loop of the subscriber has been closed
+            self.close()
+
+    def _put(self, message):
+        try:
+            self.messages.put_nowait(message)
+        except asyncio.QueueFull:
+            while not self.messages.empty():
+                self.messages.get_nowait()
+            self.messages.put_nowait({'type': 'resync'})
+
+    async def get(self, timeout=None):
+        """
+        Wait for the next message.
+
+        :param timeout: Seconds to wait before giving up, or None to wait forever.
+        :type timeout: float or None
+        :return: The next message, or None if the timeout expired.
+        :rtype: dict or None
+        """
+        try:
+            return await asyncio.wait_for(self.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        """
+        Stop receiving messages.
+        """
+        self.hub.unsubscribe(self)
+
+
+class LocalBroadcast:
+    """
+    In-process publish/subscribe backend.
+
+    Subscribers only receive messages published by the same process, which is sufficient when
+    every worker serves its own connections and all mutations of a queue go through one process,
+    e.g. a single ASGI worker. No external broker is needed.
+
+    With several worker processes the pages would miss the changes made through the other
+    workers, so :func:`live_updates_available` turns the streams off in that case.
+    """
+    #: Whether subscribers only receive the messages published by their own process
+    process_local = True
+
+    def __init__(self, max_pending=100):
+        """
+        Initialize the backend.
+
+        :param max_pending: Maximum number of undelivered messages per subscriber.
+        :type max_pending: int
+        """
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+
+    def subscribe(self, channel):
+        """
+        Subscribe to a channel. Must be called from a running event loop.
+
+        :param channel: The channel to listen to.
+        :type channel: hashable
+        :return: The new subscription.
+        :rtype: app_queue.broadcast.Subscription
+        """
+        subscription = Subscription(self, channel, self.max_pending)
+        with self.lock:
+            self.subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Remove a subscription.
+
+        :param subscription: The subscription to remove.
+        :type subscription: app_queue.broadcast.Subscription
+        """
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.channel]
+
+    def publish(self, channel, message):
+        """
+        Send a message to every subscriber of a channel.
+
+        :param channel: The channel to publish to.
+        :type channel: hashable
+        :param message: The message to send.
+        :type message: dict
+        """
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.push(message)
+
+    def count(self, channel=None):
+        """
+        Count the subscribers of a channel, or of all channels.
+
+        :param channel: The channel, or None for all channels.
+        :type channel: hashable
+        :return: The number of subscribers.
+        :rtype: int
+        """
+        with self.lock:
+            if channel is not None:
+                return len(self.subscribers.get(channel, ()))
+            return sum(len(subscribers) for subscribers in self.subscribers.values())
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_broadcast():
+    """
+    Return the broadcast backend configured by the ``QUEUE_BROADCAST_BACKEND`` setting.
+
+    The backend is created once per process.
+
+    :return: The broadcast backend.
+    :rtype: app_queue.broadcast.LocalBroadcast
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend = getattr(settings, 'QUEUE_BROADCAST_BACKEND', 'app_queue.broadcast.LocalBroadcast')
+                _backend = import_string(backend)()
+    return _backend
+
+
+def live_updates_available():
+    """
+    Return whether the event streams reach the changes made by every worker process.
+
+    This is the case with a broadcast backend shared between processes, or with a process-local
+    one when ``WEB_WORKERS`` is 1.
+
+    :return: True if the queue pages may rely on the event streams.
+    :rtype: bool
+    """
+    return not getattr(get_broadcast(), 'process_local', False) or settings.WEB_WORKERS <= 1
+
+
+@checks.register(checks.Tags.compatibility)
+def check_live_updates(app_configs, **kwargs):
+    """
+    Warn when ASGI workers would stream changes through a process-local broadcast backend.
+
+    :return: The warnings.
+    :rtype: list
+    """
+    if os.environ.get('WEB_SERVER') != 'asgi' or live_updates_available():
+        return []
+    return [checks.Warning(
+        f'{settings.QUEUE_BROADCAST_BACKEND} only reaches the event streams of its own process, '
+        f'but WEB_WORKERS is {settings.WEB_WORKERS}.',
+        hint='The queue pages poll for changes instead. Run a single worker or configure a '
+             'shared QUEUE_BROADCAST_BACKEND to stream them.',
+        id='app_queue.W001',
+    )]
@@ -0,0 +1,465 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.utils.module_loading import import_string
+
+
+SnapshotEntry = namedtuple('SnapshotEntry', ['position', 'user_id', 'name'])
+SnapshotEntry.__doc__ = """
+An entry of a queue snapshot: the 1-based position, the user profile ID and the display name
+"""
+
+QueueSnapshot = namedtuple('QueueSnapshot', ['version', 'entries'])
+QueueSnapshot.__doc__ = """
+The state of a queue at a given version: its entries ordered by position, or None in the
+stale marker stored by :meth:`SnapshotCache.invalidate`
+"""
+
+
+def _queues_generation_key(group_id):
+    return f'app_queue:queues:{group_id}:generation'
+
+
+def _queues_page_key(group_id, cursor, generation=None):
+    if generation is None:
+        generation = cache.get(_queues_generation_key(group_id), 0)
+    return f'app_queue:queues:{group_id}:{generation}:{cursor or ""}'
+
+
+def get_queues_page(group_id, cursor, build):
+    """
+    Returns a page of the queue listing of a group, from the cache when possible
+
+    Caching is enabled by a positive ``QUEUES_LIST_CACHE_TIMEOUT`` setting (in seconds).
+    Cached pages are keyed by the group's generation, which :func:`invalidate_queues`
+    advances, so a new queue never shows up late on a page built before it
+
+    :param group_id: ID of the group the listing belongs to
+    :type group_id: int
+    :param cursor: Cursor of the requested page, or None for the first page
+    :type cursor: str or None
+    :param build: Callable building the page when it is not cached
+    :type build: callable
+
+    :return: The page as returned by ``build``
+    """
+    timeout = getattr(settings, 'QUEUES_LIST_CACHE_TIMEOUT', 0)
+    if not timeout:
+        return build()
+    return cache.get_or_set(_queues_page_key(group_id, cursor), build, timeout)
+
+
+async def aget_queues_page(group_id, cursor, build):
+    """
+    Asynchronous version of :func:`get_queues_page`
+
+    :param group_id: ID of the group the listing belongs to
+    :type group_id: int
+    :param cursor: Cursor of the requested page, or None for the first page
+    :type cursor: str or None
+    :param build: Coroutine function building the page when it is not cached
+    :type build: callable
+
+    :return: The page as returned by ``build``
+    """
+    timeout = getattr(settings, 'QUEUES_LIST_CACHE_TIMEOUT', 0)
+    if not timeout:
+        return await build()
+    generation = await cache.aget(_queues_generation_key(group_id), 0)
+    key = _queues_page_key(group_id, cursor, generation)
+    page = await cache.aget(key)
+    if page is None:
+        page = await build()
+        await cache.aset(key, page, timeout)
+    return page
+
+
+def invalidate_queues(group_id):
+    """
+    Drops every cached page of the queue listing of a group
+
+    :param group_id: ID of the group whose listing changed
+    :type group_id: int
+    """
+    key = _queues_generation_key(group_id)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def _profile_key(user_id):
+    return f'app_queue:profile:{user_id}'
+
+
+def get_profile(user_id, build):
+    """
+    Returns the profile of a user, from the cache when possible
+
+    Caching is enabled by a positive ``PROFILE_CACHE_TIMEOUT`` setting (in seconds).
+    Cached profiles are dropped by :func:`invalidate_profile` whenever they are saved
+
+    :param user_id: ID of the user
+    :type user_id: int
+    :param build: Callable reading the profile when it is not cached
+    :type build: callable
+
+    :return: The profile as returned by ``build``
+    """
+    timeout = getattr(settings, 'PROFILE_CACHE_TIMEOUT', 0)
+    if not timeout:
+        return build()
+    return cache.get_or_set(_profile_key(user_id), build, timeout)
+
+
+async def aget_profile(user_id, build):
+    """
+    Asynchronous version of :func:`get_profile`
+
+    :param user_id: ID of the user
+    :type user_id: int
+    :param build: Coroutine function reading the profile when it is not cached
+    :type build: callable
+
+    :return: The profile as returned by ``build``
+    """
+    timeout = getattr(settings, 'PROFILE_CACHE_TIMEOUT', 0)
+    if not timeout:
+        return await build()
+    profile = await cache.aget(_profile_key(user_id))
+    if profile is None:
+        profile = await build()
+        if profile is not None:
+            await cache.aset(_profile_key(user_id), profile, timeout)
+    return profile
+
+
+def invalidate_profile(user_id):
+    """
+    Drops the cached profile of a user
+
+    :param user_id: ID of the user whose profile changed
+    :type user_id: int
+    """
+    cache.delete(_profile_key(user_id))
+
+
+class LocMemSnapshotBackend:
+    """
+    Snapshot backend keeping the snapshots in the memory of the process
+
+    Holds at most ``max_entries`` snapshots and evicts the least recently used one beyond that.
+    Other processes do not see its writes, so with several worker processes ``timeout`` bounds
+    how long a change made by another process can be missed
+    """
+    def __init__(self, max_entries=1000, timeout=None):
+        """
+        Initializes the backend
+
+        :param max_entries: Maximum number of cached snapshots
+        :type max_entries: int
+        :param timeout: Lifetime of the snapshots in seconds, or None to keep them until evicted
+        :type timeout: float or None
+        """
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.snapshots = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, queue_id):
+        """
+        Returns the stored snapshot of a queue
+
+        :param queue_id: ID of the queue
+        :type queue_id: int
+
+        :return: The snapshot, or None if it is not stored
+        :rtype: app_queue.caching.QueueSnapshot or None
+        """
+        with self.lock:
+            stored = self.snapshots.get(queue_id)
+            if stored is None:
+                return None
+            expires, snapshot = stored
+            if expires is not None and expires < time.monotonic():
+                del self.snapshots[queue_id]
+                return None
+            self.snapshots.move_to_end(queue_id)
+            return snapshot
+
+    def set(self, queue_id, snapshot):
+        """
+        Stores the snapshot of a queue, unless a newer version is already stored
+
+        :param queue_id: ID of the queue
+        :type queue_id: int
+        :param snapshot: The snapshot to store
+        :type snapshot: app_queue.caching.QueueSnapshot
+        """
+        expires = time.monotonic() + self.timeout if self.timeout is not None else None
+        with self.lock:
+            stored = self.snapshots.get(queue_id)
+            if stored is not None and stored[1].version > snapshot.version:
+                return
+            self.snapshots[queue_id] = (expires, snapshot)
+            self.snapshots.move_to_end(queue_id)
+            while len(self.snapshots) > self.max_entries:
+                self.snapshots.popitem(last=False)
+                self.evictions += 1
+
+    async def aget(self, queue_id):
+        """
+        Asynchronous version of :meth:`get`, which never blocks since the snapshots are in memory
+        """
+        return self.get(queue_id)
+
+    async def aset(self, queue_id, snapshot):
+        """
+        Asynchronous version of :meth:`set`, which never blocks since the snapshots are in memory
+        """
+        self.set(queue_id, snapshot)
+
+    def clear(self):
+        """
+        Drops every stored snapshot
+        """
+        with self.lock:
+            self.snapshots.clear()
+
+
+class DjangoCacheSnapshotBackend:
+    """
+    Snapshot backend storing the snapshots in one of the caches configured in ``CACHES``
+
+    Eviction is left to the cache itself, which does not report it, so the evictions are not
+    counted; the file cache used in production culls a fraction of its entries when it is full
+    rather than the least recently used ones. A snapshot older than the cached one is not
+    stored, although two processes writing the same queue at the same moment may still race
+    """
+    def __init__(self, alias='default', timeout=None, key_prefix='app_queue:snapshot'):
+        """
+        Initializes the backend
+
+        :param alias: Alias of the cache in ``CACHES``
+        :type alias: str
+        :param timeout: Lifetime of the snapshots in seconds, or None to keep them until evicted
+        :type timeout: int or None
+        :param key_prefix: Prefix of the cache keys
+        :type key_prefix: str
+        """
+        self.cache = caches[alias]
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+        #: The evictions are not counted by this backend
+        self.evictions = None
+
+    def key(self, queue_id):
+        """
+        Returns the cache key of the snapshot of a queue
+
+        :param queue_id: ID of the queue
+        :type queue_id: int
+
+        :return: The cache key
+        :rtype: str
+        """
+        return f'{self.key_prefix}:{queue_id}'
+
+    def get(self, queue_id):
+        """
+        Returns the stored snapshot of a queue
+
+        :param queue_id: ID of the queue
+        :type queue_id: int
+
+        :return: The snapshot, or None if it is not stored
+        :rtype: app_queue.caching.QueueSnapshot or None
+        """
+        return self.cache.get(self.key(queue_id))
+
+    def set(self, queue_id, snapshot):
+        """
+        Stores the snapshot of a queue, unless a newer version is already stored
+
+        :param queue_id: ID of the queue
+        :type queue_id: int
+        :param snapshot: The snapshot to store
+        :type snapshot: app_queue.caching.QueueSnapshot
+        """
+        current = self.cache.get(self.key(queue_id))
+        if current is not None and current.version > snapshot.version:
+            return
+        self.cache.set(self.key(queue_id), snapshot, self.timeout)
+
+    async def aget(self, queue_id):
+        """
+        Asynchronous version of :meth:`get`, using the async interface of the cache
+        """
+        return await self.cache.aget(self.key(queue_id))
+
+    async def aset(self, queue_id, snapshot):
+        """
+        Asynchronous version of :meth:`set`, using the async interface of the cache
+        """
+        current = await self.cache.aget(self.key(queue_id))
+        if current is not None and current.version > snapshot.version:
+            return
+        await self.cache.aset(self.key(queue_id), snapshot, self.timeout)
+
+    def clear(self):
+        """
+        Drops every snapshot by clearing the whole underlying cache
+        """
+        self.cache.clear()
+
+
+class SnapshotCache:
+    """
+    Cache of queue snapshots counting its hits and misses
+
+    Whenever a queue changes, :mod:`app_queue.services` replaces its snapshot by a stale marker
+    holding the new version and no entries, then writes the new snapshot through once it is
+    read. A marker counts as a miss, and the backends refuse to store a snapshot older than
+    what they hold, so a snapshot read before the change can never replace the marker and be
+    served after it
+    """
+    def __init__(self, backend):
+        """
+        Initializes the cache
+
+        :param backend: The backend storing the snapshots
+        :type backend: app_queue.caching.LocMemSnapshotBackend or app_queue.caching.DjangoCacheSnapshotBackend
+        """
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, queue_id):
+        """
+        Returns the cached snapshot of a queue
+
+        :param queue_id: ID of the queue
+        :type queue_id: int
+
+        :return: The snapshot, or None if it is not cached
+        :rtype: app_queue.caching.QueueSnapshot or None
+        """
+        snapshot = self.backend.get(queue_id)
+        if snapshot is not None and snapshot.entries is None:
+            snapshot = None
+        self.record_lookup(snapshot)
+        return snapshot
+
+    def set(self, queue_id, snapshot):
+        """
+        Stores the snapshot of a queue, unless a newer version is already cached
+
+        :param queue_id: ID of the queue
+        :type queue_id: int
+        :param snapshot: The snapshot to store
+        :type snapshot: app_queue.caching.QueueSnapshot
+        """
+        self.backend.set(queue_id, snapshot)
+
+    def invalidate(self, queue_id, version):
+        """
+        Marks the cached snapshot of a queue as stale, up to the given version
+
+        :param queue_id: ID of the queue
+        :type queue_id: int
+        :param version: Version of the queue after its change
+        :type version: int
+        """
+        self.backend.set(queue_id, QueueSnapshot(version, None))
+
+    def record_lookup(self, snapshot):
+        """
+        Counts a lookup as a hit or a miss
+
+        :param snapshot: The snapshot found, or None
+        :type snapshot: app_queue.caching.QueueSnapshot or None
+        """
+        with self.lock:
+            if snapshot is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+    async def aget(self, queue_id):
+        """
+        Asynchronous version of :meth:`get`
+
+        :param queue_id: ID of the queue
+        :type queue_id: int
+
+        :return: The snapshot, or None if it is not cached
+        :rtype: app_queue.caching.QueueSnapshot or None
+        """
+        snapshot = await self.backend.aget(queue_id)
+        if snapshot is not None and snapshot.entries is None:
+            snapshot = None
+        self.record_lookup(snapshot)
+        return snapshot
+
+    async def aset(self, queue_id, snapshot):
+        """
+        Asynchronous version of :meth:`set`
+
+        :param queue_id: ID of the queue
+        :type queue_id: int
+        :param snapshot: The snapshot to store
+        :type snapshot: app_queue.caching.QueueSnapshot
+        """
+        await self.backend.aset(queue_id, snapshot)
+
+    def clear(self):
+        """
+        Drops every cached snapshot and resets the counters
+        """
+        self.backend.clear()
+        with self.lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """
+        Returns the counters of the cache
+
+        :return: Dictionary with the 'hits' and 'misses' counters, and the 'evictions' counter
+                 if the backend counts them
+        :rtype: dict
+        """
+        with self.lock:
+            stats = {'hits': self.hits, 'misses': self.misses}
+        if self.backend.evictions is not None:
+            stats['evictions'] = self.backend.evictions
+        return stats
+
+
+_snapshot_cache = None
+_snapshot_cache_lock = threading.Lock()
+
+
+def get_snapshot_cache():
+    """
+    Returns the snapshot cache configured by the ``QUEUE_SNAPSHOT_CACHE`` setting
+
+    The setting is a dictionary with the dotted path of the backend class in 'BACKEND' and
+    its keyword arguments in 'OPTIONS'. The cache is created once per process
+
+    :return: The snapshot cache
+    :rtype: app_queue.caching.SnapshotCache
+    """
+    global _snapshot_cache
+    if _snapshot_cache is None:
+        with _snapshot_cache_lock:
+            if _snapshot_cache is None:
+                config = getattr(settings, 'QUEUE_SNAPSHOT_CACHE', {})
+                backend = import_string(config.get('BACKEND', 'app_queue.caching.LocMemSnapshotBackend'))
+                _snapshot_cache = SnapshotCache(backend(**config.get('OPTIONS', {})))
+    return _snapshot_cache
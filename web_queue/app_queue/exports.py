@@ -0,0 +1,174 @@
+import csv
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+from .models import Queue, QueueEvent
+
+# Columns of the exported data sets
+RECORD_COLUMNS = ['queue_id', 'queue_name', 'place', 'position', 'user_id', 'first_name', 'last_name']
+EVENT_COLUMNS = ['queue_id', 'event_id', 'kind', 'user_id', 'position', 'created_at']
+
+
+def records(queues, chunk_size=2000):
+    """
+    Reads the records of queues in order, ``chunk_size`` rows at a time
+
+    :param queues: IDs of the queues, as a list or as a query returning them
+    :type queues: list or django.db.models.QuerySet
+    :param chunk_size: Number of rows fetched from the database at a time
+    :type chunk_size: int
+
+    :return: Rows of :data:`RECORD_COLUMNS`, the place counting from 1 in every queue
+    :rtype: collections.abc.Iterator
+    """
+    rows = (Queue.objects.filter(queue__in=queues).order_by('queue', 'position', 'pk')
+            .values_list('queue_id', 'queue__name', 'position', 'user_id', 'user__first_name', 'user__last_name'))
+    current, place = None, 0
+    for queue_id, queue_name, position, user_id, first_name, last_name in rows.iterator(chunk_size=chunk_size):
+        place = place + 1 if queue_id == current else 1
+        current = queue_id
+        yield queue_id, queue_name, place, position, user_id, first_name, last_name
+
+
+def events(queues, chunk_size=2000):
+    """
+    Reads the event logs of queues in order, ``chunk_size`` rows at a time
+
+    :param queues: IDs of the queues, as a list or as a query returning them
+    :type queues: list or django.db.models.QuerySet
+    :param chunk_size: Number of rows fetched from the database at a time
+    :type chunk_size: int
+
+    :return: Rows of :data:`EVENT_COLUMNS`
+    :rtype: collections.abc.Iterator
+    """
+    rows = (QueueEvent.objects.filter(queue__in=queues).order_by('queue', 'pk')
+            .values_list('queue_id', 'pk', 'kind', 'user_id', 'position', 'created_at'))
+    return rows.iterator(chunk_size=chunk_size)
+
+
+class _Line:
+    """
+    File-like object returning what is written to it, letting :mod:`csv` format single rows
+    """
+    def write(self, value):
+        return value
+
+
+def to_csv(columns, rows, batch=500):
+    """
+    Formats rows as CSV, with a header line
+
+    :param columns: Names of the columns
+    :type columns: list
+    :param rows: The rows
+    :type rows: collections.abc.Iterable
+    :param batch: Number of rows joined into each returned chunk
+    :type batch: int
+
+    :return: Chunks of the CSV document
+    :rtype: collections.abc.Iterator
+    """
+    writer = csv.writer(_Line())
+    chunk = [writer.writerow(columns)]
+    for row in rows:
+        chunk.append(writer.writerow(row))
+        if len(chunk) >= batch:
+            yield ''.join(chunk)
+            chunk = []
+    yield ''.join(chunk)
+
+
+def to_json(columns, rows, batch=500):
+    """
+    Formats rows as a JSON array of objects keyed by the column names
+
+    :param columns: Names of the columns
+    :type columns: list
+    :param rows: The rows
+    :type rows: collections.abc.Iterable
+    :param batch: Number of rows joined into each returned chunk
+    :type batch: int
+
+    :return: Chunks of the JSON document
+    :rtype: collections.abc.Iterator
+    """
+    encoder = DjangoJSONEncoder()
+    chunk, separator = ['['], '\n'
+    for row in rows:
+        chunk.append(separator + encoder.encode(dict(zip(columns, row))))
+        separator = ',\n'
+        if len(chunk) >= batch:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append('\n]\n')
+    yield ''.join(chunk)
+
+
+# Export data sets and formats, by name
+DATA_SETS = {'records': (RECORD_COLUMNS, records), 'events': (EVENT_COLUMNS, events)}
+FORMATS = {'csv': (to_csv, 'text/csv'), 'json': (to_json, 'application/json')}
+
+
+def export(queues, data='records', fmt='csv', chunk_size=2000):
+    """
+    Exports a data set of queues, reading and formatting it a chunk at a time
+
+    :param queues: IDs of the queues, as a list or as a query returning them
+    :type queues: list or django.db.models.QuerySet
+    :param data: Name of the data set, a key of :data:`DATA_SETS`
+    :type data: str
+    :param fmt: Name of the format, a key of :data:`FORMATS`
+    :type fmt: str
+    :param chunk_size: Number of rows fetched from the database at a time
+    :type chunk_size: int
+
+    :return: Chunks of the document
+    :rtype: collections.abc.Iterator
+    """
+    columns, read = DATA_SETS[data]
+    return FORMATS[fmt][0](columns, read(queues, chunk_size))
+
+
+async def _aiterate(chunks):
+    """
+    Iterates a synchronous iterator from an event loop, producing each chunk in a thread
+
+    :param chunks: The iterator, which reads the database
+    :type chunks: collections.abc.Iterator
+
+    :return: The chunks
+    :rtype: collections.abc.AsyncIterator
+    """
+    done = object()
+    next_chunk = sync_to_async(next)
+    while (chunk := await next_chunk(chunks, done)) is not done:
+        yield chunk
+
+
+def streaming_response(request, chunks, fmt, filename):
+    """
+    Builds the response streaming an export as an attachment
+
+    The response iterates the export the way the server consumes it (asynchronously under
+    ASGI), since Django otherwise reads a whole iterator of the other kind into memory first
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+    :param chunks: Chunks of the document, as returned by :func:`export`
+    :type chunks: collections.abc.Iterator
+    :param fmt: Name of the format, a key of :data:`FORMATS`
+    :type fmt: str
+    :param filename: Name of the downloaded file, without the extension
+    :type filename: str
+
+    :return: The streaming response
+    :rtype: django.http.StreamingHttpResponse
+    """
+    if hasattr(request, 'scope'):
+        chunks = _aiterate(chunks)
+    return StreamingHttpResponse(chunks, content_type=FORMATS[fmt][1], headers={
+        'Content-Disposition': f'attachment; filename="{filename}.{fmt}"',
+    })
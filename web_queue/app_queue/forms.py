@@ -1,8 +1,49 @@
 from django import forms
 from django.contrib.auth.models import User
+from django.urls import reverse_lazy
 from .models import UserProfile, StudyGroup, Queues
 
 
+class GroupSelect(forms.Select):
+    """
+    Select widget for study groups rendering only the chosen group instead of every group
+
+    The other groups are found by the group picker script of the templates through the
+    'search_groups' view, whose URL is given in the ``data-search-url`` attribute
+    """
+    def __init__(self, attrs=None):
+        """
+        Initializes the GroupSelect instance
+
+        :param attrs: HTML attributes of the select element
+        :type attrs: dict or None
+        """
+        super().__init__({'data-search-url': reverse_lazy('search_groups'), **(attrs or {})})
+
+    def optgroups(self, name, value, attrs=None):
+        """
+        Returns the options of the select: the empty option and the chosen group, if any
+
+        :param name: Name of the field
+        :type name: str
+        :param value: Values of the field
+        :type value: list
+        :param attrs: HTML attributes of the options
+        :type attrs: dict or None
+
+        :return: The option groups, as expected by the select template
+        :rtype: list
+        """
+        chosen = [v for v in value if str(v).isdigit()]
+        options = [('', self.choices.field.empty_label or '')]
+        if chosen:
+            options += [(group.pk, str(group)) for group in self.choices.queryset.filter(pk__in=chosen)]
+        return [
+            (None, [self.create_option(name, option_value, label, str(option_value) in value, index, attrs=attrs)], index)
+            for index, (option_value, label) in enumerate(options)
+        ]
+
+
 class UserRegistrationForm(forms.ModelForm):
     """
     Form for user registration.
@@ -27,6 +68,22 @@ class UserRegistrationForm(forms.ModelForm):
         model = User
         fields = ['username', 'email', 'password']
 
+    def save(self, commit=True):
+        """
+        Saves the user with the hash of the password, with a single INSERT
+
+        :param commit: Whether to save the user to the database
+        :type commit: bool
+
+        :return: The user
+        :rtype: django.contrib.auth.models.User
+        """
+        user = super().save(commit=False)
+        user.set_password(self.cleaned_data['password'])
+        if commit:
+            user.save()
+        return user
+
 
 class UserProfileForm(forms.ModelForm):
     """
@@ -55,6 +112,7 @@ class UserProfileForm(forms.ModelForm):
         """
         model = UserProfile
         fields = ['group', 'new_group_name', 'first_name', 'last_name']
+        widgets = {'group': GroupSelect}
 
     def __init__(self, *args, **kwargs):
         """
@@ -98,7 +156,10 @@ class UserProfileForm(forms.ModelForm):
         new_group_name = self.cleaned_data.get('new_group_name')
 
         if new_group_name:
-            group, created = StudyGroup.objects.get_or_create(name=new_group_name)
+            # The lookup and the insert are backed by the unique index on name_key, so names
+            # differing only in case or spacing share a group, even when registered concurrently
+            group, created = StudyGroup.objects.get_or_create(
+                name_key=StudyGroup.normalize(new_group_name), defaults={'name': new_group_name})
             instance.group = group
 
         if commit:
@@ -137,3 +198,4 @@ class QueuesForm(forms.ModelForm):
         """
         model = Queues
         fields = ['name', 'group', 'description']
+        widgets = {'group': GroupSelect}
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    The PBKDF2 hasher of Django, with the number of iterations set by ``PASSWORD_PBKDF2_ITERATIONS``
+    (0 keeps the default of Django)
+
+    Hashes made with another number of iterations are still accepted and rehashed when
+    their user logs in
+    """
+    @property
+    def iterations(self):
+        """
+        Number of iterations of new hashes
+        """
+        return settings.PASSWORD_PBKDF2_ITERATIONS or hashers.PBKDF2PasswordHasher.iterations
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """
+    The Argon2 hasher of Django, with the costs set by ``PASSWORD_ARGON2_TIME_COST``,
+    ``PASSWORD_ARGON2_MEMORY_COST`` (in KiB) and ``PASSWORD_ARGON2_PARALLELISM``. It needs
+    the argon2-cffi package
+
+    Hashes made with other costs are still accepted and rehashed when their user logs in
+    """
+    @property
+    def time_cost(self):
+        """
+        Number of passes over the memory
+        """
+        return settings.PASSWORD_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        """
+        Memory used by a hash, in KiB
+        """
+        return settings.PASSWORD_ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        """
+        Number of lanes of a hash
+        """
+        return settings.PASSWORD_ARGON2_PARALLELISM
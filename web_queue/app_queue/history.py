@@ -0,0 +1,156 @@
+from django.utils import timezone
+
+from .models import QueueCheckpoint, QueueEvent
+
+
+def record(queue_id, kind, changes=((None, None),), at=None):
+    """
+    Appends events to the log of a queue with a single INSERT
+
+    Called by :mod:`app_queue.services` in the transaction of the change, while the queue is
+    locked, so the events are committed or rolled back together with the change
+
+    :param queue_id: ID of the changed queue
+    :type queue_id: int
+    :param kind: Kind of the change, one of :class:`app_queue.models.QueueEvent.Kind`
+    :type kind: str
+    :param changes: Pairs of the user ID and the position of each event
+    :type changes: collections.abc.Iterable
+    :param at: Time of the change, the current time by default
+    :type at: datetime.datetime or None
+
+    :return: The time of the events
+    :rtype: datetime.datetime
+    """
+    at = at or timezone.now()
+    QueueEvent.objects.bulk_create([
+        QueueEvent(queue_id=queue_id, user_id=user_id, kind=kind, position=position, created_at=at)
+        for user_id, position in changes
+    ])
+    return at
+
+
+class QueueHistory:
+    """
+    State of a queue rebuilt from its events, with statistics of the waits
+
+    Every entry maps a user ID to the position of the user, the time they joined (as a UNIX
+    timestamp) and the ID of the event that added them, which orders users on the same
+    position the way the queue does. A user moved within the queue keeps the time they joined.
+    The statistics count the events by kind and sum up the time users spent in the queue
+    until they were removed, in seconds
+    """
+    def __init__(self, entries=None, stats=None):
+        """
+        Initializes the history
+
+        :param entries: Entries of the users in the queue
+        :type entries: dict or None
+        :param stats: Statistics of the events
+        :type stats: dict or None
+        """
+        self.entries = entries or {}
+        self.stats = {'enqueued': 0, 'removed': 0, 'requeued': 0, 'total_wait': 0.0, 'max_wait': 0.0, **(stats or {})}
+
+    def apply(self, event_id, kind, user_id, position, created_at):
+        """
+        Applies an event to the state and the statistics
+
+        :param event_id: ID of the event
+        :type event_id: int
+        :param kind: Kind of the event
+        :type kind: str
+        :param user_id: ID of the user profile of the event, or None
+        :type user_id: int or None
+        :param position: Position given by the event, or None
+        :type position: int or None
+        :param created_at: Time of the event
+        :type created_at: datetime.datetime
+        """
+        if kind == QueueEvent.Kind.ENQUEUED:
+            self.entries[user_id] = [position, created_at.timestamp(), event_id]
+            self.stats['enqueued'] += 1
+        elif kind == QueueEvent.Kind.REQUEUED:
+            if user_id in self.entries:
+                self.entries[user_id][0] = position
+                self.stats['requeued'] += 1
+        elif kind == QueueEvent.Kind.REMOVED:
+            entry = self.entries.pop(user_id, None)
+            if entry is not None:
+                wait = created_at.timestamp() - entry[1]
+                self.stats['removed'] += 1
+                self.stats['total_wait'] += wait
+                self.stats['max_wait'] = max(self.stats['max_wait'], wait)
+        elif kind == QueueEvent.Kind.COMPACTED:
+            for n, user_id in enumerate(self.order()):
+                self.entries[user_id][0] = n * position
+
+    def order(self):
+        """
+        Returns the users in the queue in order
+
+        :return: IDs of the user profiles, from the head of the queue
+        :rtype: list
+        """
+        return sorted(self.entries, key=lambda user_id: (self.entries[user_id][0], self.entries[user_id][2]))
+
+    @property
+    def mean_wait(self):
+        """
+        Mean time in seconds the removed users spent in the queue, 0 if nobody was removed
+        """
+        return self.stats['total_wait'] / self.stats['removed'] if self.stats['removed'] else 0.0
+
+    def to_json(self):
+        """
+        Returns the history as a JSON-serializable dictionary
+
+        :return: Dictionary with the 'entries' and the 'stats'
+        :rtype: dict
+        """
+        return {'entries': {str(user_id): entry for user_id, entry in self.entries.items()}, 'stats': self.stats}
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Creates a history from a dictionary returned by :meth:`to_json`
+
+        :param data: The dictionary
+        :type data: dict
+
+        :return: The history
+        :rtype: app_queue.history.QueueHistory
+        """
+        return cls({int(user_id): entry for user_id, entry in data.get('entries', {}).items()}, data.get('stats'))
+
+
+def replay(queue_id, checkpoint=True, chunk_size=2000):
+    """
+    Rebuilds the state and the statistics of a queue from its events
+
+    The replay starts from the checkpoint of the queue and reads only the newer events,
+    ``chunk_size`` at a time. Neither reads the ``Queue`` table
+
+    :param queue_id: ID of the queue
+    :type queue_id: int
+    :param checkpoint: Whether to save the result as the new checkpoint of the queue
+    :type checkpoint: bool
+    :param chunk_size: Number of events read at a time
+    :type chunk_size: int
+
+    :return: The history of the queue
+    :rtype: app_queue.history.QueueHistory
+    """
+    saved = QueueCheckpoint.objects.filter(queue_id=queue_id).first()
+    history = QueueHistory.from_json(saved.state) if saved else QueueHistory()
+    start = last = saved.event_id if saved else 0
+
+    events = (QueueEvent.objects.filter(queue_id=queue_id, pk__gt=start).order_by('pk')
+              .values_list('pk', 'kind', 'user_id', 'position', 'created_at'))
+    for event in events.iterator(chunk_size=chunk_size):
+        history.apply(*event)
+        last = event[0]
+
+    if checkpoint and last > start:
+        QueueCheckpoint.objects.update_or_create(queue_id=queue_id, defaults={'event_id': last, 'state': history.to_json()})
+    return history
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from app_queue import analytics
+
+
+class Command(BaseCommand):
+    """
+    Management command rebuilding the wait-time rollups of :mod:`app_queue.analytics` from the
+    event logs, meant to be run once after migrating, or to repair the rollups
+
+    The events are streamed in batches, so the memory used does not depend on the size of the logs
+    """
+    help = 'Rebuilds the hourly wait-time rollups of queues and study groups from the queue event logs.'
+
+    def add_arguments(self, parser):
+        """
+        Adds the command line arguments
+
+        :param parser: The argument parser of the command
+        :type parser: argparse.ArgumentParser
+        """
+        parser.add_argument('--group', type=int, action='append', dest='groups',
+                            help='Study group whose queues are rebuilt (repeatable, every queue by default).')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Number of events read, and of rollups inserted, at a time.')
+
+    def handle(self, *args, **options):
+        """
+        Rebuilds the rollups of the selected queues
+
+        :param options: Parsed command line options
+        :type options: dict
+        """
+        read, written = analytics.backfill(options['groups'], options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} rollup(s) from {read} event(s).'))
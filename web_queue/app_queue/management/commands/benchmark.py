@@ -0,0 +1,110 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings
+
+from app_queue import benchmarks
+
+
+class Command(BaseCommand):
+    """
+    Management command running the in-process benchmarks of :mod:`app_queue.benchmarks`
+    against the configured database
+    """
+    help = 'Runs a benchmark against the configured database and prints its results as JSON.'
+
+    def add_arguments(self, parser):
+        """
+        Adds the command line arguments
+
+        :param parser: The argument parser of the command
+        :type parser: argparse.ArgumentParser
+        """
+        parser.add_argument('scenario', choices=['connections', 'views', 'anonymous', 'mixed', 'servers', 'templates', 'auth', 'sessions'], help='Benchmark to run.')
+        parser.add_argument('--iterations', type=int, default=100, help='Number of measured iterations.')
+        parser.add_argument('--database', default='default', help='Alias of the database to use.')
+        parser.add_argument('--groups', type=int, default=2, help='Number of seeded study groups.')
+        parser.add_argument('--profiles', type=int, default=50, help='Number of seeded profiles per group.')
+        parser.add_argument('--queues', type=int, default=10, help='Number of seeded queues per group.')
+        parser.add_argument('--records', type=int, default=20, help='Number of seeded records per queue.')
+        parser.add_argument('--requests', type=int, default=500, help='Total number of requests of the mixed workload, or per level of the servers benchmark.')
+        parser.add_argument('--concurrency', type=int, default=4, help='Number of concurrent clients of the mixed workload.')
+        parser.add_argument('--level', type=int, action='append', dest='levels',
+                            help='Number of concurrent clients of the servers benchmark (repeatable, default 1, 10 and 50).')
+        parser.add_argument('--port', type=int, default=8765, help='Port of the servers started by the servers benchmark.')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded data instead of deleting it.')
+        parser.add_argument('--output', help='File to write the results to, e.g. to be used as a later baseline.')
+        parser.add_argument('--baseline', help='Results of an earlier run to compare with.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed relative growth of the p95 latency compared to the baseline.')
+
+    def handle(self, *args, **options):
+        """
+        Runs the benchmark, prints its results and compares them with the baseline
+
+        :param options: Parsed command line options
+        :type options: dict
+
+        :raises django.core.management.base.CommandError: If the results regress compared to the baseline
+        """
+        scenario = options['scenario']
+        if scenario == 'connections':
+            results = benchmarks.connection_handshake(options['iterations'], options['database'])
+        else:
+            results = {
+                'scenario': scenario,
+                'database': connections['default'].vendor,
+                'parameters': {name: options[name] for name in (
+                    'groups', 'profiles', 'queues', 'records', 'iterations', 'requests', 'concurrency')},
+            }
+            results.update(self.run_workflow(scenario, options))
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                results['regressions'] = benchmarks.compare(results, json.load(f), options['tolerance'])
+
+        output = json.dumps(results, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        if results.get('regressions'):
+            raise CommandError('Regressions compared to the baseline:\n' + '\n'.join(results['regressions']))
+
+    def run_workflow(self, scenario, options):
+        """
+        Seeds the data set and runs the 'views', 'anonymous', 'mixed', 'servers', 'templates',
+        'auth' or 'sessions' benchmark on it
+
+        :param scenario: 'views', 'anonymous', 'mixed', 'servers', 'templates', 'auth' or 'sessions'
+        :type scenario: str
+        :param options: Parsed command line options
+        :type options: dict
+
+        :return: Results of the benchmark
+        :rtype: dict
+        """
+        data = benchmarks.seed(options['groups'], options['profiles'], options['queues'], options['records'])
+        try:
+            if scenario == 'servers':
+                return {'views': benchmarks.server_concurrency(
+                    data, options['levels'] or (1, 10, 50), options['requests'], port=options['port'])}
+            if scenario == 'templates':
+                return {'views': benchmarks.render_latencies(data, options['iterations'])}
+            # The requests are sent by the Django test client, which uses the 'testserver' host
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                if scenario == 'views':
+                    return {'views': benchmarks.view_latencies(data, options['iterations'])}
+                if scenario == 'anonymous':
+                    names = [*benchmarks.READ_PAGES, *(f'{name} (anonymous)' for name in benchmarks.READ_PAGES)]
+                    return {'views': benchmarks.view_latencies(data, options['iterations'], names)}
+                if scenario == 'auth':
+                    return {'views': benchmarks.auth_throughput(data, options['iterations'])}
+                if scenario == 'sessions':
+                    return {'views': benchmarks.session_queries(data, options['iterations'])}
+                return benchmarks.mixed_workload(data, options['requests'], options['concurrency'])
+        finally:
+            if not options['keep']:
+                benchmarks.unseed(data)
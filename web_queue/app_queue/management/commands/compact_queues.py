@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F
+
+from app_queue import services
+from app_queue.models import Queues
+
+
+class Command(BaseCommand):
+    """
+    Management command spreading the positions of sparse queues :data:`app_queue.services.POSITION_GAP`
+    apart again, meant to be run now and then, e.g. nightly from cron
+
+    Each queue is compacted in its own short transaction, so only the queue being compacted
+    is locked at a time
+    """
+    help = 'Renumbers the positions of queues whose tail counter has run far ahead of their length.'
+
+    def add_arguments(self, parser):
+        """
+        Adds the command line arguments
+
+        :param parser: The argument parser of the command
+        :type parser: argparse.ArgumentParser
+        """
+        parser.add_argument('--queue', type=int, action='append', dest='queues',
+                            help='Queue to compact regardless of the threshold (repeatable).')
+        parser.add_argument('--threshold', type=float, default=2.0,
+                            help='Compact queues whose tail counter exceeds their compacted tail this many times.')
+
+    def handle(self, *args, **options):
+        """
+        Compacts the selected queues
+
+        :param options: Parsed command line options
+        :type options: dict
+        """
+        if options['queues']:
+            queue_ids = options['queues']
+        else:
+            queue_ids = list(
+                Queues.objects.annotate(records=Count('queue'))
+                .filter(next_position__gt=(F('records') + 1) * services.POSITION_GAP * options['threshold'])
+                .values_list('pk', flat=True)
+            )
+
+        compacted = 0
+        for queue_id in queue_ids:
+            try:
+                records = services.compact(queue_id)
+            except Queues.DoesNotExist:
+                self.stderr.write(f'Queue {queue_id} does not exist.')
+                continue
+            compacted += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Compacted queue {queue_id} ({records} records).')
+        self.stdout.write(self.style.SUCCESS(f'Compacted {compacted} queue(s).'))
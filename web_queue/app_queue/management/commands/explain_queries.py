@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from app_queue import services
+from app_queue.models import Queues, Queue
+
+
+class Command(BaseCommand):
+    """
+    Management command printing the EXPLAIN plans of the hot queue queries.
+
+    The queries are built exactly as the views and :mod:`app_queue.services` build them,
+    so the plans show whether they are served by the composite indexes of the models
+    """
+    help = 'Prints EXPLAIN plans for the queries issued by the queue views.'
+
+    def add_arguments(self, parser):
+        """
+        Adds the command line arguments
+
+        :param parser: The argument parser of the command
+        :type parser: argparse.ArgumentParser
+        """
+        parser.add_argument('--queue', type=int, help='Queue to explain the queries for (defaults to the newest one).')
+        parser.add_argument('--analyze', action='store_true', help='Execute the queries and report actual timings.')
+
+    def handle(self, *args, **options):
+        """
+        Explains every hot query for the selected queue
+
+        :param options: Parsed command line options
+        :type options: dict
+        """
+        queues = self.get_queues(options['queue'])
+        record = Queue.objects.filter(queue=queues).order_by('position').first()
+        user_id = record.user_id if record is not None else 0
+        explain_options = {'analyze': True} if options['analyze'] and connection.vendor == 'postgresql' else {}
+
+        plans = [
+            ('queue detail', services.ordered_records(queues.pk)),
+            ('queue membership', Queue.objects.filter(queue=queues.pk, user=user_id)),
+            ('queue head', Queue.objects.filter(queue=queues.pk).order_by('position')[:1]),
+            ('queue tail lock', Queues.objects.select_for_update().only('pk', 'next_position').filter(pk=queues.pk)),
+            ('group queues', Queues.objects.filter(group=queues.group_id).order_by('-created_at')),
+        ]
+        for title, queryset in plans:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{title}:'))
+            with transaction.atomic():
+                self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write('')
+
+    def get_queues(self, queue_id):
+        """
+        Returns the queue to explain the queries for
+
+        :param queue_id: ID of the queue given on the command line, or None to pick the newest queue
+        :type queue_id: int or None
+
+        :return: The selected queue
+        :rtype: app_queue.models.Queues
+        """
+        if queue_id is not None:
+            try:
+                return Queues.objects.get(pk=queue_id)
+            except Queues.DoesNotExist:
+                raise CommandError(f'Queue {queue_id} does not exist.')
+        queues = Queues.objects.order_by('-pk').first()
+        if queues is None:
+            raise CommandError('There are no queues to explain the queries for.')
+        return queues
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app_queue import exports
+from app_queue.models import Queues
+
+
+class Command(BaseCommand):
+    """
+    Management command exporting the records or the event logs of queues with
+    :func:`app_queue.exports.export`, writing the document a chunk at a time
+    """
+    help = 'Exports the records or the event logs of queues as CSV or JSON.'
+
+    def add_arguments(self, parser):
+        """
+        Adds the command line arguments
+
+        :param parser: The argument parser of the command
+        :type parser: argparse.ArgumentParser
+        """
+        parser.add_argument('--queue', type=int, action='append', dest='queues', help='Queue to export (repeatable).')
+        parser.add_argument('--group', type=int, help='Study group whose queues are exported.')
+        parser.add_argument('--data', choices=list(exports.DATA_SETS), default='records', help='Data set to export.')
+        parser.add_argument('--format', choices=list(exports.FORMATS), default='csv', help='Format of the document.')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Number of rows read from the database at a time.')
+        parser.add_argument('--output', help='File to write the document to, the standard output by default.')
+
+    def handle(self, *args, **options):
+        """
+        Writes the export of the selected queues
+
+        :param options: Parsed command line options
+        :type options: dict
+
+        :raises django.core.management.base.CommandError: If neither queues nor a group are given
+        """
+        if options['queues']:
+            queues = options['queues']
+        elif options['group'] is not None:
+            queues = Queues.objects.filter(group=options['group']).values('pk')
+        else:
+            raise CommandError('Give the queues to export with --queue or --group.')
+
+        chunks = exports.export(queues, options['data'], options['format'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
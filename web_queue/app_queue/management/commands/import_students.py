@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app_queue import seeding
+
+
+class Command(BaseCommand):
+    """
+    Management command importing students, their study groups and their queue memberships
+    from a CSV or JSON file with :func:`app_queue.seeding.import_students`
+    """
+    help = 'Imports students, their groups and their queue memberships from a CSV or JSON file.'
+
+    def add_arguments(self, parser):
+        """
+        Adds the command line arguments
+
+        :param parser: The argument parser of the command
+        :type parser: argparse.ArgumentParser
+        """
+        parser.add_argument('path', help=f'File to import, with the columns {", ".join(seeding.STUDENT_COLUMNS)}.')
+        parser.add_argument('--format', choices=['csv', 'json'], help='Format of the file, guessed from its extension by default.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows inserted at a time.')
+        parser.add_argument('--processes', type=int, help='Number of password hashing processes, the number of CPUs by default.')
+
+    def handle(self, *args, **options):
+        """
+        Imports the file, reporting the progress of every stage
+
+        :param options: Parsed command line options
+        :type options: dict
+
+        :raises django.core.management.base.CommandError: If the file cannot be read or a row is invalid
+        """
+        def progress(stage, done, total):
+            if options['verbosity'] > 0:
+                self.stdout.write(f'{stage}: {done}/{total}')
+
+        try:
+            students = seeding.read_students(options['path'], options['format'])
+            summary = seeding.import_students(students, options['batch_size'], options['processes'], progress)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {students} students: {profiles} profiles in {groups} groups, '
+            '{memberships} memberships added to {queues} queues.'.format(**summary)))
@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app_queue.benchmarks import http_load
+
+
+class Command(BaseCommand):
+    """
+    Management command load testing a running server over HTTP.
+
+    Run it against two servers started on the same database (e.g. ``runserver`` and Gunicorn)
+    to compare their requests per second and tail latencies
+    """
+    help = 'Load tests a running server and reports requests per second and latency percentiles.'
+
+    def add_arguments(self, parser):
+        """
+        Adds the command line arguments
+
+        :param parser: The argument parser of the command
+        :type parser: argparse.ArgumentParser
+        """
+        parser.add_argument('url', help='URL of the server, e.g. http://127.0.0.1:8000')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Path to request, may be repeated (default: /queues/).')
+        parser.add_argument('--requests', type=int, default=1000, help='Total number of requests.')
+        parser.add_argument('--concurrency', type=int, default=20, help='Number of concurrent clients.')
+        parser.add_argument('--username', help='Log every client in as this user.')
+        parser.add_argument('--password', help='Password of the user.')
+        parser.add_argument('--login-path', default='/login/', help='Path of the login page.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        """
+        Runs the load test and prints its results
+
+        :param options: Parsed command line options
+        :type options: dict
+        """
+        login = None
+        if options['username']:
+            login = (options['login_path'], options['username'], options['password'] or '')
+        try:
+            results = http_load(options['url'], options['paths'] or ['/queues/'], options['requests'],
+                                options['concurrency'], login)
+        except (RuntimeError, OSError) as e:
+            raise CommandError(e)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results))
+        else:
+            for name, value in results.items():
+                self.stdout.write(f'{name:>8}: {value}')
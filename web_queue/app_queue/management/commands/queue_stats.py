@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from app_queue import history
+from app_queue.models import Queues
+
+
+class Command(BaseCommand):
+    """
+    Management command printing the statistics of queues, replayed from their event logs by
+    :func:`app_queue.history.replay`
+
+    The checkpoints of the queues are moved forward on the way, so running it now and then
+    (e.g. nightly from cron) keeps later replays short
+    """
+    help = 'Replays the event logs of queues and prints their lengths and wait statistics as JSON.'
+
+    def add_arguments(self, parser):
+        """
+        Adds the command line arguments
+
+        :param parser: The argument parser of the command
+        :type parser: argparse.ArgumentParser
+        """
+        parser.add_argument('--queue', type=int, action='append', dest='queues',
+                            help='Queue to replay (repeatable, every queue by default).')
+        parser.add_argument('--no-checkpoint', action='store_true',
+                            help='Do not save the replayed states as the new checkpoints.')
+
+    def handle(self, *args, **options):
+        """
+        Replays the selected queues and prints their statistics
+
+        :param options: Parsed command line options
+        :type options: dict
+        """
+        queue_ids = options['queues'] or list(Queues.objects.order_by('pk').values_list('pk', flat=True))
+        results = []
+        for queue_id in queue_ids:
+            replayed = history.replay(queue_id, checkpoint=not options['no_checkpoint'])
+            results.append({
+                'queue': queue_id,
+                'length': len(replayed.entries),
+                **replayed.stats,
+                'mean_wait': round(replayed.mean_wait, 3),
+            })
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,179 @@
+import threading
+
+from django.core.signals import request_finished, request_started
+from django.db.backends.signals import connection_created
+
+from .caching import get_snapshot_cache
+
+
+class ConnectionMetrics:
+    """
+    Counters of the database connections opened while serving requests.
+
+    A request either reuses a connection kept open by an earlier request (see ``CONN_MAX_AGE``
+    and the connection pool settings) or pays for a new connection handshake. The counters tell
+    how many requests did the latter, and how many connections were opened in total.
+    """
+    def __init__(self):
+        """
+        Initialize the counters.
+        """
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.requests = 0
+        self.requests_with_new_connection = 0
+        self.connections_opened = 0
+
+    def request_started(self, **kwargs):
+        """
+        Start counting the connections opened by the request of the current thread.
+        """
+        self.local.opened = 0
+
+    def connection_created(self, **kwargs):
+        """
+        Count a new connection.
+        """
+        self.local.opened = getattr(self.local, 'opened', 0) + 1
+        with self.lock:
+            self.connections_opened += 1
+
+    def request_finished(self, **kwargs):
+        """
+        Count a finished request, and whether it had to open a connection.
+        """
+        opened = getattr(self.local, 'opened', 0)
+        self.local.opened = 0
+        with self.lock:
+            self.requests += 1
+            if opened:
+                self.requests_with_new_connection += 1
+
+    def snapshot(self):
+        """
+        Return the current values of the counters.
+
+        :return: Dictionary with the 'requests', 'requests_with_new_connection',
+                 'connections_opened' counters and the 'connection_reuse_ratio' of the requests.
+        :rtype: dict
+        """
+        with self.lock:
+            requests = self.requests
+            reused = requests - self.requests_with_new_connection
+            return {
+                'requests': requests,
+                'requests_with_new_connection': self.requests_with_new_connection,
+                'connections_opened': self.connections_opened,
+                'connection_reuse_ratio': reused / requests if requests else 0,
+            }
+
+
+class RequestMetrics:
+    """
+    Cost of the requests, aggregated per URL name.
+
+    For every URL name (``queue``, ``add_user`` and so on) the number of requests and the sums
+    of their wall time, database queries, database time, template render time and response size
+    are kept, as recorded by :class:`app_queue.middleware.InstrumentationMiddleware`.
+    """
+    fields = ('requests', 'duration', 'queries', 'db_duration', 'template_duration', 'response_bytes')
+
+    def __init__(self):
+        """
+        Initialize the counters.
+        """
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view, duration, queries, db_duration, template_duration, response_bytes):
+        """
+        Add a finished request to the counters of its URL name.
+
+        :param view: The URL name of the request.
+        :type view: str
+        :param duration: The wall time of the request, in seconds.
+        :type duration: float
+        :param queries: The number of database queries.
+        :type queries: int
+        :param db_duration: The time spent in the database, in seconds.
+        :type db_duration: float
+        :param template_duration: The time spent rendering templates, in seconds.
+        :type template_duration: float
+        :param response_bytes: The size of the response body.
+        :type response_bytes: int
+        """
+        with self.lock:
+            counters = self.views.setdefault(view, dict.fromkeys(self.fields, 0))
+            counters['requests'] += 1
+            counters['duration'] += duration
+            counters['queries'] += queries
+            counters['db_duration'] += db_duration
+            counters['template_duration'] += template_duration
+            counters['response_bytes'] += response_bytes
+
+    def snapshot(self):
+        """
+        Return a copy of the counters.
+
+        :return: Dictionary mapping the URL names to their counters.
+        :rtype: dict
+        """
+        with self.lock:
+            return {view: dict(counters) for view, counters in self.views.items()}
+
+
+connection_metrics = ConnectionMetrics()
+
+request_metrics = RequestMetrics()
+
+request_started.connect(connection_metrics.request_started, dispatch_uid='app_queue_metrics_request_started')
+request_finished.connect(connection_metrics.request_finished, dispatch_uid='app_queue_metrics_request_finished')
+connection_created.connect(connection_metrics.connection_created, dispatch_uid='app_queue_metrics_connection_created')
+
+
+def _sample(lines, name, value, labels=None):
+    label_text = ''
+    if labels:
+        label_text = '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+    lines.append(f'{name}{label_text} {value}')
+
+
+def render_prometheus():
+    """
+    Render every metric of the application in the Prometheus text exposition format.
+
+    :return: The metrics.
+    :rtype: str
+    """
+    lines = []
+    per_view = [
+        ('app_queue_requests_total', 'requests', 'counter', 'Requests served.'),
+        ('app_queue_request_duration_seconds_total', 'duration', 'counter', 'Wall time of the requests.'),
+        ('app_queue_db_queries_total', 'queries', 'counter', 'Database queries run by the requests.'),
+        ('app_queue_db_duration_seconds_total', 'db_duration', 'counter', 'Time the requests spent in the database.'),
+        ('app_queue_template_duration_seconds_total', 'template_duration', 'counter',
+         'Time the requests spent rendering templates.'),
+        ('app_queue_response_bytes_total', 'response_bytes', 'counter', 'Size of the response bodies.'),
+    ]
+    views = request_metrics.snapshot()
+    for name, field, kind, help_text in per_view:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for view, counters in sorted(views.items()):
+            value = counters[field]
+            _sample(lines, name, round(value, 6) if isinstance(value, float) else value, {'view': view})
+
+    connections = connection_metrics.snapshot()
+    lines.append('# HELP app_queue_db_connections_opened_total Database connections opened.')
+    lines.append('# TYPE app_queue_db_connections_opened_total counter')
+    _sample(lines, 'app_queue_db_connections_opened_total', connections['connections_opened'])
+    lines.append('# HELP app_queue_requests_with_new_db_connection_total Requests that opened a database connection.')
+    lines.append('# TYPE app_queue_requests_with_new_db_connection_total counter')
+    _sample(lines, 'app_queue_requests_with_new_db_connection_total', connections['requests_with_new_connection'])
+
+    snapshots = get_snapshot_cache().stats()
+    lines.append('# HELP app_queue_snapshot_cache_total Lookups and evictions of the queue snapshot cache.')
+    lines.append('# TYPE app_queue_snapshot_cache_total counter')
+    for result, value in snapshots.items():
+        _sample(lines, 'app_queue_snapshot_cache_total', value, {'result': result})
+    return '\n'.join(lines) + '\n'
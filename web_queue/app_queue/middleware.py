@@ -1,5 +1,91 @@
+import logging
+import re
+import time
+from contextlib import ExitStack
+from functools import partial
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
 from django.shortcuts import redirect
 from django.urls import reverse
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject, cached_property
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import services
+from .metrics import request_metrics
+from .templating import render_timings
+
+logger = logging.getLogger(__name__)
+
+
+def get_profile(request):
+    """
+    Return the profile of the user of a request, loading it once per request.
+
+    :param request: The request.
+    :type request: django.http.HttpRequest
+    :return: The profile with its group joined in, or None for anonymous users and users without one.
+    :rtype: app_queue.models.UserProfile or None
+    """
+    if not hasattr(request, '_cached_profile'):
+        user = request.user
+        request._cached_profile = services.user_profile(user.pk) if user.is_authenticated else None
+    return request._cached_profile
+
+
+def load_user(request):
+    """
+    Load the user of a request from the session and return it.
+
+    :param request: The request.
+    :type request: django.http.HttpRequest
+    :return: The user.
+    :rtype: django.contrib.auth.models.User or django.contrib.auth.models.AnonymousUser
+    """
+    # Reading an attribute loads the lazy user
+    request.user.is_authenticated
+    return request.user
+
+
+async def aget_profile(request):
+    """
+    Asynchronous version of :func:`get_profile`.
+
+    :param request: The request.
+    :type request: django.http.HttpRequest
+    :return: The profile with its group joined in, or None for anonymous users and users without one.
+    :rtype: app_queue.models.UserProfile or None
+    """
+    if not hasattr(request, '_cached_profile'):
+        if hasattr(request, 'auser'):
+            user = await request.auser()
+        else:
+            # Django 4.2 has no request.auser()
+            user = await sync_to_async(load_user)(request)
+        request._cached_profile = await services.auser_profile(user.pk) if user.is_authenticated else None
+    return request._cached_profile
+
+
+class ProfileMiddleware(MiddlewareMixin):
+    """
+    Middleware attaching the profile of the logged-in user to the request.
+
+    ``request.profile`` is loaded lazily, together with its group, at most once per request
+    (and served from the cache when the ``PROFILE_CACHE_TIMEOUT`` setting is positive).
+    Async views await ``request.aprofile()`` instead. Both are None for anonymous users.
+    Must be placed after ``AuthenticationMiddleware``.
+    """
+    def process_request(self, request):
+        """
+        Attach the lazy profile to the request.
+
+        :param request: The incoming request.
+        :type request: django.http.HttpRequest
+        """
+        request.profile = SimpleLazyObject(lambda: get_profile(request))
+        request.aprofile = partial(aget_profile, request)
 
 
 class LoginRequiredMiddleware:
@@ -7,8 +93,18 @@ class LoginRequiredMiddleware:
     Middleware for enforcing login requirements on specific URLs.
 
     This middleware redirects unauthenticated users to the login page when they attempt to access
-    URLs other than those explicitly allowed (e.g., login and registration pages).
+    URLs other than those explicitly allowed (e.g., login and registration pages). Unauthenticated
+    requests are rejected before the view runs, so they never reach the database or the templates.
+
+    Besides the login and registration pages, the allowlist is extended by the
+    ``LOGIN_REQUIRED_ALLOWED_PREFIXES`` setting (path prefixes, e.g. static files or the admin) and
+    the ``LOGIN_REQUIRED_ALLOWED_PATTERNS`` setting (regular expressions matched against the path).
+
+    The middleware supports both WSGI and ASGI, so async views are not run in a thread.
     """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         """
         Initialize the middleware.
@@ -17,6 +113,43 @@ class LoginRequiredMiddleware:
         :type get_response: callable
         """
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.allowed_prefixes = tuple(getattr(settings, 'LOGIN_REQUIRED_ALLOWED_PREFIXES', ()))
+        self.allowed_patterns = [re.compile(pattern) for pattern in getattr(settings, 'LOGIN_REQUIRED_ALLOWED_PATTERNS', ())]
+
+    @cached_property
+    def login_url(self):
+        """
+        The URL of the login page, resolved on first use.
+
+        :rtype: str
+        """
+        return reverse('login')
+
+    @cached_property
+    def allowed_urls(self):
+        """
+        The URLs that are always reachable without logging in, resolved on first use.
+
+        :rtype: frozenset
+        """
+        return frozenset([self.login_url, reverse('register')])
+
+    def is_allowed(self, path):
+        """
+        Check whether a path may be accessed without logging in.
+
+        :param path: The path of the request.
+        :type path: str
+        :return: True if the path is in the allowlist.
+        :rtype: bool
+        """
+        return (
+            path in self.allowed_urls
+            or path.startswith(self.allowed_prefixes)
+            or any(pattern.match(path) for pattern in self.allowed_patterns)
+        )
 
     def __call__(self, request):
         """
@@ -27,8 +160,219 @@ class LoginRequiredMiddleware:
         :return: A response.
         :rtype: django.http.HttpResponse
         """
-        allowed_urls = [reverse('login'), reverse('register')]
-        response = self.get_response(request)
-        if not request.user.is_authenticated and request.path not in allowed_urls:
-            return redirect(reverse('login'))
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not request.user.is_authenticated and not self.is_allowed(request.path):
+            return redirect(self.login_url)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        """
+        Process incoming requests under ASGI.
+
+        The user is loaded from the session in a thread, since Django 4.2 has no async
+        interface for it. Async views can read ``request.user`` afterwards without a query.
+
+        :param request: The incoming request.
+        :type request: django.http.HttpRequest
+        :return: A response.
+        :rtype: django.http.HttpResponse
+        """
+        if not await sync_to_async(lambda: request.user.is_authenticated)() and not self.is_allowed(request.path):
+            return redirect(self.login_url)
+        return await self.get_response(request)
+
+
+class InstrumentationMiddleware:
+    """
+    Middleware measuring the cost of every request.
+
+    For each request it records the wall time, the number of database queries, the time spent
+    in the database, the time spent rendering templates (with the
+    :class:`app_queue.templating.InstrumentedDjangoTemplates` backend) and the response size.
+    The measurements are added to :data:`app_queue.metrics.request_metrics` under the URL name of
+    the request and returned in a ``Server-Timing`` header. A warning is logged when a request
+    runs more queries than the ``INSTRUMENTATION_QUERY_WARNING_THRESHOLD`` setting allows.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        """
+        Initialize the middleware.
+
+        :param get_response: A callable that takes a request and returns a response.
+        :type get_response: callable
+        """
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.query_warning_threshold = getattr(settings, 'INSTRUMENTATION_QUERY_WARNING_THRESHOLD', None)
+
+    @staticmethod
+    def wrap_connections(count_query):
+        """
+        Install a wrapper around the queries of every database connection of the current thread.
+
+        :param count_query: The wrapper, as accepted by ``connection.execute_wrapper()``.
+        :type count_query: callable
+        :return: A context stack removing the wrappers when closed.
+        :rtype: contextlib.ExitStack
+        """
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(count_query))
+        return stack
+
+    def __call__(self, request):
+        """
+        Process incoming requests.
+
+        :param request: The incoming request.
+        :type request: django.http.HttpRequest
+        :return: A response.
+        :rtype: django.http.HttpResponse
+        """
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries = [0, 0.0]
+        timings = []
+        token = render_timings.set(timings)
+        began = time.perf_counter()
+        try:
+            with self.wrap_connections(self.query_counter(queries)):
+                response = self.get_response(request)
+        finally:
+            render_timings.reset(token)
+        return self.record(request, response, time.perf_counter() - began, queries, timings)
+
+    async def __acall__(self, request):
+        """
+        Process incoming requests under ASGI.
+
+        The database connections belong to the thread running the synchronous code of the
+        request, where the async ORM interface runs the queries too, so the query wrappers
+        are installed in that thread.
+
+        :param request: The incoming request.
+        :type request: django.http.HttpRequest
+        :return: A response.
+        :rtype: django.http.HttpResponse
+        """
+        queries = [0, 0.0]
+        timings = []
+        token = render_timings.set(timings)
+        began = time.perf_counter()
+        stack = await sync_to_async(self.wrap_connections)(self.query_counter(queries))
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            render_timings.reset(token)
+        return self.record(request, response, time.perf_counter() - began, queries, timings)
+
+    @staticmethod
+    def query_counter(queries):
+        """
+        Create a query wrapper counting the queries and their duration.
+
+        :param queries: List holding the number of queries and their total duration, updated in place.
+        :type queries: list
+        :return: The wrapper, as accepted by ``connection.execute_wrapper()``.
+        :rtype: callable
+        """
+        def count_query(execute, sql, params, many, context):
+            began = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries[0] += 1
+                queries[1] += time.perf_counter() - began
+
+        return count_query
+
+    def record(self, request, response, duration, queries, timings):
+        """
+        Record the measurements of a request and add the ``Server-Timing`` header to its response.
+
+        :param request: The request.
+        :type request: django.http.HttpRequest
+        :param response: The response.
+        :type response: django.http.HttpResponse
+        :param duration: Wall time of the request in seconds.
+        :type duration: float
+        :param queries: Number of queries and their total duration in seconds.
+        :type queries: list
+        :param timings: Durations of the template renders in seconds.
+        :type timings: list
+        :return: The response.
+        :rtype: django.http.HttpResponse
+        """
+        match = request.resolver_match
+        view = match.url_name if match is not None and match.url_name else 'unresolved'
+        size = 0 if response.streaming else len(response.content)
+        template_duration = sum(timings)
+        request_metrics.record(view, duration, queries[0], queries[1], template_duration, size)
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={queries[1] * 1000:.1f};desc="{queries[0]} queries"',
+            f'tpl;dur={template_duration * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ])
+        if self.query_warning_threshold is not None and queries[0] > self.query_warning_threshold:
+            logger.warning('%s %s (%s) ran %d queries, more than the threshold of %d',
+                           request.method, request.path, view, queries[0], self.query_warning_threshold)
         return response
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise middleware that also runs natively under ASGI.
+
+    WhiteNoise itself is synchronous only, which would make Django run every request below it
+    in a thread. Under ASGI this subclass looks the path up in the memory of the process and
+    only serves actual static files in a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None):
+        """
+        Initialize the middleware.
+
+        :param get_response: A callable that takes a request and returns a response.
+        :type get_response: callable
+        """
+        super().__init__(get_response)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        """
+        Process incoming requests.
+
+        :param request: The incoming request.
+        :type request: django.http.HttpRequest
+        :return: A response.
+        :rtype: django.http.HttpResponse
+        """
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        """
+        Process incoming requests under ASGI.
+
+        :param request: The incoming request.
+        :type request: django.http.HttpRequest
+        :return: A response.
+        :rtype: django.http.HttpResponse
+        """
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:24
+
+from django.db import migrations, models
+
+
+def remove_duplicate_records(apps, schema_editor):
+    """
+    Keeps only the earliest record of every user in every queue, so that the uniqueness
+    constraint can be created on databases that already hold duplicates
+    """
+    Queue = apps.get_model('app_queue', 'Queue')
+    seen = set()
+    duplicates = []
+    for pk, queue_id, user_id in Queue.objects.order_by('queue', 'user', 'position', 'pk').values_list(
+            'pk', 'queue', 'user').iterator():
+        if (queue_id, user_id) in seen:
+            duplicates.append(pk)
+        seen.add((queue_id, user_id))
+    Queue.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_queue', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(fields=['queue', 'position'], name='queue_queue_position_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queues',
+            index=models.Index(fields=['group', 'created_at'], name='queues_group_created_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_records, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='queue',
+            constraint=models.UniqueConstraint(fields=('queue', 'user'), name='queue_unique_user'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_queue', '0002_queue_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queues',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations, models
+
+
+def fill_name_keys(apps, schema_editor):
+    """
+    Fills the normalized names of the existing study groups and merges the groups whose names
+    differ only in case or spacing into the oldest of them, so that the uniqueness constraint
+    can be created
+    """
+    StudyGroup = apps.get_model('app_queue', 'StudyGroup')
+    UserProfile = apps.get_model('app_queue', 'UserProfile')
+    Queues = apps.get_model('app_queue', 'Queues')
+    keepers = {}
+    for group in StudyGroup.objects.order_by('pk').iterator():
+        key = ' '.join(group.name.split()).casefold()
+        keeper = keepers.get(key)
+        if keeper is None:
+            keepers[key] = group.pk
+            StudyGroup.objects.filter(pk=group.pk).update(name_key=key)
+        else:
+            UserProfile.objects.filter(group=group.pk).update(group=keeper)
+            Queues.objects.filter(group=group.pk).update(group=keeper)
+            StudyGroup.objects.filter(pk=group.pk).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_queue', '0003_queues_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studygroup',
+            name='name_key',
+            field=models.CharField(default='', editable=False, max_length=100),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_name_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Makes the normalized group names unique. Kept apart from 0004 because PostgreSQL cannot
+    alter a table in the transaction that has just updated the rows referencing it
+    """
+
+    dependencies = [
+        ('app_queue', '0004_studygroup_name_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='studygroup',
+            name='name_key',
+            field=models.CharField(editable=False, max_length=100, unique=True),
+        ),
+    ]
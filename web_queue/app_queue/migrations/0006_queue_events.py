@@ -0,0 +1,57 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def log_current_records(apps, schema_editor):
+    """
+    Starts the event log of every queue with an 'enqueued' event per current record, in queue
+    order, so that replaying the log gives the current state. The times the users joined are
+    unknown, so the events get the time of the migration
+    """
+    Queue = apps.get_model('app_queue', 'Queue')
+    QueueEvent = apps.get_model('app_queue', 'QueueEvent')
+    now = django.utils.timezone.now()
+    records = Queue.objects.order_by('queue', 'position', 'pk').values_list('queue', 'user', 'position')
+    batch = []
+    for queue_id, user_id, position in records.iterator(chunk_size=2000):
+        batch.append(QueueEvent(queue_id=queue_id, user_id=user_id, kind='enqueued', position=position, created_at=now))
+        if len(batch) == 2000:
+            QueueEvent.objects.bulk_create(batch)
+            batch = []
+    QueueEvent.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_queue', '0005_studygroup_name_key_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueCheckpoint',
+            fields=[
+                ('queue', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='app_queue.queues')),
+                ('event_id', models.PositiveBigIntegerField(default=0)),
+                ('state', models.JSONField(default=dict)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QueueEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('enqueued', 'Enqueued'), ('removed', 'Removed'), ('requeued', 'Requeued'), ('compacted', 'Compacted')], max_length=16)),
+                ('position', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('queue', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app_queue.queues')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='app_queue.userprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['queue', 'id'], name='queueevent_queue_id_idx')],
+            },
+        ),
+        migrations.RunPython(log_current_records, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_queue', '0006_queue_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queue',
+            name='enqueued_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
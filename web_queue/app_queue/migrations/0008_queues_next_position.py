@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+# services.POSITION_GAP when the migration was written
+POSITION_GAP = 1024
+
+
+def fill_next_position(apps, schema_editor):
+    """
+    Starts the tail counter of every queue past its last record, rounded up to the next
+    multiple of the position gap, so that new records are appended after the current ones
+    """
+    Queue = apps.get_model('app_queue', 'Queue')
+    Queues = apps.get_model('app_queue', 'Queues')
+    lasts = Queue.objects.values('queue').annotate(last=models.Max('position')).values_list('queue', 'last')
+    batch = []
+    for queue_id, last in lasts.iterator(chunk_size=2000):
+        batch.append(Queues(pk=queue_id, next_position=-(-(last + 1) // POSITION_GAP) * POSITION_GAP))
+        if len(batch) == 2000:
+            Queues.objects.bulk_update(batch, ['next_position'])
+            batch = []
+    Queues.objects.bulk_update(batch, ['next_position'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_queue', '0007_queue_enqueued_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queues',
+            name='next_position',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_next_position, migrations.RunPython.noop),
+    ]
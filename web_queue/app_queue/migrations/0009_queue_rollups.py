@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_queue', '0008_queues_next_position'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('enqueued', models.PositiveIntegerField(default=0)),
+                ('removed', models.PositiveIntegerField(default=0)),
+                ('total_wait', models.FloatField(default=0)),
+                ('max_wait', models.FloatField(default=0)),
+                ('wait_1m', models.PositiveIntegerField(default=0)),
+                ('wait_5m', models.PositiveIntegerField(default=0)),
+                ('wait_15m', models.PositiveIntegerField(default=0)),
+                ('wait_30m', models.PositiveIntegerField(default=0)),
+                ('wait_1h', models.PositiveIntegerField(default=0)),
+                ('wait_longer', models.PositiveIntegerField(default=0)),
+                ('group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='app_queue.studygroup')),
+                ('queue', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='app_queue.queues')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='queuerollup',
+            constraint=models.UniqueConstraint(fields=('queue', 'hour'), name='queuerollup_queue_hour'),
+        ),
+        migrations.AddConstraint(
+            model_name='queuerollup',
+            constraint=models.UniqueConstraint(fields=('group', 'hour'), name='queuerollup_group_hour'),
+        ),
+        migrations.AddConstraint(
+            model_name='queuerollup',
+            constraint=models.CheckConstraint(check=models.Q(('queue__isnull', True), ('group__isnull', True), _connector='XOR'), name='queuerollup_queue_or_group'),
+        ),
+    ]
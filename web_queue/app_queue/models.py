@@ -1,6 +1,7 @@
 from django.contrib.auth.models import User
 from django.db import models
 from django.urls import reverse
+from django.utils import timezone
 
 
 class StudyGroup(models.Model):
@@ -10,9 +11,38 @@ class StudyGroup(models.Model):
 
     :param name: CharField representing the name of the study group, with a maximum length of 100 characters
     :type name: django.db.models.CharField
+    :param name_key: CharField holding the normalized name (see :meth:`normalize`), unique so that
+                     names differing only in case or spacing cannot create two groups. Its index
+                     also serves prefix searches of the group picker
+    :type name_key: django.db.models.CharField
     """
 
     name = models.CharField(max_length=100)
+    name_key = models.CharField(max_length=100, unique=True, editable=False)
+
+    @staticmethod
+    def normalize(name):
+        """
+        Normalizes a group name for comparison: surrounding and repeated whitespace is
+        removed and the case is folded
+
+        :param name: The group name
+        :type name: str
+
+        :return: The normalized name
+        :rtype: str
+        """
+        return ' '.join(name.split()).casefold()
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the study group, keeping ``name_key`` in sync with the name
+        """
+        self.name_key = self.normalize(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'name_key'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         """
@@ -75,6 +105,12 @@ class Queues(models.Model):
     :param created_at: DateTimeField representing the timestamp when the queue was created, automatically
                       set to the current date and time upon creation
     :type created_at: django.db.models.DateTimeField
+    :param next_position: IntegerField holding the position that will be given to the next user
+                          appended to the queue, advanced only while the queue row is locked
+    :type next_position: django.db.models.IntegerField
+    :param version: PositiveBigIntegerField incremented by every change of the queue's users, and
+                    of the queue or a user profile shown on its pages (see :mod:`app_queue.signals`)
+    :type version: django.db.models.PositiveBigIntegerField
     """
 
     name = models.CharField(max_length=100)
@@ -84,6 +120,30 @@ class Queues(models.Model):
 
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    next_position = models.IntegerField(default=0, editable=False)
+    version = models.PositiveBigIntegerField(default=0, editable=False)
+
+    class Meta:
+        """
+        Meta class for defining options of the model
+
+        :ivar indexes: Index on the group and creation time, used to list the queues of a group
+        :type indexes: list
+        """
+        indexes = [
+            models.Index(fields=['group', 'created_at'], name='queues_group_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the queue. The counters ``next_position`` and ``version`` are only advanced by
+        :mod:`app_queue.services` while the row is locked, so saving an existing queue leaves
+        them as they are in the database
+        """
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in ('next_position', 'version')]
+        super().save(*args, **kwargs)
 
     def get_path(self):
         """
@@ -94,6 +154,23 @@ class Queues(models.Model):
         """
         return reverse('queue', args=[str(self.pk)])
 
+    @staticmethod
+    def get_paths(pks):
+        """
+        Returns the URL paths for accessing the detail views of several queues
+
+        The URL pattern is resolved only once, instead of once per queue as with :meth:`get_path`
+
+        :param pks: Primary keys of the queues
+        :type pks: list
+
+        :return: The URL paths, in the order of ``pks``
+        :rtype: list
+        """
+        marker = '2147483647'
+        prefix, _, suffix = reverse('queue', args=[marker]).partition(marker)
+        return [f'{prefix}{pk}{suffix}' for pk in pks]
+
     def __str__(self):
         """
         Returns a string representation of the queue
@@ -118,8 +195,168 @@ class Queue(models.Model):
     :type user: django.db.models.ForeignKey
     :param position: IntegerField representing the user's position in the queue
     :type position: django.db.models.IntegerField
+    :param enqueued_at: DateTimeField representing when the user joined the queue, kept when
+                        they are moved within it
+    :type enqueued_at: django.db.models.DateTimeField
     """
     queue = models.ForeignKey(Queues, on_delete=models.CASCADE)
     user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
     position = models.IntegerField()
+    enqueued_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        """
+        Meta class for defining options of the model
+
+        :ivar indexes: Index on the queue and position, used to read a queue in order
+        :type indexes: list
+        :ivar constraints: Uniqueness of a user within a queue
+        :type constraints: list
+        """
+        indexes = [
+            models.Index(fields=['queue', 'position'], name='queue_queue_position_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['queue', 'user'], name='queue_unique_user'),
+        ]
+
+
+class QueueEvent(models.Model):
+    """
+    Model representing a change of a queue, in the append-only log of the changes.
+
+    The events are written by :mod:`app_queue.services` in the transaction of the change, while
+    the queue row is locked, so the IDs of the events of a queue follow the order in which the
+    changes were committed. The state and the statistics of a queue are rebuilt from them by
+    :func:`app_queue.history.replay`.
+
+    The log is only purged on deletions: the events of a deleted queue or user profile are
+    deleted with it, as are the rows of that user in the queues, and :mod:`app_queue.signals`
+    rebuilds the rollups of the affected queues and groups from the remaining events, so
+    replays and backfills keep agreeing with the dashboards
+
+    :param queue: ForeignKey representing the changed queue
+    :type queue: django.db.models.ForeignKey
+    :param user: ForeignKey representing the user who joined, left or moved, empty for compactions
+    :type user: django.db.models.ForeignKey
+    :param kind: CharField holding the kind of the change, one of :class:`QueueEvent.Kind`
+    :type kind: django.db.models.CharField
+    :param position: IntegerField holding the new position of the user, or the distance between
+                     the renumbered positions for compactions, empty for removals
+    :type position: django.db.models.IntegerField
+    :param created_at: DateTimeField representing the time of the change
+    :type created_at: django.db.models.DateTimeField
+    """
+
+    class Kind(models.TextChoices):
+        """
+        Kinds of queue changes
+        """
+        ENQUEUED = 'enqueued'
+        REMOVED = 'removed'
+        REQUEUED = 'requeued'
+        COMPACTED = 'compacted'
+
+    queue = models.ForeignKey(Queues, on_delete=models.CASCADE)
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, null=True, blank=True)
+    kind = models.CharField(max_length=16, choices=Kind.choices)
+    position = models.IntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        """
+        Meta class for defining options of the model
+
+        :ivar indexes: Index on the queue and ID, used to replay the events of a queue in order
+        :type indexes: list
+        """
+        indexes = [
+            models.Index(fields=['queue', 'id'], name='queueevent_queue_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Saves a new event
+
+        :raises ValueError: If the event was already saved, since the log is append-only
+        """
+        if not self._state.adding:
+            raise ValueError('Queue events cannot be changed.')
+        super().save(*args, **kwargs)
+
+
+class QueueCheckpoint(models.Model):
+    """
+    Model representing the state of a queue rebuilt from its events, up to a given event.
 
+    Replays start from the checkpoint instead of the first event of the queue
+
+    :param queue: OneToOneField representing the queue
+    :type queue: django.db.models.OneToOneField
+    :param event_id: PositiveBigIntegerField holding the ID of the last event included
+    :type event_id: django.db.models.PositiveBigIntegerField
+    :param state: JSONField holding the state, as written by :meth:`app_queue.history.QueueHistory.to_json`
+    :type state: django.db.models.JSONField
+    """
+
+    queue = models.OneToOneField(Queues, on_delete=models.CASCADE, primary_key=True)
+    event_id = models.PositiveBigIntegerField(default=0)
+    state = models.JSONField(default=dict)
+
+
+class QueueRollup(models.Model):
+    """
+    Model representing the changes of a queue, or of every queue of a study group, during an hour.
+
+    The rollups are kept up to date by :mod:`app_queue.analytics` in the transaction of every
+    join and removal, so the analytics are read from them alone, without scanning the ``Queue``
+    table or the event log. A rollup belongs either to a queue or to a group
+
+    :param queue: ForeignKey representing the queue of the rollup, empty for the rollups of a group
+    :type queue: django.db.models.ForeignKey
+    :param group: ForeignKey representing the study group of the rollup, empty for the rollups of a queue
+    :type group: django.db.models.ForeignKey
+    :param hour: DateTimeField holding the start of the hour
+    :type hour: django.db.models.DateTimeField
+    :param enqueued: PositiveIntegerField counting the users who joined
+    :type enqueued: django.db.models.PositiveIntegerField
+    :param removed: PositiveIntegerField counting the users who left
+    :type removed: django.db.models.PositiveIntegerField
+    :param total_wait: FloatField summing up the time the users who left spent in the queue, in seconds
+    :type total_wait: django.db.models.FloatField
+    :param max_wait: FloatField holding the longest of those times, in seconds
+    :type max_wait: django.db.models.FloatField
+    :param wait_1m: PositiveIntegerField counting the users who left within a minute. The other
+                    ``wait_`` fields count those who left within 5, 15 and 30 minutes, an hour,
+                    and later (see :data:`app_queue.analytics.WAIT_BUCKETS`)
+    :type wait_1m: django.db.models.PositiveIntegerField
+    """
+
+    queue = models.ForeignKey(Queues, on_delete=models.CASCADE, null=True, blank=True)
+    group = models.ForeignKey(StudyGroup, on_delete=models.CASCADE, null=True, blank=True)
+    hour = models.DateTimeField()
+    enqueued = models.PositiveIntegerField(default=0)
+    removed = models.PositiveIntegerField(default=0)
+    total_wait = models.FloatField(default=0)
+    max_wait = models.FloatField(default=0)
+    wait_1m = models.PositiveIntegerField(default=0)
+    wait_5m = models.PositiveIntegerField(default=0)
+    wait_15m = models.PositiveIntegerField(default=0)
+    wait_30m = models.PositiveIntegerField(default=0)
+    wait_1h = models.PositiveIntegerField(default=0)
+    wait_longer = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        """
+        Meta class for defining options of the model
+
+        :ivar constraints: One rollup per queue or group and hour, whose indexes serve the
+                           reads of the dashboard, and the rollup belonging to exactly one of them
+        :type constraints: list
+        """
+        constraints = [
+            models.UniqueConstraint(fields=['queue', 'hour'], name='queuerollup_queue_hour'),
+            models.UniqueConstraint(fields=['group', 'hour'], name='queuerollup_group_hour'),
+            models.CheckConstraint(check=models.Q(queue__isnull=True) ^ models.Q(group__isnull=True),
+                                   name='queuerollup_queue_or_group'),
+        ]
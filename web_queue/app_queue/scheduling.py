@@ -0,0 +1,119 @@
+import heapq
+from collections import namedtuple
+
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import Queue
+
+NextUp = namedtuple('NextUp', ['queue_id', 'place', 'user_id', 'name', 'enqueued_at'])
+NextUp.__doc__ = """
+A user chosen by the scheduler: the queue, the place of the user in it (counting from 1),
+the ID of their profile, their name and the time they joined the queue
+"""
+
+
+def round_robin(entry, rank, weight, since):
+    """
+    Takes the heads of the queues in turn, in the order in which the queues were given
+
+    :param entry: The candidate
+    :type entry: app_queue.scheduling.NextUp
+    :param rank: Index of the queue of the candidate among the given queues
+    :type rank: int
+    :param weight: Weight of the queue of the candidate
+    :type weight: float
+    :param since: Latest time any user up to the candidate joined their queue
+    :type since: datetime.datetime
+
+    :return: Sort key of the candidate, the smallest comes first
+    :rtype: tuple
+    """
+    return entry.place, rank
+
+
+def oldest_first(entry, rank, weight, since):
+    """
+    Takes the head that has waited longest. A user never comes before the users ahead of them
+    in their queue, so a user moved back waits as long as those now ahead of them
+
+    See :func:`round_robin` for the parameters
+    """
+    return since, rank, entry.place
+
+
+def weighted(entry, rank, weight, since):
+    """
+    Takes the heads of the queues in proportion to their weights, e.g. two users of a queue
+    of weight 2 for every user of a queue of weight 1, interleaved
+
+    See :func:`round_robin` for the parameters
+    """
+    return entry.place / weight, rank
+
+
+# Scheduling policies, by name
+POLICIES = {'round_robin': round_robin, 'oldest_first': oldest_first, 'weighted': weighted}
+
+
+def candidates(queue_ids, count):
+    """
+    Reads the first ``count`` users of every queue with a single query
+
+    The places are numbered per queue by a window function over the ``(queue, position)``
+    index, so no more than ``count`` rows per queue are returned
+
+    :param queue_ids: IDs of the queues
+    :type queue_ids: list
+    :param count: Number of users read from the head of every queue
+    :type count: int
+
+    :return: The users, ordered by queue and place
+    :rtype: list
+    """
+    rows = (
+        Queue.objects.filter(queue__in=queue_ids)
+        .annotate(place=Window(expression=RowNumber(), partition_by=[F('queue')],
+                               order_by=[F('position').asc(), F('pk').asc()]))
+        .filter(place__lte=count)
+        .order_by('queue', 'place')
+        .values_list('queue_id', 'place', 'user_id', 'user__first_name', 'user__last_name', 'enqueued_at')
+    )
+    return [NextUp(queue_id, place, user_id, f'{first_name} {last_name}', enqueued_at)
+            for queue_id, place, user_id, first_name, last_name, enqueued_at in rows]
+
+
+def next_up(queue_ids, count, policy='round_robin', weights=None):
+    """
+    Chooses the next ``count`` users to be served across several queues
+
+    The heads of the queues read by :func:`candidates` are merged in memory by the sort key
+    of the policy, which keeps the order of every queue. A user in several of the queues
+    comes up once for each of them. Nothing is changed, see
+    :func:`app_queue.services.dequeue_next` to remove the chosen users
+
+    :param queue_ids: IDs of the queues, in the order in which ties are broken
+    :type queue_ids: list
+    :param count: Number of users to choose
+    :type count: int
+    :param policy: Name of the policy, a key of :data:`POLICIES`
+    :type policy: str
+    :param weights: Weights of the queues of the 'weighted' policy, by queue ID, 1 by default
+    :type weights: dict or None
+
+    :return: The chosen users, in the order in which they are to be served
+    :rtype: list
+    :raises ValueError: If the policy is unknown or a weight is not positive
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"The policy must be one of {', '.join(POLICIES)}.")
+    weights = weights or {}
+    if any(weight <= 0 for weight in weights.values()):
+        raise ValueError('The weights must be positive.')
+    key, ranks = POLICIES[policy], {queue_id: n for n, queue_id in enumerate(dict.fromkeys(queue_ids))}
+
+    keyed, since = [], {}
+    for entry in candidates(list(ranks), count):
+        since[entry.queue_id] = max(since.get(entry.queue_id, entry.enqueued_at), entry.enqueued_at)
+        keyed.append((key(entry, ranks[entry.queue_id], weights.get(entry.queue_id, 1), since[entry.queue_id]), entry))
+    return [entry for _, entry in heapq.nsmallest(count, keyed, key=lambda item: item[0])]
@@ -0,0 +1,292 @@
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from . import services
+from .models import StudyGroup, UserProfile, Queues
+
+# Columns of an import file; 'email', 'queues' and the names are optional
+STUDENT_COLUMNS = ['username', 'password', 'first_name', 'last_name', 'group', 'email', 'queues']
+
+
+def read_students(path, fmt=None):
+    """
+    Reads the students of an import file
+
+    A CSV file has a header line with the :data:`STUDENT_COLUMNS`, the queues of a student
+    separated by ';'. A JSON file holds a list of objects with the same keys, the queues
+    being a list
+
+    :param path: Path of the file
+    :type path: str
+    :param fmt: 'csv' or 'json', guessed from the extension of the file by default
+    :type fmt: str or None
+
+    :return: The students, as dictionaries
+    :rtype: list
+    """
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    with open(path, newline='') as f:
+        if fmt == 'json':
+            return json.load(f)
+        if fmt != 'csv':
+            raise ValueError(f'Unknown import format: {fmt}.')
+        return [
+            {**row, 'queues': [name.strip() for name in (row.get('queues') or '').split(';') if name.strip()]}
+            for row in csv.DictReader(f)
+        ]
+
+
+def _setup_worker(settings_module):
+    """
+    Sets Django up in a password hashing process
+
+    :param settings_module: The settings module of the parent process
+    :type settings_module: str
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+
+
+def _is_hashed(password):
+    """
+    Tells whether a password is already hashed by one of the configured hashers
+
+    :param password: The password
+    :type password: str
+
+    :return: True if the password is a hash
+    :rtype: bool
+    """
+    try:
+        identify_hasher(password)
+    except ValueError:
+        return False
+    return True
+
+
+def hash_passwords(passwords, processes=None, progress=None):
+    """
+    Hashes passwords with the configured hasher, in a pool of processes
+
+    Passwords that are already hashed are kept, repeated passwords are hashed once and empty
+    ones are made unusable
+
+    :param passwords: The raw passwords
+    :type passwords: list
+    :param processes: Number of hashing processes, the number of CPUs by default; 1 hashes
+                      in the current process
+    :type processes: int or None
+    :param progress: Called with the stage name, the number of passwords hashed so far and
+                     their total number
+    :type progress: collections.abc.Callable or None
+
+    :return: The hashes, in the order of the passwords
+    :rtype: list
+    """
+    unique = [password for password in dict.fromkeys(passwords) if password and not _is_hashed(password)]
+    hashes = {}
+    if processes == 1 or len(unique) < 2:
+        results = map(make_password, unique)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(processes, initializer=_setup_worker,
+                                       initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', ''),))
+        results = executor.map(make_password, unique, chunksize=16)
+    try:
+        for n, (password, hashed) in enumerate(zip(unique, results), 1):
+            hashes[password] = hashed
+            if progress and (n % 1000 == 0 or n == len(unique)):
+                progress('passwords', n, len(unique))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return [hashes.get(password, password) if password else make_password(None) for password in passwords]
+
+
+def seed_groups(names):
+    """
+    Returns the study groups of the given names, creating the missing ones with a bulk insert
+
+    Names are matched the way :meth:`app_queue.models.StudyGroup.normalize` compares them
+
+    :param names: Names of the groups
+    :type names: collections.abc.Iterable
+
+    :return: Dictionary mapping every name to the ID of its group
+    :rtype: dict
+    """
+    keys = {name: StudyGroup.normalize(name) for name in names}
+    first_names = {}
+    for name, key in keys.items():
+        first_names.setdefault(key, name.strip())
+    StudyGroup.objects.bulk_create(
+        [StudyGroup(name=name, name_key=key) for key, name in first_names.items()], ignore_conflicts=True)
+    ids = dict(StudyGroup.objects.filter(name_key__in=first_names).values_list('name_key', 'pk'))
+    return {name: ids[key] for name, key in keys.items()}
+
+
+def _chunks(items, size):
+    """
+    Splits a list into consecutive slices of at most ``size`` items
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def seed_students(students, batch_size=1000, processes=None, progress=None):
+    """
+    Creates the users and the profiles of students with batched bulk inserts
+
+    Students whose username is already taken are left as they are. The passwords are hashed
+    by :func:`hash_passwords` first, then every batch of users and their profiles is inserted
+    in its own transaction, so an interrupted import can simply be run again
+
+    :param students: Dictionaries with the 'username', 'group' (name of the study group) and
+                     optionally the 'password', 'first_name', 'last_name' and 'email' of each student
+    :type students: list
+    :param batch_size: Number of students inserted at a time
+    :type batch_size: int
+    :param processes: Number of password hashing processes, see :func:`hash_passwords`
+    :type processes: int or None
+    :param progress: Called with the stage name, the number of items done and their total number
+    :type progress: collections.abc.Callable or None
+
+    :return: Dictionary mapping the username of every student having a profile to its ID
+    :rtype: dict
+    :raises ValueError: If a student has no username or no group
+    """
+    for n, student in enumerate(students, 1):
+        if not student.get('username') or not student.get('group'):
+            raise ValueError(f'Student {n} has no username or no group.')
+    usernames = [student['username'] for student in students]
+    existing = set()
+    for batch in _chunks(usernames, batch_size):
+        existing.update(User.objects.filter(username__in=batch).values_list('username', flat=True))
+    by_username = {student['username']: student for student in students}
+    new = [student for username, student in by_username.items() if username not in existing]
+
+    groups = seed_groups({student['group'] for student in new})
+    hashes = hash_passwords([student.get('password') or '' for student in new], processes, progress)
+    for done, batch in enumerate(_chunks(list(zip(new, hashes)), batch_size)):
+        with transaction.atomic():
+            User.objects.bulk_create([
+                User(username=student['username'], password=hashed, email=student.get('email') or '')
+                for student, hashed in batch
+            ])
+            users = dict(User.objects.filter(username__in=[student['username'] for student, _ in batch])
+                         .values_list('username', 'pk'))
+            UserProfile.objects.bulk_create([
+                UserProfile(user_id=users[student['username']], group_id=groups[student['group']],
+                            first_name=student.get('first_name') or '', last_name=student.get('last_name') or '')
+                for student, _ in batch
+            ])
+        if progress:
+            progress('students', min((done + 1) * batch_size, len(new)), len(new))
+
+    profiles = {}
+    for batch in _chunks(usernames, batch_size):
+        profiles.update(UserProfile.objects.filter(user__username__in=batch).values_list('user__username', 'pk'))
+    return profiles
+
+
+def seed_queues(group_id, names, creator_id=None):
+    """
+    Returns the queues of a study group with the given names, creating the missing ones with
+    a bulk insert
+
+    :param group_id: ID of the study group
+    :type group_id: int
+    :param names: Names of the queues
+    :type names: collections.abc.Iterable
+    :param creator_id: ID of the user profile set as the creator of the created queues
+    :type creator_id: int or None
+
+    :return: Dictionary mapping every name to the ID of the oldest queue of that name
+    :rtype: dict
+    """
+    names = list(dict.fromkeys(names))
+    existing = Queues.objects.filter(group=group_id, name__in=names)
+    found = set(existing.values_list('name', flat=True))
+    Queues.objects.bulk_create([
+        Queues(name=name, group_id=group_id, creator_id=creator_id) for name in names if name not in found
+    ])
+    # Newest first, so the oldest queue of every name is written last
+    return dict(existing.order_by('-pk').values_list('name', 'pk'))
+
+
+def seed_memberships(memberships, batch_size=1000, progress=None):
+    """
+    Appends users to queues in the given order, ``batch_size`` users at a time
+
+    Every batch goes through :func:`app_queue.services.enqueue_many`, so the positions, the
+    versions and the event logs of the queues are kept as for any other change, and users
+    already in a queue keep their place
+
+    :param memberships: Dictionary mapping queue IDs to the IDs of the user profiles to append
+    :type memberships: dict
+    :param batch_size: Number of users appended at a time
+    :type batch_size: int
+    :param progress: Called with the stage name, the number of queues done and their total number
+    :type progress: collections.abc.Callable or None
+
+    :return: Number of users added
+    :rtype: int
+    """
+    added = 0
+    for done, (queue_id, user_ids) in enumerate(memberships.items(), 1):
+        for batch in _chunks(list(user_ids), batch_size):
+            added += len(services.enqueue_many(queue_id, batch))
+        if progress:
+            progress('queues', done, len(memberships))
+    return added
+
+
+def import_students(students, batch_size=1000, processes=None, progress=None):
+    """
+    Imports students together with their groups and queue memberships
+
+    The students are created by :func:`seed_students`. The queues listed for a student
+    (under 'queues') are looked up by name within the student's group, created if missing,
+    and the students are appended to them in the order of the import
+
+    :param students: The students, as returned by :func:`read_students`
+    :type students: list
+    :param batch_size: Number of rows inserted at a time
+    :type batch_size: int
+    :param processes: Number of password hashing processes, see :func:`hash_passwords`
+    :type processes: int or None
+    :param progress: Called with the stage name, the number of items done and their total number
+    :type progress: collections.abc.Callable or None
+
+    :return: Dictionary with the number of 'students' in the import, of 'profiles' found or
+             created for them, of 'groups' and 'queues' involved and of 'memberships' added
+    :rtype: dict
+    """
+    profiles = seed_students(students, batch_size, processes, progress)
+    groups = seed_groups({student['group'] for student in students})
+
+    wanted = {}
+    for student in students:
+        profile_id = profiles.get(student['username'])
+        for name in student.get('queues') or ():
+            if profile_id is not None:
+                wanted.setdefault((groups[student['group']], name), []).append(profile_id)
+    memberships = {}
+    for group_id in {group_id for group_id, _ in wanted}:
+        queue_ids = seed_queues(group_id, [name for g, name in wanted if g == group_id])
+        memberships.update((queue_ids[name], user_ids) for (g, name), user_ids in wanted.items() if g == group_id)
+
+    return {
+        'students': len(students),
+        'profiles': len(profiles),
+        'groups': len(set(groups.values())),
+        'queues': len(memberships),
+        'memberships': seed_memberships(memberships, batch_size, progress),
+    }
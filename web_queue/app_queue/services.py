@@ -0,0 +1,812 @@
+from collections import defaultdict
+from datetime import datetime
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Max, Q, Sum, Value, When, Window
+from django.db.models.functions import RowNumber
+
+from . import analytics, caching, history, scheduling
+from .broadcast import get_broadcast
+from .models import Queues, Queue, QueueEvent, UserProfile
+
+#: Distance between the positions handed out at the tail of a queue, leaving room to insert
+#: records between neighbours without moving them
+POSITION_GAP = 1024
+
+
+def _lock_queue(queue_id):
+    """
+    Locks the queue row for the rest of the current transaction and returns it
+
+    Every operation that hands out a position goes through this lock, so concurrent
+    appends to the same queue are serialized on a single row while other queues
+    stay unaffected
+
+    :param queue_id: ID of the queue to lock
+    :type queue_id: int
+
+    :return: The locked queue with its ``next_position`` counter, its version and its group loaded
+    :rtype: app_queue.models.Queues
+    :raises app_queue.models.Queues.DoesNotExist: If the queue does not exist
+    """
+    return Queues.objects.select_for_update().only('pk', 'next_position', 'version', 'group').get(pk=queue_id)
+
+
+def _commit_change(queues, advance_tail=0):
+    """
+    Records a change of a locked queue
+
+    Bumps the version of the queue (and its tail counter when positions were handed out)
+    with a single UPDATE, then writes the new snapshot of the queue through to the cache once
+    the current transaction commits (see :func:`_write_through`). The queue is only read after
+    the commit, so a change costs the same whatever the length of the queue and the lock is
+    not held while the queue is read
+
+    :param queues: Queue previously locked with :func:`_lock_queue`
+    :type queues: app_queue.models.Queues
+    :param advance_tail: Number of positions handed out from ``next_position``, each of them
+                         :data:`POSITION_GAP` apart
+    :type advance_tail: int
+
+    :return: The version of the queue after the change
+    :rtype: int
+    """
+    changes = {'version': F('version') + 1}
+    if advance_tail:
+        changes['next_position'] = F('next_position') + advance_tail * POSITION_GAP
+    Queues.objects.filter(pk=queues.pk).update(**changes)
+    # The row is locked, so no other change can come in between
+    version = queues.version + 1
+    transaction.on_commit(lambda: _write_through(queues.pk, version))
+    return version
+
+
+def _write_through(queue_id, version):
+    """
+    Stores the snapshot of a queue after a committed change
+
+    The cached snapshot is first marked stale up to the new version, so a failed read, or one
+    overtaken by a later change, never leaves the older snapshot to be served. The snapshot is
+    then read from the database and stored, unless a newer one has been stored in the meantime
+
+    :param queue_id: ID of the changed queue
+    :type queue_id: int
+    :param version: Version of the queue after the change
+    :type version: int
+    """
+    snapshot_cache = caching.get_snapshot_cache()
+    snapshot_cache.invalidate(queue_id, version)
+    try:
+        snapshot_cache.set(queue_id, load_snapshot(queue_id))
+    except Queues.DoesNotExist:
+        # The queue was deleted right after the change
+        pass
+
+
+def touch_queues(queues):
+    """
+    Bumps the version of queues whose pages show something that changed outside of their
+    users, such as the name of the queue or of one of its users
+
+    The caches keyed by the version (the cached rows of the templates, the snapshots and the
+    ETags) then miss, and the cached snapshots are marked stale once the current transaction
+    commits. A rename may touch every queue of a group, so unlike the changes of their users
+    the snapshots are left to be rebuilt by the next read of each queue
+
+    :param queues: The queues to bump
+    :type queues: django.db.models.QuerySet
+
+    :return: The new versions, by queue ID
+    :rtype: dict
+    """
+    with transaction.atomic():
+        queue_ids = list(queues.order_by('pk').values_list('pk', flat=True))
+        if not queue_ids:
+            return {}
+        Queues.objects.filter(pk__in=queue_ids).update(version=F('version') + 1)
+        versions = dict(Queues.objects.filter(pk__in=queue_ids).values_list('pk', 'version'))
+
+        def invalidate():
+            snapshot_cache = caching.get_snapshot_cache()
+            for queue_id, version in versions.items():
+                snapshot_cache.invalidate(queue_id, version)
+        transaction.on_commit(invalidate)
+    return versions
+
+
+def _publish(queue_id, message, version):
+    """
+    Broadcasts a change of a queue to its subscribers once the current transaction commits
+
+    :param queue_id: ID of the changed queue
+    :type queue_id: int
+    :param message: Description of the change
+    :type message: dict
+    :param version: Version of the queue after the change, sent along with the message so
+                    the page can tell whether its table is up to date
+    :type version: int
+    """
+    message = {**message, 'version': version}
+    transaction.on_commit(lambda: get_broadcast().publish(queue_id, message))
+
+
+def user_profile(user_id):
+    """
+    Returns the profile of a user with its group joined in, reading the database only
+    when it is not cached
+
+    :param user_id: ID of the user
+    :type user_id: int
+
+    :return: The profile, or None if the user has none
+    :rtype: app_queue.models.UserProfile or None
+    """
+    return caching.get_profile(
+        user_id, lambda: UserProfile.objects.select_related('group').filter(user=user_id).first())
+
+
+async def auser_profile(user_id):
+    """
+    Asynchronous version of :func:`user_profile`, using the async ORM interface
+
+    :param user_id: ID of the user
+    :type user_id: int
+
+    :return: The profile, or None if the user has none
+    :rtype: app_queue.models.UserProfile or None
+    """
+    return await caching.aget_profile(
+        user_id, lambda: UserProfile.objects.select_related('group').filter(user=user_id).afirst())
+
+
+def ordered_records(queue_id):
+    """
+    Builds the query returning the records of a queue in order
+
+    Each record is annotated with its 1-based ``place`` and has the related user profile
+    joined in, so the whole queue is read with a single statement
+
+    :param queue_id: ID of the queue to be read
+    :type queue_id: int
+
+    :return: Records of the queue ordered by position
+    :rtype: django.db.models.QuerySet
+    """
+    return (
+        Queue.objects.filter(queue=queue_id)
+        .select_related('user')
+        .annotate(place=Window(expression=RowNumber(), order_by=[F('position').asc(), F('pk').asc()]))
+        .order_by('position', 'pk')
+    )
+
+
+def _snapshot_rows(queue_id):
+    """
+    Builds the query reading the entries of a queue snapshot together with the queue version
+
+    :param queue_id: ID of the queue to be read
+    :type queue_id: int
+
+    :return: Rows of the place, the user ID, the first and last names and the queue version
+    :rtype: django.db.models.QuerySet
+    """
+    return ordered_records(queue_id).values_list(
+        'place', 'user_id', 'user__first_name', 'user__last_name', 'queue__version')
+
+
+def _build_snapshot(rows, version):
+    """
+    Builds a queue snapshot from the rows of :func:`_snapshot_rows`
+
+    :param rows: The rows read
+    :type rows: list
+    :param version: Version of the queue, used when there are no rows
+    :type version: int or None
+
+    :return: The snapshot of the queue
+    :rtype: app_queue.caching.QueueSnapshot
+    """
+    entries = [caching.SnapshotEntry(place, user_id, f'{first_name} {last_name}')
+               for place, user_id, first_name, last_name, _ in rows]
+    return caching.QueueSnapshot(rows[0][4] if rows else version, entries)
+
+
+def load_snapshot(queue_id):
+    """
+    Reads the snapshot of a queue from the database
+
+    The entries and the version are read by a single statement, unless the queue is empty
+
+    :param queue_id: ID of the queue to be read
+    :type queue_id: int
+
+    :return: The snapshot of the queue
+    :rtype: app_queue.caching.QueueSnapshot
+    :raises app_queue.models.Queues.DoesNotExist: If the queue does not exist
+    """
+    rows = list(_snapshot_rows(queue_id))
+    version = None if rows else Queues.objects.values_list('version', flat=True).get(pk=queue_id)
+    return _build_snapshot(rows, version)
+
+
+async def aload_snapshot(queue_id):
+    """
+    Asynchronous version of :func:`load_snapshot`, using the async ORM interface
+
+    :param queue_id: ID of the queue to be read
+    :type queue_id: int
+
+    :return: The snapshot of the queue
+    :rtype: app_queue.caching.QueueSnapshot
+    :raises app_queue.models.Queues.DoesNotExist: If the queue does not exist
+    """
+    rows = [row async for row in _snapshot_rows(queue_id)]
+    version = None if rows else await Queues.objects.values_list('version', flat=True).aget(pk=queue_id)
+    return _build_snapshot(rows, version)
+
+
+def queue_snapshot(queue_id):
+    """
+    Returns the snapshot of a queue, reading the database only when it is not cached
+
+    :param queue_id: ID of the queue to be read
+    :type queue_id: int
+
+    :return: The snapshot of the queue
+    :rtype: app_queue.caching.QueueSnapshot
+    :raises app_queue.models.Queues.DoesNotExist: If the queue does not exist
+    """
+    snapshot_cache = caching.get_snapshot_cache()
+    snapshot = snapshot_cache.get(queue_id)
+    if snapshot is None:
+        snapshot = load_snapshot(queue_id)
+        snapshot_cache.set(queue_id, snapshot)
+    return snapshot
+
+
+async def aqueue_snapshot(queue_id):
+    """
+    Asynchronous version of :func:`queue_snapshot`
+
+    :param queue_id: ID of the queue to be read
+    :type queue_id: int
+
+    :return: The snapshot of the queue
+    :rtype: app_queue.caching.QueueSnapshot
+    :raises app_queue.models.Queues.DoesNotExist: If the queue does not exist
+    """
+    snapshot_cache = caching.get_snapshot_cache()
+    snapshot = await snapshot_cache.aget(queue_id)
+    if snapshot is None:
+        snapshot = await aload_snapshot(queue_id)
+        await snapshot_cache.aset(queue_id, snapshot)
+    return snapshot
+
+
+def queue_version(queue_id):
+    """
+    Reads the version of a queue with a primary key lookup
+
+    :param queue_id: ID of the queue
+    :type queue_id: int
+
+    :return: The version of the queue, or None if the queue does not exist
+    :rtype: int or None
+    """
+    return Queues.objects.filter(pk=queue_id).values_list('version', flat=True).first()
+
+
+def fresh_snapshot(queue_id, version):
+    """
+    Returns the snapshot of a queue at least as new as a version read from the database
+
+    The cached snapshot is used when it is recent enough, so a snapshot cache that another
+    process has not marked stale yet is never served
+
+    :param queue_id: ID of the queue to be read
+    :type queue_id: int
+    :param version: Version of the queue read from the database
+    :type version: int
+
+    :return: The snapshot of the queue
+    :rtype: app_queue.caching.QueueSnapshot
+    :raises app_queue.models.Queues.DoesNotExist: If the queue does not exist
+    """
+    snapshot = queue_snapshot(queue_id)
+    if snapshot.version < version:
+        snapshot = load_snapshot(queue_id)
+        caching.get_snapshot_cache().set(queue_id, snapshot)
+    return snapshot
+
+
+def group_fingerprint(group_id):
+    """
+    Summarizes the state of the queues of a group with a single aggregate query
+
+    The summary changes whenever a queue of the group is created, deleted or changed,
+    since every change bumps the version of the queue
+
+    :param group_id: ID of the group
+    :type group_id: int
+
+    :return: The number of queues, the highest queue ID and the sum of the versions, joined by '-'
+    :rtype: str
+    """
+    summary = Queues.objects.filter(group=group_id).aggregate(count=Count('pk'), last=Max('pk'), versions=Sum('version'))
+    return f'{summary["count"]}-{summary["last"] or 0}-{summary["versions"] or 0}'
+
+
+def queue_lengths(queue_ids):
+    """
+    Counts the records of several queues with a single query
+
+    :param queue_ids: IDs of the queues
+    :type queue_ids: list
+
+    :return: Dictionary mapping the queue IDs to their number of records
+    :rtype: dict
+    """
+    lengths = dict.fromkeys(queue_ids, 0)
+    lengths.update(
+        Queue.objects.filter(queue__in=queue_ids).values('queue').annotate(length=Count('pk')).values_list('queue', 'length')
+    )
+    return lengths
+
+
+def encode_cursor(queues):
+    """
+    Encodes the keyset cursor pointing right after a queue of a listing
+
+    :param queues: The last queue of a listing page
+    :type queues: app_queue.models.Queues
+
+    :return: The cursor of the next page
+    :rtype: str
+    """
+    return f'{queues.created_at.isoformat()}_{queues.pk}'
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a keyset cursor created by :func:`encode_cursor`
+
+    :param cursor: The cursor to decode
+    :type cursor: str
+
+    :return: A tuple of the creation time and the primary key the cursor points after,
+             or None if the cursor is malformed
+    :rtype: tuple or None
+    """
+    created_at, _, pk = cursor.rpartition('_')
+    try:
+        return datetime.fromisoformat(created_at), int(pk)
+    except ValueError:
+        return None
+
+
+def _group_queues_query(group_id, cursor):
+    """
+    Builds the query of a page of the queues of a group, see :func:`group_queues_page`
+
+    :param group_id: ID of the group whose queues are listed
+    :type group_id: int
+    :param cursor: Cursor returned with the previous page, or None for the first page
+    :type cursor: str or None
+
+    :return: The queues after the cursor, newest first
+    :rtype: django.db.models.QuerySet
+    """
+    queryset = Queues.objects.filter(group=group_id).select_related('group').order_by('-created_at', '-pk')
+    after = decode_cursor(cursor) if cursor else None
+    if after is not None:
+        created_at, pk = after
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+    return queryset
+
+
+def _finish_queues_page(page, size):
+    """
+    Cuts the queues read by :func:`_group_queues_query` to a page and attaches their paths
+
+    :param page: Up to ``size + 1`` queues read
+    :type page: list
+    :param size: Maximum number of queues on the page
+    :type size: int
+
+    :return: A tuple of the queues on the page and the cursor of the next page, or None
+    :rtype: tuple
+    """
+    next_cursor = encode_cursor(page[size - 1]) if len(page) > size else None
+    page = page[:size]
+    for queues, path in zip(page, Queues.get_paths([queues.pk for queues in page])):
+        queues.path = path
+    return page, next_cursor
+
+
+def group_queues_page(group_id, cursor=None, size=50):
+    """
+    Reads one page of the queues of a group, newest first, using keyset pagination
+
+    The page is selected by the ``(created_at, pk)`` of the last queue of the previous page,
+    so every page is served by the ``(group, created_at)`` index no matter how deep it is
+
+    :param group_id: ID of the group whose queues are listed
+    :type group_id: int
+    :param cursor: Cursor returned with the previous page, or None for the first page
+    :type cursor: str or None
+    :param size: Maximum number of queues on the page
+    :type size: int
+
+    :return: A tuple of the queues on the page (with their group and ``path`` attached)
+             and the cursor of the next page, or None if this is the last page
+    :rtype: tuple
+    """
+    return _finish_queues_page(list(_group_queues_query(group_id, cursor)[:size + 1]), size)
+
+
+async def agroup_queues_page(group_id, cursor=None, size=50):
+    """
+    Asynchronous version of :func:`group_queues_page`, using the async ORM interface
+
+    :param group_id: ID of the group whose queues are listed
+    :type group_id: int
+    :param cursor: Cursor returned with the previous page, or None for the first page
+    :type cursor: str or None
+    :param size: Maximum number of queues on the page
+    :type size: int
+
+    :return: A tuple of the queues on the page and the cursor of the next page, or None
+    :rtype: tuple
+    """
+    return _finish_queues_page([queues async for queues in _group_queues_query(group_id, cursor)[:size + 1]], size)
+
+
+def enqueue(queue_id, user_id):
+    """
+    Appends a user to the tail of a queue
+
+    The operation is idempotent: a user who is already in the queue keeps their place
+
+    :param queue_id: ID of the queue to which the user should be added
+    :type queue_id: int
+    :param user_id: ID of the user profile to be added
+    :type user_id: int
+
+    :return: A tuple of the user's record and a boolean telling whether it was created
+    :rtype: tuple
+    :raises app_queue.models.Queues.DoesNotExist: If the queue does not exist
+    """
+    with transaction.atomic():
+        queues = _lock_queue(queue_id)
+        record = Queue.objects.filter(queue_id=queue_id, user_id=user_id).first()
+        if record is not None:
+            return record, False
+        record = Queue.objects.create(queue_id=queue_id, user_id=user_id, position=queues.next_position)
+        at = history.record(queue_id, QueueEvent.Kind.ENQUEUED, [(user_id, queues.next_position)])
+        analytics.record(queues, enqueued=1, at=at)
+        version = _commit_change(queues, advance_tail=1)
+        name = UserProfile.objects.filter(pk=user_id).values_list('first_name', 'last_name').first()
+        _publish(queue_id, {'type': 'enqueued', 'user': user_id, 'name': ' '.join(name or ())}, version)
+        return record, True
+
+
+def remove(queue_id, user_id):
+    """
+    Removes a user from a queue by primary key, reading the time they joined first
+
+    :param queue_id: ID of the queue from which the user should be removed
+    :type queue_id: int
+    :param user_id: ID of the user profile to be removed
+    :type user_id: int
+
+    :return: True if the user was in the queue, False otherwise
+    :rtype: bool
+    :raises app_queue.models.Queues.DoesNotExist: If the queue does not exist
+    """
+    with transaction.atomic():
+        queues = _lock_queue(queue_id)
+        record = Queue.objects.filter(queue_id=queue_id, user_id=user_id).values_list('pk', 'enqueued_at').first()
+        if record is not None:
+            Queue.objects.filter(pk=record[0]).delete()
+            at = history.record(queue_id, QueueEvent.Kind.REMOVED, [(user_id, None)])
+            analytics.record(queues, joined=[record[1]], at=at)
+            version = _commit_change(queues)
+            _publish(queue_id, {'type': 'removed', 'user': user_id}, version)
+        return record is not None
+
+
+def move_to_tail(queue_id, user_id):
+    """
+    Moves a user who is already in a queue to its tail
+
+    The user's record is updated in place instead of being deleted and re-created
+
+    :param queue_id: ID of the queue in which the user should be moved
+    :type queue_id: int
+    :param user_id: ID of the user profile to be moved
+    :type user_id: int
+
+    :return: True if the user was in the queue, False otherwise
+    :rtype: bool
+    :raises app_queue.models.Queues.DoesNotExist: If the queue does not exist
+    """
+    with transaction.atomic():
+        queues = _lock_queue(queue_id)
+        updated = Queue.objects.filter(queue_id=queue_id, user_id=user_id).update(position=queues.next_position)
+        if updated:
+            history.record(queue_id, QueueEvent.Kind.REQUEUED, [(user_id, queues.next_position)])
+            version = _commit_change(queues, advance_tail=1)
+            _publish(queue_id, {'type': 'moved', 'user': user_id}, version)
+        return updated > 0
+
+
+def enqueue_many(queue_id, user_ids):
+    """
+    Appends several users to the tail of a queue in the given order with a single INSERT
+
+    Users who are already in the queue keep their place, and so do repeated IDs
+
+    :param queue_id: ID of the queue to which the users should be added
+    :type queue_id: int
+    :param user_ids: IDs of the user profiles to be added
+    :type user_ids: list
+
+    :return: IDs of the users who were added
+    :rtype: list
+    :raises app_queue.models.Queues.DoesNotExist: If the queue does not exist
+    :raises app_queue.models.UserProfile.DoesNotExist: If a user profile does not exist
+    """
+    with transaction.atomic():
+        queues = _lock_queue(queue_id)
+        if UserProfile.objects.filter(pk__in=user_ids).count() != len(set(user_ids)):
+            raise UserProfile.DoesNotExist('No such user.')
+        present = set(Queue.objects.filter(queue_id=queue_id, user_id__in=user_ids).values_list('user_id', flat=True))
+        added = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in present]
+        if added:
+            positions = [(user_id, queues.next_position + n * POSITION_GAP) for n, user_id in enumerate(added)]
+            Queue.objects.bulk_create([
+                Queue(queue_id=queue_id, user_id=user_id, position=position) for user_id, position in positions
+            ])
+            at = history.record(queue_id, QueueEvent.Kind.ENQUEUED, positions)
+            analytics.record(queues, enqueued=len(added), at=at)
+            version = _commit_change(queues, advance_tail=len(added))
+            _publish(queue_id, {'type': 'resync'}, version)
+        return added
+
+
+def remove_many(queue_id, user_ids=None, count=None):
+    """
+    Removes several users from a queue with a single DELETE statement
+
+    The users are given either by their IDs or by their number, counted from the head.
+    They are read before the removal, to be written to the event log and the rollups
+
+    :param queue_id: ID of the queue from which the users should be removed
+    :type queue_id: int
+    :param user_ids: IDs of the user profiles to be removed
+    :type user_ids: list or None
+    :param count: Number of users to be removed from the head of the queue
+    :type count: int or None
+
+    :return: Number of users removed
+    :rtype: int
+    :raises app_queue.models.Queues.DoesNotExist: If the queue does not exist
+    """
+    with transaction.atomic():
+        queues = _lock_queue(queue_id)
+        records = Queue.objects.filter(queue_id=queue_id)
+        if user_ids is not None:
+            records = records.filter(user_id__in=user_ids)
+        if count is not None:
+            head = Queue.objects.filter(queue_id=queue_id).order_by('position', 'pk')[:count]
+            records = records.filter(pk__in=head.values('pk'))
+        removed = dict(records.values_list('user_id', 'enqueued_at'))
+        if not removed:
+            return 0
+        deleted, _ = Queue.objects.filter(queue_id=queue_id, user_id__in=list(removed)).delete()
+        at = history.record(queue_id, QueueEvent.Kind.REMOVED, [(user_id, None) for user_id in removed])
+        analytics.record(queues, joined=removed.values(), at=at)
+        version = _commit_change(queues)
+        _publish(queue_id, {'type': 'resync'}, version)
+        return deleted
+
+
+def _renumber(queue_id, user_ids):
+    """
+    Spreads the records of a locked queue :data:`POSITION_GAP` apart in the given order
+
+    The positions are rewritten by a single UPDATE statement and the tail counter is moved
+    right after the last record
+
+    :param queue_id: ID of the queue, previously locked with :func:`_lock_queue`
+    :type queue_id: int
+    :param user_ids: IDs of every user profile in the queue, in order
+    :type user_ids: list
+    """
+    if user_ids:
+        Queue.objects.filter(queue_id=queue_id).update(position=Case(
+            *[When(user_id=user_id, then=Value(n * POSITION_GAP)) for n, user_id in enumerate(user_ids)]))
+    Queues.objects.filter(pk=queue_id).update(next_position=len(user_ids) * POSITION_GAP)
+
+
+def reorder(queue_id, user_ids):
+    """
+    Puts the users of a queue in a new order with a single UPDATE statement
+
+    The positions are renumbered in SQL, so the cost does not depend on how many
+    records change place
+
+    :param queue_id: ID of the queue to be reordered
+    :type queue_id: int
+    :param user_ids: IDs of every user profile in the queue, in the new order
+    :type user_ids: list
+
+    :raises app_queue.models.Queues.DoesNotExist: If the queue does not exist
+    :raises ValueError: If the IDs are not exactly the users in the queue
+    """
+    with transaction.atomic():
+        queues = _lock_queue(queue_id)
+        if len(set(user_ids)) != len(user_ids) or \
+                set(Queue.objects.filter(queue_id=queue_id).values_list('user_id', flat=True)) != set(user_ids):
+            raise ValueError('The new order must list every user in the queue exactly once.')
+        _renumber(queue_id, user_ids)
+        history.record(queue_id, QueueEvent.Kind.REQUEUED,
+                       [(user_id, n * POSITION_GAP) for n, user_id in enumerate(user_ids)])
+        version = _commit_change(queues)
+        _publish(queue_id, {'type': 'resync'}, version)
+
+
+def compact(queue_id):
+    """
+    Spreads the records of a queue :data:`POSITION_GAP` apart again, keeping their order
+
+    Removals and moves leave the positions sparse and the tail counter growing, and inserts
+    between neighbours use up the gaps. Compaction restores the room between the records.
+    The order is unchanged, so the version of the queue is kept
+
+    :param queue_id: ID of the queue to be compacted
+    :type queue_id: int
+
+    :return: Number of records in the queue
+    :rtype: int
+    :raises app_queue.models.Queues.DoesNotExist: If the queue does not exist
+    """
+    with transaction.atomic():
+        _lock_queue(queue_id)
+        user_ids = list(Queue.objects.filter(queue_id=queue_id).order_by('position', 'pk').values_list('user_id', flat=True))
+        _renumber(queue_id, user_ids)
+        history.record(queue_id, QueueEvent.Kind.COMPACTED, [(None, POSITION_GAP)])
+        return len(user_ids)
+
+
+def pop_head(queue_id):
+    """
+    Removes the user at the head of a queue
+
+    The head is found through the ``(queue, position)`` index and removed by primary key,
+    so the cost does not depend on the length of the queue
+
+    :param queue_id: ID of the queue
+    :type queue_id: int
+
+    :return: ID of the user profile that was removed, or None if the queue is empty
+    :rtype: int or None
+    :raises app_queue.models.Queues.DoesNotExist: If the queue does not exist
+    """
+    with transaction.atomic():
+        queues = _lock_queue(queue_id)
+        head = Queue.objects.filter(queue_id=queue_id).order_by('position', 'pk').values_list('pk', 'user_id', 'enqueued_at').first()
+        if head is None:
+            return None
+        pk, user_id, enqueued_at = head
+        Queue.objects.filter(pk=pk).delete()
+        at = history.record(queue_id, QueueEvent.Kind.REMOVED, [(user_id, None)])
+        analytics.record(queues, joined=[enqueued_at], at=at)
+        version = _commit_change(queues)
+        _publish(queue_id, {'type': 'removed', 'user': user_id}, version)
+        return user_id
+
+
+def dequeue_next(queue_ids, count, policy='round_robin', weights=None):
+    """
+    Removes the next ``count`` users across several queues, as chosen by
+    :func:`app_queue.scheduling.next_up`
+
+    The queues are locked by a single statement, in the order of their IDs so that calls over
+    overlapping sets of queues cannot deadlock, and the users are chosen while the locks are
+    held, so concurrent calls never get the same user. The chosen users are removed by a
+    single DELETE; only the queues that lost a user get a new version. The rollups of the
+    groups of the queues are written last, in the order of the groups, so calls over queues of
+    the same groups lock them in the same order as well
+
+    :param queue_ids: IDs of the queues, in the order in which ties are broken
+    :type queue_ids: list
+    :param count: Number of users to remove
+    :type count: int
+    :param policy: Name of the scheduling policy, a key of :data:`app_queue.scheduling.POLICIES`
+    :type policy: str
+    :param weights: Weights of the queues of the 'weighted' policy, by queue ID
+    :type weights: dict or None
+
+    :return: The removed users, in the order in which they are to be served
+    :rtype: list
+    :raises app_queue.models.Queues.DoesNotExist: If a queue does not exist
+    :raises ValueError: If the policy is unknown or a weight is not positive
+    """
+    with transaction.atomic():
+        locked = list(Queues.objects.select_for_update().filter(pk__in=queue_ids).order_by('pk').only('pk', 'next_position', 'version', 'group'))
+        if len(locked) != len(set(queue_ids)):
+            raise Queues.DoesNotExist('No such queue.')
+        chosen = scheduling.next_up(queue_ids, count, policy, weights)
+        removed = defaultdict(dict)
+        for entry in chosen:
+            removed[entry.queue_id][entry.user_id] = entry.enqueued_at
+        if removed:
+            Queue.objects.filter(reduce(or_, [Q(queue_id=queue_id, user_id__in=list(user_ids))
+                                              for queue_id, user_ids in removed.items()])).delete()
+        changes, at = [], None
+        for queues in locked:
+            user_ids = list(removed.get(queues.pk, ()))
+            if user_ids:
+                at = history.record(queues.pk, QueueEvent.Kind.REMOVED, [(user_id, None) for user_id in user_ids], at=at)
+                changes.append((queues, 0, removed[queues.pk].values()))
+                version = _commit_change(queues)
+                _publish(queues.pk, {'type': 'removed', 'user': user_ids[0]} if len(user_ids) == 1 else {'type': 'resync'}, version)
+        analytics.record_many(changes, at=at)
+        return chosen
+
+
+def insert_after(queue_id, user_id, after_user_id=None):
+    """
+    Puts a user right after another user of a queue, or at its head
+
+    The user gets the position halfway between the neighbours, so only their own record
+    is written. A user already in the queue is moved there. When the neighbours are adjacent
+    the queue is compacted first, which is rare since positions are handed out
+    :data:`POSITION_GAP` apart
+
+    :param queue_id: ID of the queue
+    :type queue_id: int
+    :param user_id: ID of the user profile to be put in place
+    :type user_id: int
+    :param after_user_id: ID of the user profile after which the user should be put,
+                          or None to put them at the head
+    :type after_user_id: int or None
+
+    :return: True if the user was put in place, False if ``after_user_id`` is not in the queue
+    :rtype: bool
+    :raises app_queue.models.Queues.DoesNotExist: If the queue does not exist
+    :raises django.db.IntegrityError: If the user profile does not exist
+    """
+    with transaction.atomic():
+        queues = _lock_queue(queue_id)
+        if user_id == after_user_id:
+            return Queue.objects.filter(queue_id=queue_id, user_id=user_id).exists()
+        records = Queue.objects.filter(queue_id=queue_id).exclude(user_id=user_id).order_by('position', 'pk')
+        for attempt in range(2):
+            if after_user_id is None:
+                before = None
+                after = records.values_list('position', flat=True).first()
+                position = queues.next_position if after is None else after - POSITION_GAP
+            else:
+                before = Queue.objects.filter(queue_id=queue_id, user_id=after_user_id).values_list('position', flat=True).first()
+                if before is None:
+                    return False
+                after = records.filter(position__gt=before).values_list('position', flat=True).first()
+                position = queues.next_position if after is None else (before + after) // 2
+            if position != before and position != after:
+                break
+            compact(queue_id)
+            queues = _lock_queue(queue_id)
+
+        updated = Queue.objects.filter(queue_id=queue_id, user_id=user_id).update(position=position)
+        if not updated:
+            Queue.objects.create(queue_id=queue_id, user_id=user_id, position=position)
+        at = history.record(queue_id, QueueEvent.Kind.REQUEUED if updated else QueueEvent.Kind.ENQUEUED, [(user_id, position)])
+        if not updated:
+            analytics.record(queues, enqueued=1, at=at)
+        version = _commit_change(queues, advance_tail=int(position == queues.next_position))
+        _publish(queue_id, {'type': 'resync'}, version)
+        return True
@@ -0,0 +1,124 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import analytics, caching, services
+from .models import Queue, Queues, QueueCheckpoint, QueueEvent, StudyGroup, UserProfile
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def profile_changed(sender, instance, **kwargs):
+    """
+    Drops the cached profile of a user when it is saved or deleted
+
+    :param sender: The model class
+    :type sender: type
+    :param instance: The saved or deleted profile
+    :type instance: app_queue.models.UserProfile
+    """
+    caching.invalidate_profile(instance.user_id)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(pre_delete, sender=UserProfile)
+def profile_shown_changed(sender, instance, created=False, **kwargs):
+    """
+    Bumps the version of the queues a user is in when their profile is saved or deleted, as
+    their pages show the name of the user
+
+    :param sender: The model class
+    :type sender: type
+    :param instance: The saved or deleted profile
+    :type instance: app_queue.models.UserProfile
+    :param created: Whether the profile was created
+    :type created: bool
+    """
+    if not created:
+        services.touch_queues(Queues.objects.filter(pk__in=Queue.objects.filter(user=instance).values('queue')))
+
+
+@receiver(pre_save, sender=Queues)
+def queue_saving(sender, instance, **kwargs):
+    """
+    Drops the cached listing of the group a queue is moved out of
+
+    :param sender: The model class
+    :type sender: type
+    :param instance: The queue being saved
+    :type instance: app_queue.models.Queues
+    """
+    if not instance._state.adding:
+        group_id = Queues.objects.filter(pk=instance.pk).values_list('group_id', flat=True).first()
+        if group_id is not None and group_id != instance.group_id:
+            caching.invalidate_queues(group_id)
+
+
+@receiver(post_save, sender=Queues)
+def queue_changed(sender, instance, created, **kwargs):
+    """
+    Bumps the version of a queue when it is edited and drops the cached listing of its group,
+    as their pages show its name, group and description
+
+    :param sender: The model class
+    :type sender: type
+    :param instance: The saved queue
+    :type instance: app_queue.models.Queues
+    :param created: Whether the queue was created
+    :type created: bool
+    """
+    if not created:
+        instance.version = services.touch_queues(Queues.objects.filter(pk=instance.pk)).get(instance.pk, instance.version)
+        caching.invalidate_queues(instance.group_id)
+
+
+@receiver(post_save, sender=StudyGroup)
+def group_changed(sender, instance, created, **kwargs):
+    """
+    Bumps the version of the queues of a group when it is renamed, as their rows on the
+    listing show its name
+
+    :param sender: The model class
+    :type sender: type
+    :param instance: The saved group
+    :type instance: app_queue.models.StudyGroup
+    :param created: Whether the group was created
+    :type created: bool
+    """
+    if not created:
+        services.touch_queues(Queues.objects.filter(group=instance))
+        caching.invalidate_queues(instance.pk)
+
+
+@receiver(pre_delete, sender=UserProfile)
+def profile_purged(sender, instance, **kwargs):
+    """
+    Rebuilds the analytics of the queues a user has events in when their profile is deleted
+
+    The events of the user are deleted together with the profile, so the checkpoints of those
+    queues, which may include them, are dropped and the rollups of the queues and of their
+    groups are rebuilt from the remaining events once the deletion commits
+
+    :param sender: The model class
+    :type sender: type
+    :param instance: The deleted profile
+    :type instance: app_queue.models.UserProfile
+    """
+    queue_ids = list(QueueEvent.objects.filter(user=instance).values_list('queue', flat=True).distinct())
+    if queue_ids:
+        QueueCheckpoint.objects.filter(queue__in=queue_ids).delete()
+        transaction.on_commit(lambda: analytics.backfill([], queue_ids=queue_ids))
+
+
+@receiver(post_delete, sender=Queues)
+def queue_purged(sender, instance, **kwargs):
+    """
+    Rebuilds the analytics of the group of a queue once the deletion of the queue commits, as
+    its events and its own rollups are deleted with it
+
+    :param sender: The model class
+    :type sender: type
+    :param instance: The deleted queue
+    :type instance: app_queue.models.Queues
+    """
+    if instance.group_id is not None:
+        transaction.on_commit(lambda: analytics.backfill([instance.group_id]))
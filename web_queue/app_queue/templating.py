@@ -0,0 +1,82 @@
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+
+# List collecting the durations of the template renders of the current request, set by
+# app_queue.middleware.InstrumentationMiddleware, or None outside of a request
+render_timings = ContextVar('render_timings', default=None)
+
+
+class InstrumentedTemplate:
+    """
+    Wrapper of a template of the Django template backend timing its renders.
+    """
+    def __init__(self, template):
+        """
+        Initialize the wrapper.
+
+        :param template: The wrapped template.
+        :type template: django.template.backends.django.Template
+        """
+        self.template = template
+        self.origin = template.origin
+
+    def render(self, context=None, request=None):
+        """
+        Render the template and add the duration to the timings of the current request.
+
+        :param context: The template context.
+        :type context: dict or None
+        :param request: The current request.
+        :type request: django.http.HttpRequest or None
+        :return: The rendered template.
+        :rtype: django.utils.safestring.SafeString
+        """
+        timings = render_timings.get()
+        began = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            if timings is not None:
+                timings.append(time.perf_counter() - began)
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, timing every render of a top-level template.
+    """
+    def from_string(self, template_code):
+        """
+        Create a template from a string.
+
+        :param template_code: The source of the template.
+        :type template_code: str
+        :return: The timed template.
+        :rtype: app_queue.templating.InstrumentedTemplate
+        """
+        return InstrumentedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        """
+        Load a template by its name.
+
+        :param template_name: The name of the template.
+        :type template_name: str
+        :return: The timed template.
+        :rtype: app_queue.templating.InstrumentedTemplate
+        """
+        return InstrumentedTemplate(super().get_template(template_name))
+
+
+def fragment_cache(request):
+    """
+    Context processor giving the templates the timeout of their cached fragments.
+
+    :param request: The current request.
+    :type request: django.http.HttpRequest
+    :return: The 'fragment_cache_timeout' in seconds.
+    :rtype: dict
+    """
+    return {'fragment_cache_timeout': settings.TEMPLATE_FRAGMENT_CACHE_TIMEOUT}
@@ -1,3 +1,1888 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import os
+import re
+import tempfile
+import threading
+import tracemalloc
+from datetime import timedelta
+from io import StringIO
+from importlib.util import find_spec
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.signals import request_finished, request_started
+from django.shortcuts import render as render_page
+from django.template.loader import render_to_string
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F, Q
+from django.test import AsyncClient, Client, LiveServerTestCase, RequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import analytics, benchmarks, caching, history, metrics, scheduling, services, views
+from .forms import UserProfileForm
+from .broadcast import LocalBroadcast, check_live_updates, get_broadcast
+from .middleware import ProfileMiddleware
+from .models import StudyGroup, UserProfile, Queues, Queue, QueueCheckpoint, QueueEvent, QueueRollup
+
+
+def make_profile(group, username, first_name='First', last_name='Last'):
+    """
+    Creates a user together with its profile in the given study group
+
+    :param group: Study group of the new profile
+    :type group: app_queue.models.StudyGroup
+    :param username: Username of the new user
+    :type username: str
+
+    :return: The created user profile
+    :rtype: app_queue.models.UserProfile
+    """
+    user = User.objects.create(username=username)
+    return UserProfile.objects.create(user=user, group=group, first_name=first_name, last_name=last_name)
+
+
+class QueueTestCase(TestCase):
+    """
+    Base class of the tests, starting every test with empty caches
+    """
+    def setUp(self):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        caching.get_snapshot_cache().clear()
+
+
+class QueueViewTests(QueueTestCase):
+    """
+    Tests for the queue detail view
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group')
+        self.profile = make_profile(self.group, 'owner', 'Owner', 'Profile')
+        self.queues = Queues.objects.create(name='Lab', group=self.group, creator=self.profile)
+        self.client.force_login(self.profile.user)
+
+    def fill(self, count):
+        """
+        Appends ``count`` new profiles to the queue with gaps between their positions
+        """
+        start = Queue.objects.filter(queue=self.queues).count()
+        for i in range(start, start + count):
+            profile = make_profile(self.group, f'student{i}', f'Name{i}', f'Surname{i}')
+            Queue.objects.create(queue=self.queues, user=profile, position=i * 10)
+
+    def count_queries(self):
+        caching.get_snapshot_cache().clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('queue', args=[self.queues.pk]))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_records_are_ordered_and_numbered(self):
+        first = make_profile(self.group, 'first', 'Ann', 'A')
+        second = make_profile(self.group, 'second', 'Bob', 'B')
+        Queue.objects.create(queue=self.queues, user=second, position=7)
+        Queue.objects.create(queue=self.queues, user=first, position=3)
+
+        response = self.client.get(reverse('queue', args=[self.queues.pk]))
+        entries = response.context['entries']
+
+        self.assertEqual([e.user_id for e in entries], [first.pk, second.pk])
+        self.assertEqual([e.position for e in entries], [1, 2])
+        self.assertContains(response, 'Ann A')
+
+    def test_query_count_does_not_grow_with_queue_length(self):
+        self.fill(2)
+        small = self.count_queries()
+        self.fill(40)
+        large = self.count_queries()
+        self.assertEqual(small, large)
+
+
+class QueueServicesTests(QueueTestCase):
+    """
+    Tests for the queue operations in :mod:`app_queue.services`
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group')
+        self.queues = Queues.objects.create(name='Lab', group=self.group)
+        self.profiles = [make_profile(self.group, f'student{i}') for i in range(3)]
+
+    def order(self):
+        return list(Queue.objects.filter(queue=self.queues).order_by('position').values_list('user', flat=True))
+
+    def test_enqueue_appends_once(self):
+        first, second, _ = self.profiles
+        self.assertTrue(services.enqueue(self.queues.pk, first.pk)[1])
+        self.assertTrue(services.enqueue(self.queues.pk, second.pk)[1])
+        self.assertFalse(services.enqueue(self.queues.pk, first.pk)[1])
+        self.assertEqual(self.order(), [first.pk, second.pk])
+
+    def test_move_to_tail_and_remove(self):
+        for profile in self.profiles:
+            services.enqueue(self.queues.pk, profile.pk)
+        first, second, third = self.profiles
+
+        self.assertTrue(services.move_to_tail(self.queues.pk, first.pk))
+        self.assertEqual(self.order(), [second.pk, third.pk, first.pk])
+        self.assertTrue(services.remove(self.queues.pk, third.pk))
+        self.assertFalse(services.remove(self.queues.pk, third.pk))
+        self.assertFalse(services.move_to_tail(self.queues.pk, third.pk))
+        self.assertEqual(self.order(), [second.pk, first.pk])
+
+    def test_unknown_queue(self):
+        with self.assertRaises(Queues.DoesNotExist):
+            services.enqueue(self.queues.pk + 1, self.profiles[0].pk)
+
+    def test_pop_head(self):
+        first, second, _ = self.profiles
+        services.enqueue(self.queues.pk, first.pk)
+        services.enqueue(self.queues.pk, second.pk)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(services.pop_head(self.queues.pk), first.pk)
+        deletes = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('DELETE')]
+        self.assertEqual(len(deletes), 1)
+        self.assertEqual(self.order(), [second.pk])
+        self.assertEqual(services.pop_head(self.queues.pk), second.pk)
+        self.assertIsNone(services.pop_head(self.queues.pk))
+
+    def test_insert_after(self):
+        first, second, third = self.profiles
+        services.enqueue(self.queues.pk, first.pk)
+        services.enqueue(self.queues.pk, second.pk)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertTrue(services.insert_after(self.queues.pk, third.pk, first.pk))
+        writes = [q['sql'] for q in ctx.captured_queries
+                  if q['sql'].startswith(('INSERT INTO "app_queue_queue"', 'UPDATE "app_queue_queue"'))]
+        self.assertEqual(len(writes), 2)  # the UPDATE finding no record, then the INSERT
+        self.assertEqual(self.order(), [first.pk, third.pk, second.pk])
+
+        self.assertTrue(services.insert_after(self.queues.pk, second.pk, None))
+        self.assertEqual(self.order(), [second.pk, first.pk, third.pk])
+        self.assertTrue(services.insert_after(self.queues.pk, second.pk, third.pk))
+        self.assertEqual(self.order(), [first.pk, third.pk, second.pk])
+        self.assertFalse(services.insert_after(self.queues.pk, second.pk, self.profiles[0].pk + 100))
+
+    def test_insert_after_compacts_when_out_of_room(self):
+        first, second, third = self.profiles
+        Queue.objects.create(queue=self.queues, user=first, position=5)
+        Queue.objects.create(queue=self.queues, user=second, position=6)
+        Queues.objects.filter(pk=self.queues.pk).update(next_position=7)
+
+        self.assertTrue(services.insert_after(self.queues.pk, third.pk, first.pk))
+        self.assertEqual(self.order(), [first.pk, third.pk, second.pk])
+        positions = list(Queue.objects.filter(queue=self.queues).order_by('position').values_list('position', flat=True))
+        self.assertEqual(positions, [0, services.POSITION_GAP // 2, services.POSITION_GAP])
+
+    def test_compact_queues_command(self):
+        for profile in self.profiles:
+            services.enqueue(self.queues.pk, profile.pk)
+        for _ in range(10):
+            services.move_to_tail(self.queues.pk, self.profiles[0].pk)
+        before = self.order()
+        other = Queues.objects.create(name='Untouched', group=self.group)
+        services.enqueue(other.pk, self.profiles[0].pk)
+
+        out = StringIO()
+        call_command('compact_queues', stdout=out)
+        self.assertIn('Compacted 1 queue(s).', out.getvalue())
+        self.assertEqual(self.order(), before)
+        positions = list(Queue.objects.filter(queue=self.queues).order_by('position').values_list('position', flat=True))
+        self.assertEqual(positions, [n * services.POSITION_GAP for n in range(3)])
+        self.queues.refresh_from_db()
+        self.assertEqual(self.queues.next_position, 3 * services.POSITION_GAP)
+
+        services.enqueue(self.queues.pk, make_profile(self.group, 'late').pk)
+        self.assertEqual(len(self.order()), 4)
+
+
+class QueueHistoryTests(QueueTestCase):
+    """
+    Tests for the queue event log and its replay in :mod:`app_queue.history`
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group')
+        self.queues = Queues.objects.create(name='Lab', group=self.group)
+        self.profiles = [make_profile(self.group, f'student{i}') for i in range(6)]
+
+    def live_order(self):
+        return list(Queue.objects.filter(queue=self.queues).order_by('position', 'pk').values_list('user', flat=True))
+
+    def live_positions(self):
+        return dict(Queue.objects.filter(queue=self.queues).values_list('user', 'position'))
+
+    def test_replay_rebuilds_every_operation(self):
+        ids = [profile.pk for profile in self.profiles]
+        queue_id = self.queues.pk
+        services.enqueue(queue_id, ids[0])
+        services.enqueue_many(queue_id, ids[1:4])
+        services.move_to_tail(queue_id, ids[0])
+        services.insert_after(queue_id, ids[4], ids[1])
+        services.reorder(queue_id, [ids[3], ids[1], ids[4], ids[2], ids[0]])
+        services.insert_after(queue_id, ids[5], None)
+        services.remove_many(queue_id, count=2)
+        services.pop_head(queue_id)
+        services.remove(queue_id, ids[2])
+        services.compact(queue_id)
+
+        replayed = history.replay(queue_id)
+        self.assertEqual(replayed.order(), self.live_order())
+        self.assertEqual({user_id: entry[0] for user_id, entry in replayed.entries.items()}, self.live_positions())
+        self.assertEqual((replayed.stats['enqueued'], replayed.stats['removed']), (6, 4))
+
+    def test_replay_continues_from_the_checkpoint_without_reading_records(self):
+        first, second, third = [profile.pk for profile in self.profiles[:3]]
+        services.enqueue_many(self.queues.pk, [first, second])
+        history.replay(self.queues.pk)
+        checkpoint = QueueCheckpoint.objects.get(queue=self.queues)
+
+        services.remove(self.queues.pk, first)
+        services.enqueue(self.queues.pk, third)
+        with CaptureQueriesContext(connection) as ctx:
+            replayed = history.replay(self.queues.pk)
+        self.assertEqual(replayed.order(), [second, third])
+        self.assertFalse(any('"app_queue_queue"' in q['sql'] for q in ctx.captured_queries))
+        self.assertIn(f'> {checkpoint.event_id}', ctx.captured_queries[1]['sql'])
+
+        self.assertEqual(history.replay(self.queues.pk).to_json(), replayed.to_json())
+        self.assertGreater(QueueCheckpoint.objects.get(queue=self.queues).event_id, checkpoint.event_id)
+
+    def test_wait_statistics(self):
+        first, second = [profile.pk for profile in self.profiles[:2]]
+        began = timezone.now()
+        with mock.patch('app_queue.history.timezone.now', side_effect=[
+                began, began + timedelta(seconds=10), began + timedelta(seconds=30), began + timedelta(seconds=60)]):
+            services.enqueue(self.queues.pk, first)
+            services.enqueue(self.queues.pk, second)
+            services.pop_head(self.queues.pk)
+            services.pop_head(self.queues.pk)
+
+        replayed = history.replay(self.queues.pk)
+        self.assertEqual(replayed.stats['max_wait'], 50)
+        self.assertEqual(replayed.mean_wait, 40)
+
+    def test_failed_change_writes_no_event(self):
+        with self.assertRaises(UserProfile.DoesNotExist):
+            services.enqueue_many(self.queues.pk, [self.profiles[0].pk, self.profiles[-1].pk + 1])
+        self.assertFalse(QueueEvent.objects.exists())
+
+    def test_events_are_append_only(self):
+        services.enqueue(self.queues.pk, self.profiles[0].pk)
+        event = QueueEvent.objects.get()
+        event.position = 0
+        with self.assertRaises(ValueError):
+            event.save()
+
+    def test_queue_stats_command(self):
+        services.enqueue(self.queues.pk, self.profiles[0].pk)
+        out = StringIO()
+        call_command('queue_stats', '--queue', str(self.queues.pk), stdout=out)
+        self.assertEqual(json.loads(out.getvalue())[0]['length'], 1)
+
+
+class QueueAnalyticsTests(QueueTestCase):
+    """
+    Tests for the wait-time rollups of :mod:`app_queue.analytics`, their dashboards and their backfill
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group')
+        self.profiles = [make_profile(self.group, f'student{i}') for i in range(6)]
+        self.queues = Queues.objects.create(name='Lab', group=self.group, creator=self.profiles[0])
+        self.other = Queues.objects.create(name='Other lab', group=self.group)
+
+    def rollups(self, **scope):
+        fields = ['hour', 'enqueued', 'removed', *(field for _, field, _ in analytics.WAIT_BUCKETS)]
+        return [dict(row, total_wait=round(row['total_wait']), max_wait=round(row['max_wait'])) for row in
+                QueueRollup.objects.filter(**scope).order_by('hour').values('total_wait', 'max_wait', *fields)]
+
+    def test_rollups_follow_joins_and_removals(self):
+        ids = [profile.pk for profile in self.profiles]
+        services.enqueue_many(self.queues.pk, ids[:5])
+        services.insert_after(self.other.pk, ids[5])
+        now = timezone.now()
+        for user_id, minutes in zip(ids, [0, 3, 10, 20, 90]):
+            Queue.objects.filter(queue=self.queues, user_id=user_id).update(enqueued_at=now - timedelta(minutes=minutes))
+
+        services.pop_head(self.queues.pk)
+        services.remove(self.queues.pk, ids[1])
+        services.remove_many(self.queues.pk, user_ids=[ids[2]])
+        services.dequeue_next([self.queues.pk, self.other.pk], 2)
+
+        [rollup] = QueueRollup.objects.filter(queue=self.queues)
+        self.assertEqual((rollup.enqueued, rollup.removed), (5, 4))
+        self.assertEqual([rollup.wait_1m, rollup.wait_5m, rollup.wait_15m, rollup.wait_30m, rollup.wait_1h, rollup.wait_longer],
+                         [1, 1, 1, 1, 0, 0])
+        self.assertAlmostEqual(rollup.total_wait, (3 + 10 + 20) * 60, delta=5)
+        self.assertAlmostEqual(rollup.max_wait, 20 * 60, delta=5)
+
+        [group] = QueueRollup.objects.filter(group=self.group)
+        self.assertEqual((group.enqueued, group.removed, group.wait_1m), (6, 5, 2))
+        self.assertEqual(analytics.dashboard(group_id=self.group.pk)['totals']['length'], 1)
+
+    def test_dashboard_sums_up_the_hours(self):
+        now = timezone.now()
+        hour = analytics.hour_of(now)
+        QueueRollup.objects.create(queue=self.queues, hour=hour - timedelta(hours=30), enqueued=5, removed=1, total_wait=100, max_wait=100, wait_5m=1)
+        QueueRollup.objects.create(queue=self.queues, hour=hour - timedelta(hours=1), enqueued=2, removed=3, total_wait=7500, max_wait=7000, wait_longer=3)
+
+        stats = analytics.dashboard(queue_id=self.queues.pk, hours=3, now=now)
+        self.assertEqual([row['hour'] for row in stats['hours']], [hour - timedelta(hours=n) for n in (2, 1, 0)])
+        self.assertEqual([row['length'] for row in stats['hours']], [4, 3, 3])
+        self.assertEqual([row['removed'] for row in stats['hours']], [0, 3, 0])
+        self.assertEqual(stats['hours'][1]['mean_wait'], 2500)
+        self.assertEqual(stats['totals']['mean_wait'], 1900)
+        self.assertEqual(stats['totals']['max_wait'], 7000)
+        self.assertEqual(dict(stats['histogram']), {'Up to 1 min': 0, '1 to 5 min': 1, '5 to 15 min': 0, '15 to 30 min': 0,
+                                                    '30 min to 1 h': 0, 'Over 1 h': 3})
+
+    def test_dashboards_read_only_the_rollups(self):
+        services.enqueue_many(self.queues.pk, [profile.pk for profile in self.profiles])
+        services.pop_head(self.queues.pk)
+        self.client.force_login(self.profiles[0].user)
+        url = reverse('queue_analytics', args=[self.queues.pk])
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, {'hours': 48})
+        self.assertEqual(len(response.context['stats']['hours']), 48)
+        self.assertEqual(response.context['stats']['totals']['length'], 5)
+        tables = [q['sql'] for q in ctx.captured_queries if 'app_queue_queue' in q['sql']]
+        self.assertEqual(len([sql for sql in tables if 'app_queue_queuerollup' in sql]), 2)
+        self.assertFalse([sql for sql in tables if '"app_queue_queue"' in sql or 'app_queue_queueevent' in sql])
+
+        self.assertEqual(self.client.get(url, {'hours': 0}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('group_analytics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('queue_analytics', args=[self.other.pk])).status_code, 403)
+        User.objects.filter(pk=self.profiles[0].user_id).update(is_staff=True)
+        response = self.client.get(reverse('group_analytics'))
+        self.assertContains(response, f'Group {self.group.pk}')
+        self.assertEqual(response.context['stats']['totals']['enqueued'], 6)
+
+    def test_backfill_rebuilds_the_live_rollups(self):
+        ids = [profile.pk for profile in self.profiles]
+        services.enqueue_many(self.queues.pk, ids[:4])
+        services.enqueue(self.other.pk, ids[4])
+        services.move_to_tail(self.queues.pk, ids[0])
+        services.pop_head(self.queues.pk)
+        services.dequeue_next([self.queues.pk, self.other.pk], 2, policy='oldest_first')
+        self.assertTrue(services.insert_after(self.queues.pk, ids[5], ids[0]))
+        other_group = StudyGroup.objects.create(name='Other group')
+        elsewhere = Queues.objects.create(name='Elsewhere', group=other_group)
+        services.enqueue(elsewhere.pk, ids[0])
+        scopes = [{'queue': self.queues}, {'queue': self.other}, {'group': self.group}]
+        live = [self.rollups(**scope) for scope in scopes]
+        QueueRollup.objects.filter(group=self.group).update(enqueued=0)
+        QueueRollup.objects.filter(queue=self.other).delete()
+
+        out = StringIO()
+        call_command('backfill_analytics', '--group', str(self.group.pk), '--chunk-size', '2', stdout=out)
+        self.assertIn('Wrote 3 rollup(s) from 10 event(s).', out.getvalue())
+        self.assertEqual([self.rollups(**scope) for scope in scopes], live)
+        self.assertEqual(QueueRollup.objects.filter(Q(queue=elsewhere) | Q(group=other_group)).count(), 2)
+
+        QueueRollup.objects.all().delete()
+        call_command('backfill_analytics', stdout=StringIO())
+        self.assertEqual([self.rollups(**scope) for scope in scopes], live)
+        self.assertEqual(QueueRollup.objects.count(), 5)
+
+    def test_deletions_purge_the_log_and_rebuild_the_rollups(self):
+        ids = [profile.pk for profile in self.profiles]
+        services.enqueue_many(self.queues.pk, ids[:3])
+        services.enqueue_many(self.other.pk, ids[1:3])
+        services.pop_head(self.queues.pk)
+        history.replay(self.queues.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profiles[1].delete()
+        self.assertFalse(QueueEvent.objects.filter(user=ids[1]).exists())
+        self.assertFalse(QueueCheckpoint.objects.exists())
+        self.assertEqual(history.replay(self.queues.pk).order(), [ids[2]])
+        totals = analytics.dashboard(group_id=self.group.pk)['totals']
+        self.assertEqual((totals['enqueued'], totals['removed'], totals['length']), (3, 1, 2))
+        self.assertEqual(analytics.dashboard(queue_id=self.other.pk)['totals']['enqueued'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.queues.delete()
+        self.assertEqual(QueueEvent.objects.count(), 1)
+        self.assertEqual([rollup['enqueued'] for rollup in self.rollups(group=self.group)], [1])
+        live = self.rollups(group=self.group)
+        analytics.backfill()
+        self.assertEqual(self.rollups(group=self.group), live)
+
+
+class BulkQueueApiTests(QueueTestCase):
+    """
+    Tests for the bulk enqueue, dequeue and reorder endpoints
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group')
+        self.creator = make_profile(self.group, 'creator')
+        self.queues = Queues.objects.create(name='Lab', group=self.group, creator=self.creator)
+        self.profiles = [make_profile(self.group, f'student{i}', 'Name', str(i)) for i in range(5)]
+        self.ids = [profile.pk for profile in self.profiles]
+        self.client.force_login(self.creator.user)
+
+    def post(self, action, body):
+        return self.client.post(reverse(f'bulk_{action}', args=[self.queues.pk]), body, content_type='application/json')
+
+    def order(self):
+        return list(Queue.objects.filter(queue=self.queues).order_by('position').values_list('user', flat=True))
+
+    def test_enqueue(self):
+        services.enqueue(self.queues.pk, self.ids[1])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post('enqueue', {'users': self.ids + [self.ids[0]]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['added'], [self.ids[0]] + self.ids[2:])
+        self.assertEqual([entry['user_id'] for entry in response.json()['entries']], self.order())
+        self.assertEqual(self.order(), [self.ids[1], self.ids[0]] + self.ids[2:])
+        inserts = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 2)  # the records, then their events
+
+        # The tail counter was advanced past every new record
+        services.enqueue(self.queues.pk, self.creator.pk)
+        self.assertEqual(self.order()[-1], self.creator.pk)
+
+    def test_enqueue_unknown_user_changes_nothing(self):
+        response = self.post('enqueue', {'users': [self.ids[0], 0]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.order(), [])
+
+    def test_dequeue(self):
+        services.enqueue_many(self.queues.pk, self.ids)
+        response = self.post('dequeue', {'count': 2})
+        self.assertEqual(response.json()['removed'], 2)
+        self.assertEqual(self.order(), self.ids[2:])
+
+        response = self.post('dequeue', {'users': [self.ids[4], self.ids[2], self.ids[0]]})
+        self.assertEqual(response.json()['removed'], 2)
+        self.assertEqual(self.order(), [self.ids[3]])
+        self.assertEqual(self.post('dequeue', {}).status_code, 400)
+
+    def test_reorder(self):
+        services.enqueue_many(self.queues.pk, self.ids)
+        new_order = list(reversed(self.ids))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post('reorder', {'users': new_order})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.order(), new_order)
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE "app_queue_queue"')]
+        self.assertEqual(len(updates), 1)
+
+        self.assertEqual(self.post('reorder', {'users': new_order[1:]}).status_code, 400)
+        self.assertEqual(self.post('reorder', {'users': new_order + new_order[:1]}).status_code, 400)
+        self.assertEqual(self.order(), new_order)
+
+    def test_only_the_creator_and_staff(self):
+        self.client.force_login(self.profiles[0].user)
+        self.assertEqual(self.post('enqueue', {'users': self.ids}).status_code, 403)
+        User.objects.filter(pk=self.profiles[0].user_id).update(is_staff=True)
+        self.assertEqual(self.post('enqueue', {'users': self.ids}).status_code, 200)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.post('enqueue', {'users': ['1']}).status_code, 400)
+        self.assertEqual(self.post('enqueue', [1]).status_code, 400)
+        self.assertEqual(self.client.get(reverse('bulk_enqueue', args=[self.queues.pk])).status_code, 405)
+        response = self.client.post(reverse('bulk_enqueue', args=[self.queues.pk + 1]), {'users': []},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+
+class SchedulerTests(QueueTestCase):
+    """
+    Tests for the multi-queue scheduler of :mod:`app_queue.scheduling` and its endpoint
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group')
+        self.creator = make_profile(self.group, 'ta')
+        self.labs = [Queues.objects.create(name=f'Lab {n}', group=self.group, creator=self.creator) for n in range(3)]
+        self.profiles = [make_profile(self.group, f'student{i}', 'Name', str(i)) for i in range(9)]
+        for n, lab in enumerate(self.labs):
+            services.enqueue_many(lab.pk, [profile.pk for profile in self.profiles[3 * n:3 * n + 3]])
+        self.lab_ids = [lab.pk for lab in self.labs]
+        self.client.force_login(self.creator.user)
+
+    def chosen(self, entries):
+        return [(self.lab_ids.index(entry.queue_id), int(entry.name.split()[1])) for entry in entries]
+
+    def test_round_robin(self):
+        self.assertEqual(self.chosen(scheduling.next_up(self.lab_ids, 5)), [(0, 0), (1, 3), (2, 6), (0, 1), (1, 4)])
+        # Ties are broken in the order of the given queues
+        self.assertEqual(self.chosen(scheduling.next_up(self.lab_ids[::-1], 2)), [(2, 6), (1, 3)])
+
+    def test_weighted(self):
+        chosen = scheduling.next_up(self.lab_ids[:2], 6, 'weighted', {self.lab_ids[0]: 2})
+        self.assertEqual(self.chosen(chosen), [(0, 0), (0, 1), (1, 3), (0, 2), (1, 4), (1, 5)])
+        with self.assertRaisesMessage(ValueError, 'The weights must be positive.'):
+            scheduling.next_up(self.lab_ids, 1, 'weighted', {self.lab_ids[0]: 0})
+
+    def test_oldest_first_keeps_the_order_of_every_queue(self):
+        now = timezone.now()
+        for n, profile in enumerate(self.profiles):
+            Queue.objects.filter(user=profile).update(enqueued_at=now - timedelta(minutes=10 * n))
+        # Student 2 waited longest, but comes after students 0 and 1 of the same queue
+        chosen = scheduling.next_up(self.lab_ids, 4, 'oldest_first')
+        self.assertEqual(self.chosen(chosen), [(2, 6), (2, 7), (2, 8), (1, 3)])
+        # A user moved to the tail keeps the time they joined, but waits behind the others
+        services.move_to_tail(self.labs[1].pk, self.profiles[3].pk)
+        self.assertEqual(self.chosen(scheduling.next_up(self.lab_ids[1:], 6, 'oldest_first')),
+                         [(2, 6), (2, 7), (2, 8), (1, 4), (1, 5), (1, 3)])
+        with self.assertRaisesMessage(ValueError, 'The policy must be one of'):
+            scheduling.next_up(self.lab_ids, 1, 'random')
+
+    def test_dequeue_next(self):
+        other = Queues.objects.create(name='Other', group=self.group)
+        services.enqueue(other.pk, self.profiles[0].pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            chosen = services.dequeue_next(self.lab_ids + [other.pk], 4)
+        self.assertEqual(self.chosen(chosen[:3]), [(0, 0), (1, 3), (2, 6)])
+        self.assertEqual((chosen[3].queue_id, chosen[3].user_id), (other.pk, self.profiles[0].pk))
+        self.assertEqual(Queue.objects.count(), 6)
+        self.assertEqual(services.queue_snapshot(self.labs[0].pk).entries[0].user_id, self.profiles[1].pk)
+        self.assertEqual(history.replay(self.labs[1].pk).stats['removed'], 1)
+        self.assertEqual(self.chosen(services.dequeue_next(self.lab_ids, 10)), [
+            (0, 1), (1, 4), (2, 7), (0, 2), (1, 5), (2, 8)])
+        self.assertEqual(services.dequeue_next(self.lab_ids, 1), [])
+        with self.assertRaises(Queues.DoesNotExist):
+            services.dequeue_next([self.lab_ids[0], 0], 1)
+
+    def test_endpoint(self):
+        url = reverse('next_up')
+        response = self.client.get(url, {'queue': self.lab_ids[:2], 'count': 3, 'policy': 'weighted', 'weight': [1, 2]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([entry['name'] for entry in response.json()['next']], ['Name 3', 'Name 0', 'Name 4'])
+        self.assertFalse(response.json()['dequeued'])
+        self.assertEqual(Queue.objects.count(), 9)
+
+        response = self.client.post(url, {'queues': self.lab_ids, 'count': 2}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['dequeued'])
+        self.assertEqual([entry['user_id'] for entry in response.json()['next']], [self.profiles[0].pk, self.profiles[3].pk])
+        self.assertEqual(Queue.objects.count(), 7)
+
+        self.assertEqual(self.client.get(url, {'queue': self.lab_ids, 'policy': 'random'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'queue': self.lab_ids, 'count': 0}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'queue': self.lab_ids, 'weight': [1]}).status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.get(url, {'queue': [self.lab_ids[0], 0]}).status_code, 404)
+        self.client.force_login(self.profiles[0].user)
+        self.assertEqual(self.client.get(url, {'queue': self.lab_ids}).status_code, 403)
+
+    def test_cost_does_not_grow_with_the_number_of_queues(self):
+        labs = [Queues.objects.create(name=f'Extra {n}', group=self.group) for n in range(60)]
+        for lab in labs:
+            services.enqueue_many(lab.pk, [profile.pk for profile in self.profiles])
+
+        def measure(queue_ids):
+            with CaptureQueriesContext(connection) as queries:
+                chosen = services.dequeue_next(queue_ids, 3)
+            self.assertEqual(len(chosen), 3)
+            return [query['sql'] for query in queries]
+
+        few, many = measure([lab.pk for lab in labs[:3]]), measure([lab.pk for lab in labs[3:]])
+        # The lock, the choice and the DELETE, then the changes of the three queues served
+        self.assertEqual(len(few), len(many))
+        if connection.features.has_select_for_update:
+            self.assertEqual(sum('FOR UPDATE' in sql for sql in many), 1)
+        self.assertEqual(sum(sql.startswith('DELETE') for sql in many), 1)
+        # Only the first three users of every queue are read
+        self.assertEqual(len(scheduling.candidates([lab.pk for lab in labs], 3)), 3 * len(labs))
+
+    def test_group_rollups_are_written_in_the_order_of_the_groups(self):
+        later, earlier = StudyGroup.objects.create(name='Later'), StudyGroup.objects.create(name='Earlier')
+        earlier, later = sorted([later, earlier], key=lambda group: group.pk)
+        labs = [Queues.objects.create(name=f'Lab {n}', group=group) for n, group in enumerate([later, earlier, later])]
+        for lab in labs:
+            services.enqueue(lab.pk, self.profiles[0].pk)
+
+        with CaptureQueriesContext(connection) as queries:
+            services.dequeue_next([lab.pk for lab in labs], 3)
+        groups = [int(group_id) for query in queries for group_id in
+                  re.findall(r'"group_id" = (\d+)', query['sql']) if 'app_queue_queuerollup' in query['sql']]
+        # Once per group, whatever the order of the queues
+        self.assertEqual(groups, [earlier.pk, later.pk])
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class QueueServicesConcurrencyTests(TransactionTestCase):
+    """
+    Stress test hammering one queue from many threads at once
+    """
+    threads = 50
+
+    def test_concurrent_enqueue_and_requeue(self):
+        group = StudyGroup.objects.create(name='Group')
+        queues = Queues.objects.create(name='Lab', group=group)
+        profiles = [make_profile(group, f'student{i}') for i in range(self.threads)]
+        start = threading.Barrier(self.threads)
+        errors = []
+
+        def student(profile):
+            try:
+                start.wait()
+                services.enqueue(queues.pk, profile.pk)
+                services.move_to_tail(queues.pk, profile.pk)
+                services.enqueue(queues.pk, profile.pk)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=student, args=(p,)) for p in profiles]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        positions = list(Queue.objects.filter(queue=queues).values_list('position', flat=True))
+        self.assertEqual(len(positions), self.threads)
+        self.assertEqual(len(set(positions)), self.threads)
+        queues.refresh_from_db()
+        self.assertEqual(queues.next_position, 2 * self.threads * services.POSITION_GAP)
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_backfill_during_changes(self):
+        group = StudyGroup.objects.create(name='Group')
+        labs = [Queues.objects.create(name=f'Lab {n}', group=group) for n in range(2)]
+        profiles = [make_profile(group, f'student{i}') for i in range(10)]
+        start = threading.Barrier(len(profiles) + 1)
+        errors = []
+
+        def student(profile):
+            try:
+                start.wait()
+                for lab in labs:
+                    services.enqueue(lab.pk, profile.pk)
+                services.pop_head(labs[0].pk)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        def rebuild():
+            try:
+                start.wait()
+                for _ in range(5):
+                    analytics.backfill([group.pk], chunk_size=3)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=student, args=(p,)) for p in profiles] + [threading.Thread(target=rebuild)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        rollups = QueueRollup.objects.filter(Q(queue__in=labs) | Q(group=group)).order_by('queue', 'group', 'hour')
+        live = list(rollups.values_list('queue', 'group', 'enqueued', 'removed'))
+        analytics.backfill([group.pk])
+        self.assertEqual(list(rollups.values_list('queue', 'group', 'enqueued', 'removed')), live)
+        self.assertEqual(sum(row[2] for row in live if row[1] is not None), 2 * len(profiles))
+
+
+class NextPositionMigrationTests(TransactionTestCase):
+    """
+    Tests for the migration adding the tail counter of the queues to existing data
+    """
+    before = [('app_queue', '0007_queue_enqueued_at')]
+    after = [('app_queue', '0008_queues_next_position')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_tail_counter_starts_after_the_existing_records(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        group = apps.get_model('app_queue', 'StudyGroup').objects.create(name='Group')
+        users = [apps.get_model('auth', 'User').objects.create(username=f'student{i}') for i in range(3)]
+        profiles = [apps.get_model('app_queue', 'UserProfile').objects.create(user=user, group=group) for user in users]
+        Queues = apps.get_model('app_queue', 'Queues')
+        full, gapped, empty = (Queues.objects.create(name=name, group=group) for name in ('Full', 'Gapped', 'Empty'))
+        Queue = apps.get_model('app_queue', 'Queue')
+        for position, profile in enumerate(profiles, 1):
+            Queue.objects.create(queue=full, user=profile, position=position)
+        Queue.objects.create(queue=gapped, user=profiles[0], position=2 * services.POSITION_GAP)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        Queues = executor.loader.project_state(self.after).apps.get_model('app_queue', 'Queues')
+        self.assertEqual(dict(Queues.objects.values_list('name', 'next_position')), {
+            'Full': services.POSITION_GAP, 'Gapped': 3 * services.POSITION_GAP, 'Empty': 0})
+
+        # New records are appended after the existing ones
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        services.enqueue(full.pk, make_profile(StudyGroup.objects.get(pk=group.pk), 'late').pk)
+        self.assertEqual(list(Queue.objects.filter(queue=full.pk).order_by('position').values_list('position', flat=True)),
+                         [1, 2, 3, services.POSITION_GAP])
+
+
+class ExplainQueriesCommandTests(TestCase):
+    """
+    Tests for the ``explain_queries`` management command
+    """
+    def test_explains_every_hot_query(self):
+        group = StudyGroup.objects.create(name='Group')
+        profile = make_profile(group, 'student')
+        queues = Queues.objects.create(name='Lab', group=group)
+        services.enqueue(queues.pk, profile.pk)
+
+        out = StringIO()
+        call_command('explain_queries', stdout=out)
+        for title in ('queue detail', 'queue membership', 'queue head', 'queue tail lock', 'group queues'):
+            self.assertIn(f'{title}:', out.getvalue())
+
+    def test_requires_a_queue(self):
+        with self.assertRaises(CommandError):
+            call_command('explain_queries', stdout=StringIO())
+
+
+class LoginRequiredMiddlewareTests(QueueTestCase):
+    """
+    Tests and a small benchmark for :class:`app_queue.middleware.LoginRequiredMiddleware`
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group')
+        self.profile = make_profile(self.group, 'owner')
+        self.queues = Queues.objects.create(name='Lab', group=self.group)
+        for i in range(20):
+            services.enqueue(self.queues.pk, make_profile(self.group, f'student{i}').pk)
+        self.url = reverse('queue', args=[self.queues.pk])
+
+    def test_anonymous_request_is_rejected_before_the_view(self):
+        with self.assertNumQueries(0), mock.patch('app_queue.views.render') as render:
+            response = self.client.get(self.url)
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+        render.assert_not_called()
+
+    def test_allowlist(self):
+        self.assertEqual(self.client.get(reverse('login')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('register')).status_code, 200)
+        self.assertEqual(self.client.get('/static/missing.css').status_code, 404)
+        self.assertEqual(self.client.get('/health/').status_code, 302)
+        with self.settings(LOGIN_REQUIRED_ALLOWED_PATTERNS=[r'^/health/$']):
+            self.assertEqual(Client().get('/health/').status_code, 404)
+
+    def test_anonymous_requests_skip_the_work_of_rendering(self):
+        with self.assertNumQueries(0):
+            anonymous = self.client.get(self.url)
+        self.assertEqual(anonymous.status_code, 302)
+        self.assertTemplateNotUsed(anonymous, 'app_queue/queue.html')
+
+        self.client.force_login(self.profile.user)
+        with CaptureQueriesContext(connection) as queries:
+            rendered = self.client.get(self.url)
+        self.assertEqual(rendered.status_code, 200)
+        self.assertTemplateUsed(rendered, 'app_queue/queue.html')
+        self.assertGreater(len(queries), 0)
+
+    def session_queries(self, engine):
+        with self.settings(SESSION_ENGINE=f'django.contrib.sessions.backends.{engine}'):
+            client = Client()
+            client.force_login(self.profile.user)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(client.get(self.url).status_code, 200)
+            return sum('"django_session"' in query['sql'] for query in queries)
+
+    def test_session_engines(self):
+        self.assertEqual(self.session_queries('db'), 1)
+        self.assertEqual(self.session_queries('cached_db'), 0)
+        self.assertEqual(self.session_queries('signed_cookies'), 0)
+
+    def test_cached_session_is_revoked_on_logout(self):
+        self.client.force_login(self.profile.user)
+        session_key = self.client.session.session_key
+        self.assertIsNotNone(caches[settings.SESSION_CACHE_ALIAS].get(f'django.contrib.sessions.cached_db{session_key}'))
+        self.client.logout()
+        self.assertIsNone(caches[settings.SESSION_CACHE_ALIAS].get(f'django.contrib.sessions.cached_db{session_key}'))
+        self.assertFalse(Session.objects.filter(session_key=session_key).exists())
+
+    def test_clearsessions_deletes_expired_sessions(self):
+        self.client.force_login(self.profile.user)
+        Session.objects.create(session_key='expired', session_data='', expire_date=timezone.now() - timedelta(days=1))
+        call_command('clearsessions')
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), [self.client.session.session_key])
+
+    def test_test_runs_keep_the_shared_caches_in_memory(self):
+        for alias in ('sessions', 'snapshots'):
+            self.assertEqual(settings.CACHES[alias]['BACKEND'], 'django.core.cache.backends.locmem.LocMemCache', alias)
+
+
+class QueuesViewTests(QueueTestCase):
+    """
+    Tests for the paginated queue listing
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group')
+        self.profile = make_profile(self.group, 'owner')
+        self.client.force_login(self.profile.user)
+
+    def create(self, count):
+        return [Queues.objects.create(name=f'Lab {i}', group=self.group) for i in range(count)]
+
+    def walk(self):
+        """
+        Follows the cursors through every page of the listing and returns the listed queues
+        """
+        listed, cursor = [], None
+        while True:
+            response = self.client.get(reverse('queues'), {'after': cursor} if cursor else {})
+            listed += response.context['user_queues']
+            cursor = response.context['next_cursor']
+            if cursor is None:
+                return listed
+
+    @override_settings(QUEUES_PAGE_SIZE=3)
+    def test_keyset_pages_cover_every_queue_once(self):
+        created = self.create(7)
+        Queues.objects.filter(pk__in=[q.pk for q in created[2:5]]).update(created_at=created[2].created_at)
+        listed = self.walk()
+        self.assertEqual(sorted(q.pk for q in listed), sorted(q.pk for q in created))
+        self.assertEqual(listed[0].path, reverse('queue', args=[listed[0].pk]))
+
+    def test_query_count_does_not_grow_with_page_length(self):
+        self.create(2)
+        with CaptureQueriesContext(connection) as small:
+            self.assertContains(self.client.get(reverse('queues')), 'Group')
+        self.create(30)
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(reverse('queues'))
+        self.assertEqual(len(small), len(large))
+
+    @override_settings(QUEUES_LIST_CACHE_TIMEOUT=60)
+    def test_cached_page_is_invalidated_by_create_queue(self):
+        self.create(1)
+        self.client.get(reverse('queues'))
+        with CaptureQueriesContext(connection) as cached:
+            self.client.get(reverse('queues'))
+        self.assertFalse(any('app_queue_queues' in q['sql'] for q in cached.captured_queries))
+
+        self.client.post(reverse('create_queue'), {'name': 'New lab', 'group': self.group.pk, 'description': ''})
+        self.assertContains(self.client.get(reverse('queues')), 'New lab')
+
+
+class QueueStateApiTests(QueueTestCase):
+    """
+    Tests for the JSON state endpoints and their conditional GET support
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group')
+        self.profile = make_profile(self.group, 'owner', 'Owner', 'Profile')
+        self.queues = Queues.objects.create(name='Lab', group=self.group, creator=self.profile)
+        services.enqueue(self.queues.pk, self.profile.pk)
+        self.client.force_login(self.profile.user)
+        self.url = reverse('queue_state', args=[self.queues.pk])
+
+    def test_queue_state(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'queue': self.queues.pk, 'version': 1, 'entries': [[1, self.profile.pk, 'Owner Profile']],
+        })
+        self.assertEqual(response['ETag'], f'"{self.queues.pk}-1"')
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_not_modified_after_a_single_lookup(self):
+        etag = self.client.get(self.url)['ETag']
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        queries = [q['sql'] for q in ctx.captured_queries if 'app_queue_' in q['sql']]
+        self.assertEqual(len(queries), 1)
+
+        services.enqueue(self.queues.pk, make_profile(self.group, 'student').pk)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['entries']), 2)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_stale_cached_snapshot_is_not_served(self):
+        Queues.objects.filter(pk=self.queues.pk).update(version=5)
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()['version'], 5)
+        self.assertEqual(response['ETag'], f'"{self.queues.pk}-5"')
+
+    def test_missing_queue(self):
+        self.assertEqual(self.client.get(reverse('queue_state', args=[self.queues.pk + 1])).status_code, 404)
+
+    def test_group_state(self):
+        url = reverse('group_state')
+        response = self.client.get(url)
+        self.assertEqual(response.json(), {
+            'group': self.group.pk,
+            'queues': [{'id': self.queues.pk, 'name': 'Lab', 'version': 1, 'length': 1}],
+            'next': None,
+        })
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        services.remove(self.queues.pk, self.profile.pk)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['queues'][0]['length'], 0)
+        etag = response['ETag']
+        Queues.objects.create(name='New', group=self.group)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class AsyncReadViewsTests(QueueTestCase):
+    """
+    Tests for the asynchronous read views and the async support of the middleware
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group')
+        self.profile = make_profile(self.group, 'owner', 'Owner', 'Profile')
+        self.queues = Queues.objects.create(name='Lab', group=self.group, creator=self.profile)
+        services.enqueue(self.queues.pk, self.profile.pk)
+        self.async_client.force_login(self.profile.user)
+
+    def test_read_views_are_async(self):
+        for view in (views.home, views.queues, views.queue, views.profile):
+            self.assertTrue(asyncio.iscoroutinefunction(view), view.__name__)
+
+    def test_middleware_chain_is_async_capable(self):
+        for path in settings.MIDDLEWARE:
+            self.assertTrue(getattr(import_string(path), 'async_capable', False), path)
+
+    async def test_read_views_under_asgi(self):
+        response = await self.async_client.get(reverse('queue', args=[self.queues.pk]))
+        self.assertContains(response, 'Owner Profile')
+        self.assertEqual(response.context['user_pk'], self.profile.pk)
+
+        response = await self.async_client.get(reverse('queues'))
+        self.assertEqual([queues.pk for queues in response.context['user_queues']], [self.queues.pk])
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries"')
+
+        for name in ('home', 'profile'):
+            self.assertEqual((await self.async_client.get(reverse(name))).status_code, 200, name)
+        self.assertEqual((await self.async_client.get(reverse('queue', args=[self.queues.pk + 1]))).status_code, 404)
+
+    async def test_anonymous_request_is_redirected(self):
+        response = await AsyncClient().get(reverse('queues'))
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+
+    async def test_templates_are_rendered_off_the_event_loop(self):
+        loops = []
+
+        def render(*args, **kwargs):
+            try:
+                loops.append(asyncio.get_running_loop())
+            except RuntimeError:
+                loops.append(None)
+            return render_page(*args, **kwargs)
+
+        with mock.patch.object(views, 'render', render):
+            for url in (reverse('home'), reverse('queues'), reverse('queue', args=[self.queues.pk])):
+                self.assertEqual((await self.async_client.get(url)).status_code, 200, url)
+            response = await self.async_client.get(reverse('queue', args=[self.queues.pk]), HTTP_HX_REQUEST='true')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(loops, [None] * 4)
+
+    async def test_user_without_profile_gets_not_found(self):
+        user = await sync_to_async(User.objects.create)(username='admin')
+        await sync_to_async(self.async_client.force_login)(user)
+        for url in (reverse('queues'), reverse('queue', args=[self.queues.pk])):
+            self.assertEqual((await self.async_client.get(url)).status_code, 404, url)
+        self.assertEqual((await self.async_client.get(reverse('home'))).status_code, 200)
+
+
+class SeedingTests(QueueTestCase):
+    """
+    Tests for the bulk import of students in :mod:`app_queue.seeding`
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group A')
+
+    def write(self, suffix, content):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def order(self, name):
+        return list(Queue.objects.filter(queue__name=name, queue__group=self.group).order_by('position')
+                    .values_list('user__user__username', flat=True))
+
+    def test_import_csv(self):
+        path = self.write('.csv', 'username,password,first_name,last_name,group,queues\n'
+                                  'ann,secret-1,Ann,A,group  a,Lab 1;Lab 2\n'
+                                  'bob,secret-2,Bob,B,Group B,Lab 1\n'
+                                  'cid,secret-1,Cid,C,GROUP A,Lab 1\n')
+        out = StringIO()
+        call_command('import_students', path, '--processes', '2', stdout=out)
+        self.assertIn('passwords: 2/2', out.getvalue())
+        self.assertIn('Imported 3 students: 3 profiles in 2 groups, 4 memberships added to 3 queues.', out.getvalue())
+
+        ann = User.objects.get(username='ann')
+        self.assertTrue(ann.check_password('secret-1'))
+        self.assertEqual(ann.userprofile.group, self.group)
+        self.assertEqual(self.order('Lab 1'), ['ann', 'cid'])
+        self.assertEqual(Queues.objects.get(name='Lab 1', group=self.group).version, 1)
+        self.assertEqual(Queues.objects.get(name='Lab 1', group__name='Group B').queue_set.get().user.first_name, 'Bob')
+        self.assertEqual(history.replay(Queues.objects.get(name='Lab 2').pk).stats['enqueued'], 1)
+
+        call_command('import_students', path, stdout=out)
+        self.assertEqual(User.objects.count(), 3)
+        self.assertEqual(self.order('Lab 1'), ['ann', 'cid'])
+
+    def test_import_json_keeps_hashed_passwords(self):
+        hashed = make_password('known')
+        path = self.write('.json', json.dumps([
+            {'username': 'ann', 'password': hashed, 'group': 'Group A'},
+            {'username': 'bob', 'group': 'Group A', 'queues': ['Lab']},
+        ]))
+        call_command('import_students', path, '--processes', '1', verbosity=0, stdout=StringIO())
+        self.assertEqual(User.objects.get(username='ann').password, hashed)
+        self.assertFalse(User.objects.get(username='bob').has_usable_password())
+        self.assertEqual(self.order('Lab'), ['bob'])
+
+    def test_invalid_rows_are_rejected(self):
+        path = self.write('.csv', 'username,group\nann,\n')
+        with self.assertRaisesMessage(CommandError, 'Student 1 has no username or no group.'):
+            call_command('import_students', path, stdout=StringIO())
+        self.assertFalse(User.objects.exists())
+
+
+class PasswordHashingTests(QueueTestCase):
+    """
+    Tests for the configurable password hashers of :mod:`app_queue.hashers` and the registration
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group A')
+
+    def register(self, username, password='secret-pass'):
+        return self.client.post(reverse('register'), {
+            'username': username, 'email': '', 'password': password,
+            'group': self.group.pk, 'first_name': 'Ann', 'last_name': 'A',
+        })
+
+    @override_settings(PASSWORD_HASHERS=['app_queue.hashers.PBKDF2PasswordHasher'], PASSWORD_PBKDF2_ITERATIONS=1000)
+    def test_registration_hashes_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertRedirects(self.register('ann'), reverse('home'), fetch_redirect_response=False)
+        user_queries = [query['sql'] for query in queries if '"auth_user"' in query['sql'].split('WHERE')[0]]
+        self.assertEqual(sum(sql.startswith('INSERT') for sql in user_queries), 1)
+        # The only UPDATE of the user is the one of the login
+        for sql in user_queries:
+            if sql.startswith('UPDATE'):
+                self.assertIn('"last_login"', sql)
+                self.assertNotIn('"password"', sql)
+        user = User.objects.get(username='ann')
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+        self.assertEqual(user.userprofile.group, self.group)
+
+    @override_settings(PASSWORD_HASHERS=['app_queue.hashers.PBKDF2PasswordHasher'], PASSWORD_PBKDF2_ITERATIONS=1000)
+    def test_hash_is_upgraded_on_login(self):
+        self.register('ann')
+        self.client.logout()
+        with self.settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            response = self.client.post(reverse('login'), {'username': 'ann', 'password': 'secret-pass'})
+            self.assertEqual(response.status_code, 302)
+            user = User.objects.get(username='ann')
+            self.assertTrue(user.password.startswith('pbkdf2_sha256$2000$'))
+            self.assertTrue(user.check_password('secret-pass'))
+
+    @override_settings(PASSWORD_HASHERS=['app_queue.hashers.PBKDF2PasswordHasher'], PASSWORD_PBKDF2_ITERATIONS=0)
+    def test_default_iterations(self):
+        self.assertTrue(make_password('x').startswith(f'pbkdf2_sha256${PBKDF2PasswordHasher.iterations}$'))
+
+    @skipUnless(find_spec('argon2'), 'argon2-cffi is not installed')
+    @override_settings(PASSWORD_HASHERS=['app_queue.hashers.Argon2PasswordHasher'],
+                       PASSWORD_ARGON2_TIME_COST=1, PASSWORD_ARGON2_MEMORY_COST=1024, PASSWORD_ARGON2_PARALLELISM=1)
+    def test_argon2_costs(self):
+        self.assertIn('$m=1024,t=1,p=1$', make_password('x'))
+
+    @override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+    def test_auth_benchmark(self):
+        data = benchmarks.seed(groups=1, profiles=2, queues=1, records=1)
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            results = benchmarks.auth_throughput(data, iterations=1)
+        self.assertEqual(set(results), {'register (default)', 'login (default)',
+                                        'register (configured)', 'login (configured)'})
+        for name, summary in results.items():
+            self.assertEqual((summary['requests'], summary['errors']), (1, 0), name)
+
+
+class ExportTests(QueueTestCase):
+    """
+    Tests for the streaming exports of queue records and event logs
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group')
+        self.creator = make_profile(self.group, 'creator', 'Queue', 'Creator')
+        self.queues = Queues.objects.create(name='Lab', group=self.group, creator=self.creator)
+        self.ids = [make_profile(self.group, f'student{i}', 'Student', str(i)).pk for i in range(3)]
+        services.enqueue_many(self.queues.pk, self.ids)
+        services.move_to_tail(self.queues.pk, self.ids[0])
+        self.client.force_login(self.creator.user)
+        self.async_client.force_login(self.creator.user)
+
+    def read(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_queue_records_as_csv(self):
+        response = self.client.get(reverse('export_queue', args=[self.queues.pk]))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="queue-{self.queues.pk}-records.csv"')
+        rows = list(csv.DictReader(StringIO(self.read(response))))
+        self.assertEqual([(row['place'], int(row['user_id'])) for row in rows],
+                         [('1', self.ids[1]), ('2', self.ids[2]), ('3', self.ids[0])])
+        self.assertEqual(rows[0]['last_name'], '1')
+
+    def test_group_events_as_json(self):
+        staff = make_profile(self.group, 'staff')
+        User.objects.filter(pk=staff.user_id).update(is_staff=True)
+        self.client.force_login(staff.user)
+        response = self.client.get(reverse('export_group'), {'data': 'events', 'format': 'json'})
+        events = json.loads(self.read(response))
+        self.assertEqual([event['kind'] for event in events], ['enqueued'] * 3 + ['requeued'])
+        self.assertEqual(events[-1]['user_id'], self.ids[0])
+
+    def test_permissions_and_parameters(self):
+        self.assertEqual(self.client.get(reverse('export_group')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('export_queue', args=[self.queues.pk]), {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('export_queue', args=[self.queues.pk + 1])).status_code, 404)
+        self.client.force_login(UserProfile.objects.get(pk=self.ids[0]).user)
+        self.assertEqual(self.client.get(reverse('export_queue', args=[self.queues.pk])).status_code, 403)
+
+    async def test_export_is_iterated_asynchronously_under_asgi(self):
+        response = await self.async_client.get(reverse('export_queue', args=[self.queues.pk]), {'format': 'json'})
+        self.assertTrue(response.is_async)
+        content = ''.join([chunk.decode() async for chunk in response.streaming_content])
+        self.assertEqual([entry['user_id'] for entry in json.loads(content)], [self.ids[1], self.ids[2], self.ids[0]])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_queues', '--group', str(self.group.pk), '--format', 'json', stdout=out)
+        self.assertEqual(len(json.loads(out.getvalue())), 3)
+        with self.assertRaises(CommandError):
+            call_command('export_queues')
+
+    @override_settings(EXPORT_CHUNK_SIZE=100)
+    def test_memory_stays_flat(self):
+        def peak(group_id):
+            staff = User.objects.create(username=f'staff-{group_id}', is_staff=True)
+            self.client.force_login(staff)
+            response = self.client.get(reverse('export_group'), {'group': group_id})
+            tracemalloc.start()
+            size = sum(len(chunk) for chunk in response.streaming_content)
+            used = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return size, used
+
+        medium = benchmarks.seed(groups=1, profiles=200, queues=10, records=200)
+        large = benchmarks.seed(groups=1, profiles=200, queues=40, records=200)
+        medium_size, medium_peak = peak(medium['groups'][0])
+        large_size, large_peak = peak(large['groups'][0])
+        self.assertGreater(large_size, 3 * medium_size)
+        self.assertLess(large_peak, medium_peak + 64 * 1024)
+
+
+class ProfileMiddlewareTests(QueueTestCase):
+    """
+    Tests for the profile attached to the request
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group')
+        self.profile = make_profile(self.group, 'owner', 'Owner', 'Profile')
+        self.queues = Queues.objects.create(name='Lab', group=self.group, creator=self.profile)
+
+    def request(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        ProfileMiddleware(lambda request: None).process_request(request)
+        return request
+
+    def test_profile_and_group_are_loaded_once(self):
+        request = self.request(self.profile.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(request.profile.pk, self.profile.pk)
+            self.assertEqual(request.profile.group.name, 'Group')
+            self.assertEqual(request.profile.group_id, self.group.pk)
+
+    def test_anonymous_user_has_no_profile(self):
+        request = self.request(AnonymousUser())
+        self.assertFalse(request.profile)
+        self.assertIsNone(async_to_sync(request.aprofile)())
+
+    async def test_async_profile(self):
+        request = await sync_to_async(self.request)(self.profile.user)
+        profile = await request.aprofile()
+        self.assertEqual(profile.group.name, 'Group')
+        self.assertIs(await request.aprofile(), profile)
+
+    def test_views_use_the_request_profile(self):
+        self.client.force_login(self.profile.user)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('create_queue'))
+        profile_queries = [q['sql'] for q in ctx.captured_queries if 'app_queue_userprofile' in q['sql']]
+        self.assertEqual(len(profile_queries), 1)
+        self.assertIn('app_queue_studygroup', profile_queries[0])
+
+    @override_settings(PROFILE_CACHE_TIMEOUT=60)
+    def test_cached_profile_is_invalidated_on_save(self):
+        self.assertEqual(services.user_profile(self.profile.user_id).first_name, 'Owner')
+        with self.assertNumQueries(0):
+            self.request(self.profile.user).profile.pk
+
+        self.profile.first_name = 'Renamed'
+        self.profile.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.request(self.profile.user).profile.first_name, 'Renamed')
+
+
+class GroupPickerTests(QueueTestCase):
+    """
+    Tests for the group picker: the select rendering only the chosen group, the group
+    search and the normalized group names
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group')
+        StudyGroup.objects.bulk_create(
+            [StudyGroup(name=f'Other {i}', name_key=f'other {i}') for i in range(50)])
+        self.profile = make_profile(self.group, 'owner')
+        self.client.force_login(self.profile.user)
+
+    def test_select_renders_only_the_chosen_group(self):
+        html = UserProfileForm(instance=self.profile).as_p()
+        self.assertEqual(html.count('<option'), 2)
+        self.assertIn(f'<option value="{self.group.pk}" selected>Group</option>', html)
+        self.assertIn(f'data-search-url="{reverse("search_groups")}"', html)
+
+    def test_search_by_prefix_ignores_case_and_spacing(self):
+        response = self.client.get(reverse('search_groups'), {'q': '  OTHER   1'})
+        names = [group['name'] for group in response.json()['results']]
+        self.assertEqual(names, ['Other 1'] + [f'Other 1{i}' for i in range(10)])
+
+    @override_settings(GROUP_SEARCH_LIMIT=5)
+    def test_search_is_limited_and_open_to_anonymous_users(self):
+        self.client.logout()
+        response = self.client.get(reverse('search_groups'), {'q': 'other'})
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_new_group_name_reuses_group_differing_in_case_and_spacing(self):
+        form = UserProfileForm({'new_group_name': ' group  ', 'first_name': 'A', 'last_name': 'B'},
+                               instance=self.profile)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.save().group, self.group)
+        self.assertEqual(StudyGroup.objects.filter(name_key='group').count(), 1)
+
+    def test_renaming_updates_the_key(self):
+        self.group.name = 'Renamed  Group'
+        self.group.save(update_fields=['name'])
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.name_key, 'renamed group')
+
+
+@override_settings(WEB_WORKERS=1)
+class QueueEventsTests(QueueTestCase):
+    """
+    Tests for the live queue update stream and the local broadcast backend
+    """
+    idle_connections = 200
+
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group')
+        self.profile = make_profile(self.group, 'owner', 'Owner', 'Profile')
+        self.queues = Queues.objects.create(name='Lab', group=self.group)
+        self.async_client.force_login(self.profile.user)
+        self.url = reverse('queue_events', args=[self.queues.pk])
+
+    async def test_stream_pushes_queue_changes(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        self.assertEqual(await anext(stream), b'event: version\ndata: {"type": "version", "version": 0}\n\n')
+
+        def change():
+            with self.captureOnCommitCallbacks(execute=True):
+                services.enqueue(self.queues.pk, self.profile.pk)
+            with self.captureOnCommitCallbacks(execute=True):
+                services.remove(self.queues.pk, self.profile.pk)
+
+        await sync_to_async(change)()
+        enqueued = await anext(stream)
+        self.assertTrue(enqueued.startswith(b'event: enqueued\n'))
+        self.assertIn(b'"name": "Owner Profile"', enqueued)
+        self.assertIn(b'"version": 1', enqueued)
+        removed = await anext(stream)
+        self.assertTrue(removed.startswith(b'event: removed\n'))
+        self.assertIn(b'"version": 2', removed)
+
+    async def test_stream_starts_with_the_current_version(self):
+        await sync_to_async(services.enqueue)(self.queues.pk, self.profile.pk)
+        response = await self.async_client.get(self.url)
+        stream = aiter(response.streaming_content)
+        await anext(stream)
+        self.assertEqual(await anext(stream), b'event: version\ndata: {"type": "version", "version": 1}\n\n')
+        await stream.aclose()
+        self.assertEqual((await self.async_client.get(reverse('queue_events', args=[self.queues.pk + 1]))).status_code, 404)
+        self.assertEqual(get_broadcast().count(self.queues.pk + 1), 0)
+
+    async def test_holds_many_idle_streams_without_threads(self):
+        threads = threading.active_count()
+        streams = []
+        for _ in range(self.idle_connections):
+            response = await self.async_client.get(self.url)
+            stream = aiter(response.streaming_content)
+            self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+            self.assertTrue((await anext(stream)).startswith(b'event: version\n'))
+            streams.append(stream)
+        waiting = [asyncio.ensure_future(anext(stream)) for stream in streams]
+        await asyncio.sleep(0)
+        self.assertEqual(get_broadcast().count(), self.idle_connections)
+        # Every parked stream is a coroutine waiting on the event loop, not a worker thread
+        self.assertLess(threading.active_count() - threads, 10)
+
+        def change():
+            with self.captureOnCommitCallbacks(execute=True):
+                services.enqueue(self.queues.pk, self.profile.pk)
+
+        await sync_to_async(change)()
+        received = await asyncio.gather(*waiting)
+        self.assertTrue(all(event.startswith(b'event: enqueued\n') for event in received))
+        for stream in streams:
+            await stream.aclose()
+
+    def test_wsgi_pages_poll_instead_of_streaming(self):
+        self.client.force_login(self.profile.user)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(get_broadcast().count(), 0)
+
+        response = self.client.get(reverse('queue', args=[self.queues.pk]))
+        self.assertNotContains(response, 'EventSource')
+        self.assertContains(response, f'hx-trigger="every {settings.QUEUE_POLL_INTERVAL}s"')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            services.enqueue(self.queues.pk, self.profile.pk)
+        url = reverse('queue', args=[self.queues.pk])
+        response = self.client.get(url, {'version': 0}, HTTP_HX_REQUEST='true')
+        self.assertTemplateNotUsed(response, 'app_queue/base.html')
+        self.assertContains(response, 'data-version="1"')
+        self.assertContains(response, 'Owner Profile')
+        self.assertEqual(self.client.get(url, {'version': 1}, HTTP_HX_REQUEST='true').status_code, 204)
+
+    async def test_asgi_pages_stream_and_keep_polling(self):
+        response = await self.async_client.get(reverse('queue', args=[self.queues.pk]))
+        self.assertContains(response, 'EventSource')
+        self.assertContains(response, f'hx-trigger="every {settings.QUEUE_POLL_INTERVAL}s"')
+
+    @override_settings(WEB_WORKERS=4)
+    async def test_process_local_broadcast_is_not_streamed_by_several_workers(self):
+        response = await self.async_client.get(reverse('queue', args=[self.queues.pk]))
+        self.assertNotContains(response, 'EventSource')
+        self.assertContains(response, f'hx-trigger="every {settings.QUEUE_POLL_INTERVAL}s"')
+        self.assertEqual((await self.async_client.get(self.url)).status_code, 404)
+        self.assertEqual(get_broadcast().count(), 0)
+
+        with mock.patch.dict(os.environ, {'WEB_SERVER': 'asgi'}):
+            self.assertEqual([warning.id for warning in check_live_updates(None)], ['app_queue.W001'])
+        with mock.patch.object(LocalBroadcast, 'process_local', False), mock.patch.dict(os.environ, {'WEB_SERVER': 'asgi'}):
+            self.assertEqual(check_live_updates(None), [])
+
+    async def test_slow_subscriber_is_asked_to_resync(self):
+        hub = LocalBroadcast(max_pending=2)
+        subscription = hub.subscribe(self.queues.pk)
+        for user in range(3):
+            hub.publish(self.queues.pk, {'type': 'removed', 'user': user})
+        await asyncio.sleep(0)
+        self.assertEqual(await subscription.get(), {'type': 'resync'})
+        self.assertIsNone(await subscription.get(timeout=0.01))
+
+
+class QueuePartialRenderingTests(QueueTestCase):
+    """
+    Tests measuring the htmx partial responses of the queue mutation views
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group')
+        self.profile = make_profile(self.group, 'owner', 'Owner', 'Profile')
+        self.queues = Queues.objects.create(name='Lab', group=self.group)
+        for i in range(30):
+            services.enqueue(self.queues.pk, make_profile(self.group, f'student{i}').pk)
+        self.client.force_login(self.profile.user)
+        self.url = reverse('update_user', args=[self.queues.pk, self.profile.pk])
+        services.enqueue(self.queues.pk, self.profile.pk)
+
+    def measure(self, **headers):
+        """
+        Posts the "Update" form and returns the body of the final response together with the
+        number of queries of the round trip, including the page load following a redirect
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, follow=True, **headers)
+        return response, len(queries)
+
+    def test_htmx_request_gets_only_the_table(self):
+        response = self.client.post(self.url, HTTP_HX_REQUEST='true')
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'app_queue/queue_table.html')
+        self.assertTemplateNotUsed(response, 'app_queue/base.html')
+        content = response.content.decode()
+        self.assertTrue(content.startswith('<table class="table" id="queue-table"'))
+        self.assertNotIn('navbar', content)
+        self.assertEqual(response.context['entries'][-1].user_id, self.profile.pk)
+
+    def test_plain_request_is_redirected(self):
+        response = self.client.post(self.url)
+        self.assertRedirects(response, reverse('queue', args=[self.queues.pk]))
+
+    def test_partial_is_smaller_and_cheaper(self):
+        full, full_queries = self.measure()
+        partial, partial_queries = self.measure(HTTP_HX_REQUEST='true')
+        self.assertEqual(len(full.redirect_chain), 1)
+        self.assertEqual(partial.redirect_chain, [])
+        self.assertLess(len(partial.content) * 2, len(full.content))
+        # The partial skips the second request and the lookups it repeats
+        self.assertLess(partial_queries, full_queries)
+        self.assertEqual([entry.user_id for entry in partial.context['entries']],
+                         [entry.user_id for entry in full.context['entries']])
+
+
+class TemplateFragmentCacheTests(QueueTestCase):
+    """
+    Tests for the cached fragments of the queue pages
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group')
+        self.profile = make_profile(self.group, 'owner', 'Owner', 'Profile')
+        self.queues = Queues.objects.create(name='Lab', group=self.group)
+        self.client.force_login(self.profile.user)
+
+    def render_rows(self, name, version):
+        request = RequestFactory().get('/')
+        request.user = self.profile.user
+        entries = [caching.SnapshotEntry(1, self.profile.pk, name)]
+        return render_to_string('app_queue/queue_table.html',
+                                {'entries': entries, 'version': version, 'queue_pk': self.queues.pk}, request)
+
+    def test_rows_are_cached_per_queue_version(self):
+        self.assertIn('First name', self.render_rows('First name', 1))
+        self.assertIn('First name', self.render_rows('Second name', 1))
+        self.assertIn('Second name', self.render_rows('Second name', 2))
+
+    def test_changes_show_up_on_the_pages(self):
+        self.assertNotContains(self.client.get(reverse('queue', args=[self.queues.pk])), 'Owner Profile')
+        self.assertNotContains(self.client.get(reverse('queues')), 'Renamed lab')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            services.enqueue(self.queues.pk, self.profile.pk)
+        self.assertContains(self.client.get(reverse('queue', args=[self.queues.pk])), 'Owner Profile')
+        self.assertContains(self.client.get(reverse('queues')), '<td>Lab</td>')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.queues.name, self.queues.description = 'Renamed lab', 'New description'
+            self.queues.save()
+        response = self.client.get(reverse('queues'))
+        self.assertContains(response, 'Renamed lab')
+        self.assertContains(response, 'New description')
+
+    def test_edits_outside_of_the_queue_show_up_on_the_pages(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            services.enqueue(self.queues.pk, self.profile.pk)
+        self.assertContains(self.client.get(reverse('queue', args=[self.queues.pk])), 'Owner Profile')
+        self.assertContains(self.client.get(reverse('queues')), '<td>Group</td>')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile.first_name = 'Renamed'
+            self.profile.save()
+            self.group.name = 'Renamed group'
+            self.group.save()
+        self.assertContains(self.client.get(reverse('queue', args=[self.queues.pk])), 'Renamed Profile')
+        self.assertContains(self.client.get(reverse('queues')), '<td>Renamed group</td>')
+
+    def test_saving_a_queue_keeps_its_counters(self):
+        stale = Queues.objects.get(pk=self.queues.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            services.enqueue(self.queues.pk, self.profile.pk)
+        stale.name = 'Renamed lab'
+        stale.save()
+        self.queues.refresh_from_db()
+        self.assertEqual((self.queues.next_position, self.queues.version), (services.POSITION_GAP, 2))
+        self.assertEqual(stale.version, 2)
+
+    @override_settings(TEMPLATE_FRAGMENT_CACHE_TIMEOUT=60)
+    def test_chrome_is_rendered_once(self):
+        self.client.get(reverse('home'))
+        with mock.patch('bootstrap5.templatetags.bootstrap5.bootstrap_css_url') as bootstrap_css_url:
+            response = self.client.get(reverse('queues'))
+        bootstrap_css_url.assert_not_called()
+        self.assertContains(response, 'bootstrap.min.css')
+
+
+class QueueSnapshotCacheTests(QueueTestCase):
+    """
+    Tests for the write-through cache of queue snapshots
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group')
+        self.profile = make_profile(self.group, 'owner', 'Owner', 'Profile')
+        self.queues = Queues.objects.create(name='Lab', group=self.group)
+        self.client.force_login(self.profile.user)
+        self.url = reverse('queue', args=[self.queues.pk])
+
+    def queue_queries(self):
+        """
+        Requests the queue page and returns the queries it ran against the queue tables
+        """
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        return [q['sql'] for q in ctx.captured_queries if 'app_queue_queue' in q['sql']]
+
+    def test_warm_cache_is_served_without_the_database(self):
+        self.assertTrue(self.queue_queries())
+        self.assertEqual(self.queue_queries(), [])
+        self.assertEqual(caching.get_snapshot_cache().stats()['hits'], 1)
+
+    def test_mutations_write_through(self):
+        self.queue_queries()
+        with self.captureOnCommitCallbacks() as callbacks:
+            services.enqueue(self.queues.pk, self.profile.pk)
+        # Until the change commits, the older snapshot is still served
+        self.assertEqual(caching.get_snapshot_cache().get(self.queues.pk).version, 0)
+
+        for callback in callbacks:
+            callback()
+        snapshot = caching.get_snapshot_cache().get(self.queues.pk)
+        self.assertEqual(snapshot.version, 1)
+        self.assertEqual(snapshot.entries, [caching.SnapshotEntry(1, self.profile.pk, 'Owner Profile')])
+        self.assertEqual(self.queue_queries(), [])
+
+    def test_snapshot_of_a_deleted_queue_is_not_written(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            services.enqueue(self.queues.pk, self.profile.pk)
+        Queues.objects.filter(pk=self.queues.pk).delete()
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(caching.get_snapshot_cache().get(self.queues.pk))
+
+    def test_snapshot_read_before_a_change_is_not_stored_after_it(self):
+        stale = services.load_snapshot(self.queues.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            services.enqueue(self.queues.pk, self.profile.pk)
+        caching.get_snapshot_cache().set(self.queues.pk, stale)
+        self.assertEqual([entry.user_id for entry in services.queue_snapshot(self.queues.pk).entries], [self.profile.pk])
+
+    def test_changes_do_not_read_the_whole_queue(self):
+        def write_queries(queue_id, profile_id):
+            with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as ctx:
+                services.move_to_tail(queue_id, profile_id)
+                services.insert_after(queue_id, profile_id, None)
+                services.pop_head(queue_id)
+                services.enqueue(queue_id, profile_id)
+                services.remove(queue_id, profile_id)
+            return [q['sql'] for q in ctx.captured_queries]
+
+        small, large = self.queues, Queues.objects.create(name='Large', group=self.group)
+        profiles = [make_profile(self.group, f'student{i}') for i in range(500)]
+        services.enqueue_many(small.pk, [profile.pk for profile in profiles[:5]])
+        services.enqueue_many(large.pk, [profile.pk for profile in profiles])
+        small_queries = write_queries(small.pk, profiles[1].pk)
+        large_queries = write_queries(large.pk, profiles[1].pk)
+        self.assertEqual(len(small_queries), len(large_queries))
+        # The snapshot, read with ROW_NUMBER(), is written through after the commit
+        self.assertFalse([sql for sql in large_queries if 'ROW_NUMBER' in sql])
+
+    def test_missing_queue(self):
+        self.assertEqual(self.client.get(reverse('queue', args=[self.queues.pk + 1])).status_code, 404)
+
+    def test_older_snapshot_does_not_replace_newer(self):
+        backend = caching.LocMemSnapshotBackend()
+        backend.set(1, caching.QueueSnapshot(2, []))
+        backend.set(1, caching.QueueSnapshot(1, [caching.SnapshotEntry(1, 1, 'Stale')]))
+        self.assertEqual(backend.get(1).version, 2)
+
+    def test_lru_eviction(self):
+        backend = caching.LocMemSnapshotBackend(max_entries=2)
+        for queue_id in (1, 2):
+            backend.set(queue_id, caching.QueueSnapshot(0, []))
+        backend.get(1)
+        backend.set(3, caching.QueueSnapshot(0, []))
+        self.assertIsNone(backend.get(2))
+        self.assertIsNotNone(backend.get(1))
+        self.assertEqual(backend.evictions, 1)
+
+    def test_django_cache_backend(self):
+        snapshot_cache = caching.SnapshotCache(caching.DjangoCacheSnapshotBackend())
+        self.assertIsNone(snapshot_cache.get(1))
+        snapshot_cache.set(1, caching.QueueSnapshot(3, [caching.SnapshotEntry(1, 7, 'Name')]))
+        self.assertEqual(snapshot_cache.get(1).entries[0].name, 'Name')
+        # The cache evicts on its own, without reporting it
+        self.assertEqual(snapshot_cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_shared_cache_is_seen_by_every_worker(self):
+        def worker():
+            return caching.SnapshotCache(caching.DjangoCacheSnapshotBackend(alias='snapshots'))
+
+        writer, reader = worker(), worker()
+        writer.clear()
+        self.addCleanup(writer.clear)
+        with mock.patch.object(caching, '_snapshot_cache', writer):
+            self.assertEqual(services.queue_snapshot(self.queues.pk).entries, [])
+            with self.captureOnCommitCallbacks(execute=True):
+                services.enqueue(self.queues.pk, self.profile.pk)
+        # The worker that did not handle the change reads the snapshot written through by the other
+        self.assertEqual([entry.user_id for entry in reader.get(self.queues.pk).entries], [self.profile.pk])
+        self.assertEqual(writer.get(self.queues.pk).version, 1)
+
+
+class LoadTestTests(LiveServerTestCase):
+    """
+    Tests for the HTTP load driver behind the ``loadtest`` command
+    """
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(benchmarks.percentile(samples, 0.5), 50)
+        self.assertEqual(benchmarks.percentile(samples, 0.99), 99)
+        self.assertEqual(benchmarks.percentile([], 0.99), 0)
+
+    def test_drives_a_live_server_as_a_logged_in_user(self):
+        group = StudyGroup.objects.create(name='Group')
+        profile = make_profile(group, 'student')
+        profile.user.set_password('secret')
+        profile.user.save()
+
+        out = StringIO()
+        call_command('loadtest', self.live_server_url, '--username', 'student', '--password', 'secret',
+                     '--requests', '20', '--concurrency', '2', '--json', stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual(results['requests'], 20)
+        self.assertEqual(results['errors'], 0)
+        self.assertGreater(results['rps'], 0)
+
+    def test_rejected_login(self):
+        with self.assertRaises(CommandError):
+            call_command('loadtest', self.live_server_url, '--username', 'nobody', '--password', 'wrong',
+                         '--requests', '1', '--concurrency', '1', stdout=StringIO())
+
+
+class ConnectionMetricsTests(TestCase):
+    """
+    Tests for the database connection counters and the handshake benchmark
+    """
+    def test_counts_requests_opening_a_connection(self):
+        counters = metrics.ConnectionMetrics()
+        counters.request_started()
+        counters.connection_created()
+        counters.request_finished()
+        for _ in range(3):
+            counters.request_started()
+            counters.request_finished()
+
+        self.assertEqual(counters.snapshot(), {
+            'requests': 4,
+            'requests_with_new_connection': 1,
+            'connections_opened': 1,
+            'connection_reuse_ratio': 0.75,
+        })
+
+    def test_receivers_are_connected(self):
+        before = metrics.connection_metrics.snapshot()['requests']
+        request_started.send(sender=self.__class__)
+        request_finished.send(sender=self.__class__)
+        self.assertEqual(metrics.connection_metrics.snapshot()['requests'], before + 1)
+
+    def test_handshake_benchmark(self):
+        out = StringIO()
+        call_command('benchmark', 'connections', '--iterations', '5', stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual(results['new_connection']['requests'], 5)
+        self.assertEqual(results['reused_connection']['requests'], 5)
+        self.assertIn('handshake_ms', results)
+
+
+class BenchmarkTests(QueueTestCase):
+    """
+    Tests for the workflow benchmarks and their comparison with a baseline
+    """
+    def test_seed_and_unseed(self):
+        data = benchmarks.seed(groups=2, profiles=5, queues=3, records=4)
+        self.assertEqual(Queues.objects.filter(group__in=data['groups']).count(), 6)
+        self.assertEqual(Queue.objects.filter(queue__group__in=data['groups']).count(), 24)
+        self.assertFalse(Queue.objects.filter(user__in=data['actors'][0]).exists())
+
+        benchmarks.unseed(data)
+        self.assertFalse(StudyGroup.objects.filter(pk__in=data['groups']).exists())
+        self.assertFalse(User.objects.filter(username__startswith=data['prefix']).exists())
+
+    def test_every_view_is_measured(self):
+        data = benchmarks.seed(groups=1, profiles=5, queues=2, records=3)
+        results = benchmarks.view_latencies(data, iterations=2)
+
+        self.assertEqual(set(results), {'home', 'queues', 'queue', 'add_user', 'update_user',
+                                        'delete_user', 'register', 'profile',
+                                        'home (anonymous)', 'queues (anonymous)', 'queue (anonymous)'})
+        for name, summary in results.items():
+            self.assertEqual((summary['requests'], summary['errors']), (2, 0), name)
+        # The session comes from the cache, so only the user is read
+        self.assertEqual(results['home']['queries'], 1)
+        # Anonymous requests are redirected before the view reads anything
+        for name in benchmarks.READ_PAGES:
+            self.assertEqual(results[f'{name} (anonymous)']['queries'], 0, name)
+        # The data set is left as it was
+        self.assertEqual(Queue.objects.filter(queue=data['queues'][0][0]).count(), 3)
+
+    def test_anonymous_benchmark_compares_the_read_pages(self):
+        out = StringIO()
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            call_command('benchmark', 'anonymous', '--iterations', '2', '--groups', '1', '--profiles', '5',
+                         '--queues', '2', '--records', '3', stdout=out)
+        views = json.loads(out.getvalue())['views']
+        self.assertEqual(set(views), {'home', 'queues', 'queue', 'home (anonymous)', 'queues (anonymous)', 'queue (anonymous)'})
+        self.assertGreater(views['queue']['queries'], views['queue (anonymous)']['queries'])
+
+    def test_template_renders_are_measured_in_both_modes(self):
+        data = benchmarks.seed(groups=1, profiles=5, queues=2, records=3)
+        results = benchmarks.render_latencies(data, iterations=2)
+
+        self.assertEqual(set(results), {'queue (cached)', 'queue (uncached)', 'queues (cached)', 'queues (uncached)'})
+        for name, summary in results.items():
+            self.assertEqual((summary['requests'], summary['errors']), (2, 0), name)
+
+    def test_session_engines_are_measured(self):
+        data = benchmarks.seed(groups=1, profiles=5, queues=2, records=3)
+        results = benchmarks.session_queries(data, iterations=2)
+
+        self.assertEqual(len(results), 4 * len(benchmarks.SESSION_ENGINES))
+        for name, summary in results.items():
+            self.assertEqual((summary['requests'], summary['errors']), (2, 0), name)
+        self.assertEqual(results['home (db)']['queries'], 2)
+        self.assertEqual(results['home (cached_db)']['queries'], 1)
+        self.assertEqual(results['home (signed_cookies)']['queries'], 1)
+
+    def test_compare(self):
+        baseline = {'views': {
+            'queue': {'p95_ms': 10.0, 'queries': 3, 'errors': 0},
+            'home': {'p95_ms': 0.5, 'queries': 2, 'errors': 0},
+        }}
+        results = {'views': {
+            'queue': {'p95_ms': 20.0, 'queries': 4, 'errors': 1},
+            'home': {'p95_ms': 1.0, 'queries': 2, 'errors': 0},
+            'profile': {'p95_ms': 50.0, 'queries': 9, 'errors': 0},
+        }}
+        self.assertEqual(benchmarks.compare(results, baseline), [
+            'queue: p95 latency 10.0 ms -> 20.0 ms',
+            'queue: 3 -> 4 queries',
+            'queue: 0 -> 1 errors',
+        ])
+        self.assertEqual(benchmarks.compare(baseline, baseline), [])
+
+    def test_command_fails_on_regression(self):
+        baseline = {'views': {name: {'p95_ms': 10000.0, 'queries': 0, 'errors': 0} for name in ('home', 'queue')}}
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump(baseline, f)
+        self.addCleanup(os.remove, f.name)
+
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, 'home: 0 -> 1 queries'):
+            call_command('benchmark', 'views', '--iterations', '1', '--groups', '1', '--profiles', '3',
+                         '--queues', '1', '--records', '2', '--baseline', f.name, stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual(results['scenario'], 'views')
+        self.assertIn('home: 0 -> 1 queries', results['regressions'])
+        self.assertFalse(User.objects.filter(username__startswith='bench-').exists())
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class MixedWorkloadTests(TransactionTestCase):
+    """
+    Tests for the concurrent mixed workload, which needs a database handling concurrent writers
+    """
+    def test_concurrent_clients(self):
+        data = benchmarks.seed(groups=1, profiles=3, queues=2, records=2)
+        results = benchmarks.mixed_workload(data, requests=40, concurrency=2)
+
+        self.assertEqual(results['overall']['requests'], 40)
+        self.assertEqual(results['overall']['errors'], 0)
+        self.assertEqual(sum(summary['requests'] for summary in results['views'].values()), 40)
+
+
+class InstrumentationMiddlewareTests(QueueTestCase):
+    """
+    Tests for the per-request instrumentation and the metrics endpoint
+    """
+    def setUp(self):
+        super().setUp()
+        self.group = StudyGroup.objects.create(name='Group')
+        self.profile = make_profile(self.group, 'owner')
+        self.queues = Queues.objects.create(name='Lab', group=self.group)
+        self.client.force_login(self.profile.user)
+        self.url = reverse('queue', args=[self.queues.pk])
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        timing = response['Server-Timing']
+        self.assertIn(f'desc="{len(ctx.captured_queries)} queries"', timing)
+        self.assertRegex(timing, r'tpl;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_metrics_are_recorded_per_url_name(self):
+        before = metrics.request_metrics.snapshot().get('queue', {}).get('requests', 0)
+        response = self.client.get(self.url)
+        counters = metrics.request_metrics.snapshot()['queue']
+        self.assertEqual(counters['requests'], before + 1)
+        self.assertGreater(counters['template_duration'], 0)
+        self.assertGreaterEqual(counters['response_bytes'], len(response.content))
+
+    @override_settings(INSTRUMENTATION_QUERY_WARNING_THRESHOLD=1)
+    def test_warns_about_too_many_queries(self):
+        client = Client()
+        client.force_login(self.profile.user)
+        with self.assertLogs('app_queue.middleware', 'WARNING') as logs:
+            client.get(self.url)
+        self.assertIn('(queue) ran', logs.output[0])
+
+    @override_settings(METRICS_ALLOWED_IPS=['127.0.0.1'])
+    def test_metrics_endpoint(self):
+        self.client.get(self.url)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertContains(response, 'app_queue_requests_total{view="queue"}')
+        self.assertContains(response, 'app_queue_snapshot_cache_total{result="hits"}')
+
+    def test_metrics_endpoint_is_restricted(self):
+        # Requests through a local reverse proxy all come from its address
+        self.assertEqual(Client(REMOTE_ADDR='127.0.0.1').get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        User.objects.filter(pk=self.profile.user_id).update(is_staff=True)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
@@ -10,8 +10,21 @@ urlpatterns = [
     path('queues/', views.queues, name='queues'),
     path('queues/create', views.create_queue, name='create_queue'),
     path('queue/<int:pk>/', views.queue, name='queue'),
+    path('queues/state/', views.group_state, name='group_state'),
+    path('queue/<int:pk>/state/', views.queue_state, name='queue_state'),
+    path('queue/<int:pk>/events/', views.queue_events, name='queue_events'),
     path('queue/<int:pk>/delete-user/<int:user_id>/', views.delete_user, name='delete_user'),
     path('queue/<int:pk>/add-user/<int:user_id>/', views.add_user, name='add_user'),
     path('queue/<int:pk>/update-user/<int:user_id>/', views.update_user, name='update_user'),
+    path('queue/<int:pk>/bulk/enqueue/', views.bulk_enqueue, name='bulk_enqueue'),
+    path('queue/<int:pk>/bulk/dequeue/', views.bulk_dequeue, name='bulk_dequeue'),
+    path('queue/<int:pk>/bulk/reorder/', views.bulk_reorder, name='bulk_reorder'),
+    path('queue/<int:pk>/export/', views.export_queue, name='export_queue'),
+    path('queues/export/', views.export_group, name='export_group'),
+    path('queue/<int:pk>/analytics/', views.queue_analytics, name='queue_analytics'),
+    path('queues/analytics/', views.group_analytics, name='group_analytics'),
+    path('queues/next/', views.next_up, name='next_up'),
+    path('groups/search/', views.search_groups, name='search_groups'),
     path('profile/', views.profile, name='profile'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
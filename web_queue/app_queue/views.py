@@ -1,23 +1,73 @@
-from django.contrib.auth import login
-from django.db.models import Max
-from django.http import HttpResponse
-from django.shortcuts import render, redirect, get_object_or_404
+import hashlib
+import json
+import time
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import login
+from django.db import IntegrityError, transaction
+from django.core.exceptions import BadRequest, PermissionDenied
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import render, redirect
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_http_methods, require_POST
+
+from . import analytics, caching, exports, scheduling, services
+from .broadcast import get_broadcast, live_updates_available
+from .metrics import render_prometheus
 from .forms import UserProfileForm, UserRegistrationForm, QueuesForm
-from .models import Queues, Queue, UserProfile
+from .models import Queues, StudyGroup, UserProfile
+
+
+def profile_or_404(request):
+    """
+    Returns the profile of the logged-in user
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
 
+    :return: The profile with its group joined in
+    :rtype: app_queue.models.UserProfile
+    :raises django.http.Http404: If the user has no profile, e.g. a superuser created from the command line
+    """
+    if request.profile is None:
+        raise Http404('The user has no profile.')
+    return request.profile
+
+
+async def aprofile_or_404(request):
+    """
+    Asynchronous version of :func:`profile_or_404`
 
-def home(request):
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+
+    :return: The profile with its group joined in
+    :rtype: app_queue.models.UserProfile
+    :raises django.http.Http404: If the user has no profile
+    """
+    profile = await request.aprofile()
+    if profile is None:
+        raise Http404('The user has no profile.')
+    return profile
+
+
+async def home(request):
     """
     Displays the home page of the queue application
 
+    The read views are asynchronous, so under ASGI a request waiting for the database does not
+    hold a worker thread. They rely on :class:`app_queue.middleware.LoginRequiredMiddleware`
+    having loaded ``request.user``, since Django 4.2 has no async interface for it. Templates
+    may still query the database (context processors are lazy), so they are rendered in a thread
+
     :param request: Django HttpRequest object
     :type request: django.http.HttpRequest
 
     :return: HttpResponse object with the rendered template 'app_queue/home.html'
     :rtype: django.http.HttpRequest
     """
-    return render(request, 'app_queue/home.html')
+    return await sync_to_async(render)(request, 'app_queue/home.html')
 
 
 def create_queue(request):
@@ -34,39 +84,68 @@ def create_queue(request):
     if request.method == 'POST':
         form = QueuesForm(request.POST)
         if form.is_valid():
-            # group = request.user.userprofile.group
-            # form.instance.group = group
-            user = request.user.userprofile
-            form.instance.creator = user
+            form.instance.creator_id = profile_or_404(request).pk
             queue = form.save()
-            Queue.objects.create(queue=queue, user=user, position=0)
+            services.enqueue(queue.pk, request.profile.pk)
+            caching.invalidate_queues(queue.group_id)
             return redirect('queues')
     else:
-        group = request.user.userprofile.group
-        form = QueuesForm(initial={'group': group})
+        form = QueuesForm(initial={'group': profile_or_404(request).group})
     return render(request, 'app_queue/create_queue.html', {'form': form})
 
 
-def queues(request):
+async def queues(request):
     """
-    Displays a list of queues associated with the currently logged-in user's group
+    Displays a page of the queues associated with the currently logged-in user's group
+
+    Queues are listed newest first, ``QUEUES_PAGE_SIZE`` at a time. The next page is selected
+    by the ``after`` query parameter holding the cursor of the current page
 
     :param request: Django HttpRequest object
     :type request: django.http.HttpRequest
 
     :return: HttpResponse object with the rendered template 'app_queue/queues.html',
-             including a dictionary containing 'user_queues' - the queues associated
-             with the user's group
+             including a dictionary containing 'user_queues' - the queues on the page and
+             'next_cursor' - the cursor of the next page, or None on the last page
     :rtype: django.http.HttpRequest
     """
-    user_queues = Queues.objects.filter(group=request.user.userprofile.group)
-    return render(request, 'app_queue/queues.html', {'user_queues': user_queues})
+    group_id = (await aprofile_or_404(request)).group_id
+    cursor = request.GET.get('after')
+    user_queues, next_cursor = await caching.aget_queues_page(
+        group_id, cursor,
+        lambda: services.agroup_queues_page(group_id, cursor, settings.QUEUES_PAGE_SIZE),
+    )
+    return await sync_to_async(render)(request, 'app_queue/queues.html', {'user_queues': user_queues, 'next_cursor': next_cursor})
 
 
-def queue(request, pk):
+def serves_events(request):
+    """
+    Tells whether the live queue updates can be streamed to a request
+
+    An idle event stream costs nothing but a coroutine under ASGI, whereas a WSGI worker would
+    be held for the whole life of the stream, so the streams are only served over ASGI
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+
+    :return: True if the request is served over ASGI
+    :rtype: bool
+    """
+    return hasattr(request, 'scope')
+
+
+async def queue(request, pk):
     """
     Displays the details of a specific queue identified by its primary key (pk)
 
+    The queue is read from its cached snapshot, so the database is only queried when
+    the snapshot is not cached yet. Over ASGI the page follows the changes of the queue through
+    :func:`queue_events`, unless the broadcast backend cannot reach every worker (see
+    :func:`app_queue.broadcast.live_updates_available`). Either way it polls this view every
+    ``QUEUE_POLL_INTERVAL`` seconds with htmx, sending the ``version`` it shows, so a change the
+    stream missed still shows up: such requests (carrying the ``HX-Request`` header) get only
+    the queue table, or an empty 204 response while the version is unchanged
+
     :param request: Django HttpRequest object
     :type request: django.http.HttpRequest
     :param pk: Primary key of the queue to be displayed
@@ -74,42 +153,236 @@ def queue(request, pk):
 
     :return: HttpResponse object with the rendered template 'app_queue/queue.html',
              including a dictionary containing:
-               - 'records': A sorted list of records in the queue.
+               - 'entries': The entries of the queue snapshot ordered by position.
+               - 'version': The version of the snapshot, keying the cached rows.
                - 'queue_pk': The primary key of the queue being displayed.
                - 'user_pk': The primary key of the currently logged-in user.
+               - 'live_updates': Whether the page streams the changes of the queue.
+               - 'poll_interval': Seconds between the checks of the version of the table.
+             If the queue does not exist, returns an HTTP 404 Not Found error
     :rtype: django.http.HttpRequest
     """
-    records = Queue.objects.filter(queue=pk)
-    pos = 0
-    for r in records:
-        pos = r.position = pos + 1
-
-    records = sorted(records, key=lambda x: x.position)
+    try:
+        snapshot = await services.aqueue_snapshot(pk)
+    except Queues.DoesNotExist:
+        raise Http404('No such queue.')
     context = {
-        'records': records,
+        'entries': snapshot.entries,
+        'version': snapshot.version,
         'queue_pk': pk,
-        'user_pk': request.user.userprofile.pk,
     }
-    return render(request, 'app_queue/queue.html', context)
+    if request.headers.get('HX-Request') == 'true':
+        if request.GET.get('version') == str(snapshot.version):
+            return HttpResponse(status=204)
+        return await sync_to_async(render)(request, 'app_queue/queue_table.html', context)
+    context.update({
+        'user_pk': (await aprofile_or_404(request)).pk,
+        'live_updates': serves_events(request) and live_updates_available(),
+        'poll_interval': settings.QUEUE_POLL_INTERVAL,
+    })
+    return await sync_to_async(render)(request, 'app_queue/queue.html', context)
+
+
+def get_snapshot_or_404(pk):
+    """
+    Returns the snapshot of a queue
 
+    :param pk: Primary key of the queue
+    :type pk: int
 
-def get_max_position_record(queue_id):
+    :return: The snapshot of the queue
+    :rtype: app_queue.caching.QueueSnapshot
+    :raises django.http.Http404: If the queue does not exist
     """
-    Retrieves the record with the maximum position in the specified queue
+    try:
+        return services.queue_snapshot(pk)
+    except Queues.DoesNotExist:
+        raise Http404('No such queue.')
 
-    :param queue_id: ID of the queue for which the maximum position record is to be retrieved
-    :type queue_id: int
 
-    :return: The record with the maximum position in the specified queue, or None if the queue is empty
-    :rtype: Queue or None
+def queue_etag(request, pk):
     """
-    max_position_record = Queue.objects.filter(queue_id=queue_id).aggregate(Max('position'))
-    max_position = max_position_record['position__max']
-    if max_position is not None:
-        record = Queue.objects.get(queue_id=queue_id, position=max_position)
-        return record
-    else:
+    Computes the strong ETag of the state of a queue from its version
+
+    The version is read by a primary key lookup and remembered on the request
+    as ``queue_version`` for :func:`queue_state`
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+    :param pk: Primary key of the queue
+    :type pk: int
+
+    :return: The ETag, or None if the queue does not exist
+    :rtype: str or None
+    """
+    request.queue_version = services.queue_version(pk)
+    if request.queue_version is None:
         return None
+    return f'"{pk}-{request.queue_version}"'
+
+
+@condition(etag_func=queue_etag)
+def queue_state(request, pk):
+    """
+    Returns the state of a queue as compact JSON, for clients polling the queue
+
+    The response carries a strong ETag derived from the version of the queue, and a request
+    whose ``If-None-Match`` header holds the current ETag is answered with an HTTP 304 Not
+    Modified after a single primary key lookup
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+    :param pk: Primary key of the queue
+    :type pk: int
+
+    :return: JSON response with the 'queue' ID, its 'version' and its 'entries', each being
+             a list of the position, the user profile ID and the name of a user.
+             If the queue does not exist, returns an HTTP 404 Not Found error
+    :rtype: django.http.JsonResponse
+    """
+    if request.queue_version is None:
+        raise Http404('No such queue.')
+    try:
+        snapshot = services.fresh_snapshot(pk, request.queue_version)
+    except Queues.DoesNotExist:
+        raise Http404('No such queue.')
+    response = JsonResponse({
+        'queue': pk,
+        'version': snapshot.version,
+        'entries': [list(entry) for entry in snapshot.entries],
+    })
+    response['ETag'] = f'"{pk}-{snapshot.version}"'
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def group_etag(request):
+    """
+    Computes the strong ETag of a page of the queues of the user's group
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+
+    :return: The ETag
+    :rtype: str
+    """
+    group_id = profile_or_404(request).group_id
+    fingerprint = f'{group_id}-{services.group_fingerprint(group_id)}-{request.GET.get("after", "")}'
+    return f'"{hashlib.md5(fingerprint.encode()).hexdigest()}"'
+
+
+@condition(etag_func=group_etag)
+def group_state(request):
+    """
+    Returns a page of the queues of the user's group as compact JSON, newest first
+
+    The response carries a strong ETag that changes whenever a queue of the group is created,
+    deleted or changed, and a request whose ``If-None-Match`` header holds the current ETag is
+    answered with an HTTP 304 Not Modified after a single aggregate query. The next page is
+    selected by the ``after`` query parameter, as in :func:`queues`
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+
+    :return: JSON response with the 'group' ID, its 'queues', each holding the 'id', 'name',
+             'version' and 'length' of a queue, and the cursor of the 'next' page, or None
+             on the last page
+    :rtype: django.http.JsonResponse
+    """
+    group_id = profile_or_404(request).group_id
+    page, next_cursor = services.group_queues_page(group_id, request.GET.get('after'), settings.QUEUES_PAGE_SIZE)
+    lengths = services.queue_lengths([queues.pk for queues in page])
+    response = JsonResponse({
+        'group': group_id,
+        'queues': [
+            {'id': queues.pk, 'name': queues.name, 'version': queues.version, 'length': lengths[queues.pk]}
+            for queues in page
+        ],
+        'next': next_cursor,
+    })
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+async def queue_events(request, pk):
+    """
+    Streams the changes of a queue to the browser as Server-Sent Events
+
+    The stream starts with a ``version`` event holding the current version of the queue, so
+    the page reloads its table if the queue changed since it was rendered. Each change made by
+    :func:`add_user`, :func:`delete_user` or :func:`update_user` is then sent as an ``enqueued``,
+    ``removed`` or ``moved`` event carrying the affected user and the new version, so the page
+    can update its table in place instead of reloading. The stream is idle between changes
+    (apart from a comment sent every ``QUEUE_EVENTS_KEEPALIVE`` seconds) and ends after
+    ``QUEUE_EVENTS_MAX_AGE`` seconds, after which the browser reconnects. The stream is only
+    served over ASGI (see :func:`serves_events`) with a broadcast backend reaching every worker
+    (see :func:`app_queue.broadcast.live_updates_available`)
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+    :param pk: Primary key of the queue whose changes are streamed
+    :type pk: int
+
+    :return: Streaming response with the ``text/event-stream`` content type
+    :rtype: django.http.StreamingHttpResponse
+    :raises django.http.Http404: If the request is not served over ASGI, if the broadcast
+                                 backend does not reach every worker or if the queue does not exist
+    """
+    if not serves_events(request) or not live_updates_available():
+        raise Http404('Live updates are not served.')
+    # Subscribing first, a change made while the version is read is sent afterwards
+    subscription = get_broadcast().subscribe(pk)
+    version = await Queues.objects.filter(pk=pk).values_list('version', flat=True).afirst()
+    if version is None:
+        subscription.close()
+        raise Http404('No such queue.')
+
+    async def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            yield f'event: version\ndata: {json.dumps({"type": "version", "version": version})}\n\n'
+            deadline = time.monotonic() + settings.QUEUE_EVENTS_MAX_AGE
+            while time.monotonic() < deadline:
+                message = await subscription.get(timeout=settings.QUEUE_EVENTS_KEEPALIVE)
+                if message is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield f'event: {message["type"]}\ndata: {json.dumps(message)}\n\n'
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def queue_changed(request, pk):
+    """
+    Builds the response of a view that changed a queue
+
+    Requests made by htmx (carrying the ``HX-Request`` header) get only the re-rendered
+    queue table, which the page swaps in place. Other requests are redirected to the
+    'queue' view
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+    :param pk: Primary key of the changed queue
+    :type pk: int
+
+    :return: HttpResponse object with the rendered template 'app_queue/queue_table.html',
+             or a redirect to the 'queue' view
+    :rtype: django.http.HttpResponse
+    """
+    if request.headers.get('HX-Request') == 'true':
+        snapshot = get_snapshot_or_404(pk)
+        context = {
+            'entries': snapshot.entries,
+            'version': snapshot.version,
+            'queue_pk': pk,
+        }
+        return render(request, 'app_queue/queue_table.html', context)
+    return redirect('queue', pk=pk)
 
 
 def delete_user(request, pk, user_id):
@@ -124,18 +397,22 @@ def delete_user(request, pk, user_id):
     :type user_id: int
 
     :return: Redirects to the 'queue' view for the same queue (specified by pk) after
-             deleting the user. If the queue does not exist or the user is not found
+             deleting the user, or returns the re-rendered queue table to htmx requests. If the queue does not exist or the user is not found
              in the queue, returns an HTTP 404 Not Found error
-    :rtype: django.http.HttpResponseRedirect
+    :rtype: django.http.HttpResponse
     """
-    record = get_object_or_404(Queue, queue=pk, user=user_id)
-    record.delete()
-    return redirect('queue', pk=pk)
+    try:
+        removed = services.remove(pk, user_id)
+    except Queues.DoesNotExist:
+        removed = False
+    if not removed:
+        raise Http404('No such user in the queue.')
+    return queue_changed(request, pk)
 
 
 def add_user(request, pk, user_id):
     """
-    Adds a user to a queue
+    Adds a user to the tail of a queue
 
     :param request: Django HttpRequest object
     :type request: django.http.HttpRequest
@@ -145,24 +422,20 @@ def add_user(request, pk, user_id):
     :type user_id: int
 
     :return: Redirects to the 'queue' view for the same queue (specified by pk) after
-             adding the user. If the queue does not exist or the user is already in the queue,
-             or an error occurs while determining the position, redirects back to the 'queue' view
-    :rtype: django.http.HttpResponseRedirect
-    """
-    record = get_max_position_record(pk)
-    if record is not None:
-        if record.user.pk == user_id:
-            return redirect('queue', pk=pk)
-        position = record.position + 1
-    else:
-        position = 0
-    Queue.objects.create(queue=Queues.objects.get(pk=pk), user=UserProfile.objects.get(pk=user_id), position=position)
-    return redirect('queue', pk=pk)
+             adding the user, or returns the re-rendered queue table to htmx requests. If the user is already in the queue, they keep their place.
+             If the queue or the user does not exist, returns an HTTP 404 Not Found error
+    :rtype: django.http.HttpResponse
+    """
+    try:
+        services.enqueue(pk, user_id)
+    except (Queues.DoesNotExist, IntegrityError):
+        raise Http404('No such queue or user.')
+    return queue_changed(request, pk)
 
 
 def update_user(request, pk, user_id):
     """
-    Updates the position of a user in a queue by deleting and re-adding them
+    Moves a user to the tail of a queue
 
     :param request: Django HttpRequest object
     :type request: django.http.HttpRequest
@@ -172,21 +445,440 @@ def update_user(request, pk, user_id):
     :type user_id: int
 
     :return: Redirects to the 'queue' view for the same queue (specified by pk) after
-             updating the user's position. If the queue does not exist or the user is not found
+             updating the user's position, or returns the re-rendered queue table to htmx requests. If the queue does not exist or the user is not found
              in the queue, returns an HTTP 404 Not Found error
-    :rtype: django.http.HttpResponseRedirect
+    :rtype: django.http.HttpResponse
+    """
+    try:
+        moved = services.move_to_tail(pk, user_id)
+    except Queues.DoesNotExist:
+        moved = False
+    if not moved:
+        raise Http404('No such user in the queue.')
+    return queue_changed(request, pk)
+
+
+def check_queue_manager(request, pk):
+    """
+    Checks that the user manages a queue, being its creator or a staff user
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+    :param pk: Primary key of the queue
+    :type pk: int
+
+    :raises django.http.Http404: If the queue does not exist
+    :raises django.core.exceptions.PermissionDenied: If the user does not manage the queue
+    """
+    check_queues_manager(request, [pk])
+
+
+def check_queues_manager(request, pks):
+    """
+    Checks that the user manages every one of several queues, with a single query
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+    :param pks: Primary keys of the queues
+    :type pks: list
+
+    :raises django.http.Http404: If a queue does not exist
+    :raises django.core.exceptions.PermissionDenied: If the user does not manage a queue
+    """
+    creators = dict(Queues.objects.filter(pk__in=pks).values_list('pk', 'creator__user_id'))
+    if len(creators) != len(set(pks)):
+        raise Http404('No such queue.')
+    if not request.user.is_staff and any(creator != request.user.pk for creator in creators.values()):
+        raise PermissionDenied
+
+
+def read_bulk_request(request, pk):
+    """
+    Checks the permission of a bulk operation on a queue and parses its JSON body
+
+    Bulk operations may only be applied by the managers of the queue, see :func:`check_queue_manager`
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+    :param pk: Primary key of the queue
+    :type pk: int
+
+    :return: The parsed body, whose 'users' item (if any) is a list of user profile IDs
+    :rtype: dict
+    :raises django.http.Http404: If the queue does not exist
+    :raises django.core.exceptions.PermissionDenied: If the user may not change the queue in bulk
+    :raises django.core.exceptions.BadRequest: If the body is not a valid JSON object
+    """
+    check_queue_manager(request, pk)
+    try:
+        body = json.loads(request.body)
+    except ValueError:
+        raise BadRequest('The body must be JSON.')
+    if not isinstance(body, dict):
+        raise BadRequest('The body must be a JSON object.')
+    users = body.get('users')
+    if users is not None and not (isinstance(users, list) and
+                                  all(isinstance(user, int) and not isinstance(user, bool) for user in users)):
+        raise BadRequest("'users' must be a list of user profile IDs.")
+    return body
+
+
+def bulk_response(pk, **fields):
+    """
+    Builds the response of a bulk operation on a queue
+
+    :param pk: Primary key of the changed queue
+    :type pk: int
+    :param fields: Results of the operation to include in the response
+    :type fields: dict
+
+    :return: JSON response with the results of the operation, the new 'version' of the queue
+             and its 'entries', each holding the 'position', 'user_id' and 'name' of a user
+    :rtype: django.http.JsonResponse
+    """
+    snapshot = get_snapshot_or_404(pk)
+    return JsonResponse({
+        **fields,
+        'version': snapshot.version,
+        'entries': [entry._asdict() for entry in snapshot.entries],
+    })
+
+
+@require_POST
+def bulk_enqueue(request, pk):
+    """
+    Appends several users to the tail of a queue in one transaction
+
+    The body is a JSON object whose 'users' item lists the user profile IDs in order.
+    Users already in the queue keep their place
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+    :param pk: Primary key of the queue
+    :type pk: int
+
+    :return: JSON response with the IDs of the users who were added under 'added',
+             as built by :func:`bulk_response`. If a user does not exist, returns an
+             HTTP 400 Bad Request error
+    :rtype: django.http.JsonResponse
+    """
+    body = read_bulk_request(request, pk)
+    if body.get('users') is None:
+        raise BadRequest("'users' is required.")
+    try:
+        added = services.enqueue_many(pk, body['users'])
+    except Queues.DoesNotExist:
+        raise Http404('No such queue.')
+    except UserProfile.DoesNotExist:
+        raise BadRequest('No such user.')
+    return bulk_response(pk, added=added)
+
+
+@require_POST
+def bulk_dequeue(request, pk):
+    """
+    Removes several users from a queue in one transaction
+
+    The body is a JSON object holding either the user profile IDs to be removed under 'users'
+    or the number of users to be removed from the head of the queue under 'count'
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+    :param pk: Primary key of the queue
+    :type pk: int
+
+    :return: JSON response with the number of users removed under 'removed',
+             as built by :func:`bulk_response`
+    :rtype: django.http.JsonResponse
+    """
+    body = read_bulk_request(request, pk)
+    count = body.get('count')
+    if count is not None and (not isinstance(count, int) or isinstance(count, bool) or count < 0):
+        raise BadRequest("'count' must be a non-negative integer.")
+    if (body.get('users') is None) == (count is None):
+        raise BadRequest("Either 'users' or 'count' is required.")
+    try:
+        removed = services.remove_many(pk, body.get('users'), count)
+    except Queues.DoesNotExist:
+        raise Http404('No such queue.')
+    return bulk_response(pk, removed=removed)
+
+
+@require_POST
+def bulk_reorder(request, pk):
     """
-    record = get_object_or_404(Queue, queue=pk, user=user_id)
-    record.delete()
+    Puts the users of a queue in a new order in one transaction
 
-    record = get_max_position_record(pk)
-    if record is not None:
-        position = record.position + 1
+    The body is a JSON object whose 'users' item lists the IDs of every user profile in the
+    queue in the new order
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+    :param pk: Primary key of the queue
+    :type pk: int
+
+    :return: JSON response built by :func:`bulk_response`. If the IDs are not exactly the
+             users in the queue, returns an HTTP 400 Bad Request error
+    :rtype: django.http.JsonResponse
+    """
+    body = read_bulk_request(request, pk)
+    if body.get('users') is None:
+        raise BadRequest("'users' is required.")
+    try:
+        services.reorder(pk, body['users'])
+    except Queues.DoesNotExist:
+        raise Http404('No such queue.')
+    except ValueError as e:
+        raise BadRequest(str(e))
+    return bulk_response(pk)
+
+
+def read_next_up_request(request):
+    """
+    Reads the parameters of a :func:`next_up` request, from the query parameters of a GET
+    request (``queue`` and ``weight`` repeated) or from the JSON body of a POST request
+    (``queues`` and ``weights`` as lists)
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+
+    :return: A tuple of the queue IDs, the number of users, the name of the policy and the
+             weights by queue ID
+    :rtype: tuple
+    :raises django.core.exceptions.BadRequest: If a parameter is missing or invalid
+    """
+    if request.method == 'POST':
+        try:
+            body = json.loads(request.body)
+        except ValueError:
+            raise BadRequest('The body must be JSON.')
+        if not isinstance(body, dict):
+            raise BadRequest('The body must be a JSON object.')
+        queue_ids, count = body.get('queues'), body.get('count', 1)
+        policy, weights = body.get('policy', 'round_robin'), body.get('weights') or []
     else:
-        position = 0
-    Queue.objects.create(queue=Queues.objects.get(pk=pk), user=UserProfile.objects.get(pk=user_id), position=position)
+        queue_ids, count = request.GET.getlist('queue'), request.GET.get('count', 1)
+        policy, weights = request.GET.get('policy', 'round_robin'), request.GET.getlist('weight')
+    try:
+        queue_ids = [int(queue_id) for queue_id in queue_ids]
+        count = int(count)
+        weights = [float(weight) for weight in weights]
+    except (TypeError, ValueError):
+        raise BadRequest("'queues' must be queue IDs, 'count' an integer and 'weights' numbers.")
+    if not queue_ids:
+        raise BadRequest("'queues' is required.")
+    if not 0 < count <= settings.NEXT_UP_LIMIT:
+        raise BadRequest(f"'count' must be between 1 and {settings.NEXT_UP_LIMIT}.")
+    if weights and len(weights) != len(queue_ids):
+        raise BadRequest("'weights' must give a weight to every queue.")
+    return queue_ids, count, policy, dict(zip(queue_ids, weights))
+
+
+@require_http_methods(['GET', 'POST'])
+def next_up(request):
+    """
+    Returns the next users to be served across several queues, to the managers of the queues
 
-    return redirect('queue', pk=pk)
+    A GET request only shows them; a POST request removes them from their queues in one
+    transaction, see :func:`app_queue.services.dequeue_next`. The users are chosen by the
+    policy, one of :data:`app_queue.scheduling.POLICIES`: 'round_robin' (the default),
+    'oldest_first' or 'weighted'. See :func:`read_next_up_request` for the parameters
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+
+    :return: JSON response with the 'policy' and the 'next' users, each holding the 'queue_id',
+             'place', 'user_id', 'name' and 'enqueued_at' of a user, and telling under 'dequeued'
+             whether they were removed
+    :rtype: django.http.JsonResponse
+    :raises django.http.Http404: If a queue does not exist
+    :raises django.core.exceptions.PermissionDenied: If the user does not manage every queue
+    """
+    queue_ids, count, policy, weights = read_next_up_request(request)
+    check_queues_manager(request, queue_ids)
+    dequeue = request.method == 'POST'
+    try:
+        if dequeue:
+            chosen = services.dequeue_next(queue_ids, count, policy, weights)
+        else:
+            chosen = scheduling.next_up(queue_ids, count, policy, weights)
+    except Queues.DoesNotExist:
+        raise Http404('No such queue.')
+    except ValueError as e:
+        raise BadRequest(str(e))
+    return JsonResponse({'policy': policy, 'next': [entry._asdict() for entry in chosen], 'dequeued': dequeue})
+
+
+def read_export_request(request):
+    """
+    Reads the data set and the format of an export from the ``data`` and ``format`` query
+    parameters, 'records' and 'csv' by default
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+
+    :return: A tuple of the names of the data set and of the format
+    :rtype: tuple
+    :raises django.core.exceptions.BadRequest: If the data set or the format is unknown
+    """
+    data, fmt = request.GET.get('data', 'records'), request.GET.get('format', 'csv')
+    if data not in exports.DATA_SETS:
+        raise BadRequest(f"'data' must be one of {', '.join(exports.DATA_SETS)}.")
+    if fmt not in exports.FORMATS:
+        raise BadRequest(f"'format' must be one of {', '.join(exports.FORMATS)}.")
+    return data, fmt
+
+
+def export_queue(request, pk):
+    """
+    Streams the records or the event log of a queue as CSV or JSON, to its managers
+
+    The rows are read ``EXPORT_CHUNK_SIZE`` at a time and sent as they are formatted, so the
+    memory used does not depend on the size of the queue
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+    :param pk: Primary key of the queue
+    :type pk: int
+
+    :return: Streaming response with the document as an attachment, see :func:`read_export_request`
+             for the query parameters
+    :rtype: django.http.StreamingHttpResponse
+    :raises django.http.Http404: If the queue does not exist
+    :raises django.core.exceptions.PermissionDenied: If the user does not manage the queue
+    """
+    check_queue_manager(request, pk)
+    data, fmt = read_export_request(request)
+    chunks = exports.export([pk], data, fmt, settings.EXPORT_CHUNK_SIZE)
+    return exports.streaming_response(request, chunks, fmt, f'queue-{pk}-{data}')
+
+
+def read_group_request(request):
+    """
+    Reads the study group of a request of a staff user from the ``group`` query parameter,
+    the group of the user by default
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+
+    :return: ID of the group
+    :rtype: int
+    :raises django.core.exceptions.PermissionDenied: If the user is not a staff user
+    :raises django.core.exceptions.BadRequest: If the group is not an ID
+    """
+    if not request.user.is_staff:
+        raise PermissionDenied
+    profile = request.profile
+    group_id = request.GET.get('group') or (profile and profile.group_id)
+    try:
+        return int(group_id)
+    except (TypeError, ValueError):
+        raise BadRequest("'group' must be a study group ID.")
+
+
+def export_group(request):
+    """
+    Streams the records or the event logs of every queue of a study group as CSV or JSON,
+    to staff users
+
+    The group is given by the ``group`` query parameter, the group of the user by default
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+
+    :return: Streaming response with the document as an attachment, see :func:`read_export_request`
+             for the other query parameters
+    :rtype: django.http.StreamingHttpResponse
+    :raises django.core.exceptions.PermissionDenied: If the user is not a staff user
+    """
+    group_id = read_group_request(request)
+    data, fmt = read_export_request(request)
+    chunks = exports.export(Queues.objects.filter(group=group_id).values('pk'), data, fmt, settings.EXPORT_CHUNK_SIZE)
+    return exports.streaming_response(request, chunks, fmt, f'group-{group_id}-{data}')
+
+
+def read_hours_request(request):
+    """
+    Reads the number of hours listed by an analytics dashboard from the ``hours`` query
+    parameter, ``ANALYTICS_HOURS`` by default
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+
+    :return: The number of hours
+    :rtype: int
+    :raises django.core.exceptions.BadRequest: If it is not a number between 1 and ``ANALYTICS_MAX_HOURS``
+    """
+    try:
+        hours = int(request.GET.get('hours', settings.ANALYTICS_HOURS))
+    except ValueError:
+        hours = 0
+    if not 1 <= hours <= settings.ANALYTICS_MAX_HOURS:
+        raise BadRequest(f"'hours' must be a number between 1 and {settings.ANALYTICS_MAX_HOURS}.")
+    return hours
+
+
+def queue_analytics(request, pk):
+    """
+    Displays the wait-time analytics of a queue to its managers
+
+    The page is built from the hourly rollups of :mod:`app_queue.analytics` alone, so its cost
+    does not depend on the length of the queue or of its history
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+    :param pk: Primary key of the queue
+    :type pk: int
+
+    :return: HttpResponse object with the rendered template 'app_queue/analytics.html',
+             including the 'title' of the page and the 'stats' returned by
+             :func:`app_queue.analytics.dashboard` for the last ``hours`` hours
+    :rtype: django.http.HttpResponse
+    :raises django.http.Http404: If the queue does not exist
+    :raises django.core.exceptions.PermissionDenied: If the user does not manage the queue
+    """
+    check_queue_manager(request, pk)
+    stats = analytics.dashboard(queue_id=pk, hours=read_hours_request(request))
+    return render(request, 'app_queue/analytics.html', {'title': f'Queue {pk}', 'stats': stats})
+
+
+def group_analytics(request):
+    """
+    Displays the wait-time analytics of every queue of a study group together, to staff users
+
+    The group is given by the ``group`` query parameter, the group of the user by default.
+    See :func:`queue_analytics`
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+
+    :return: HttpResponse object with the rendered template 'app_queue/analytics.html'
+    :rtype: django.http.HttpResponse
+    :raises django.core.exceptions.PermissionDenied: If the user is not a staff user
+    """
+    group_id = read_group_request(request)
+    stats = analytics.dashboard(group_id=group_id, hours=read_hours_request(request))
+    return render(request, 'app_queue/analytics.html', {'title': f'Group {group_id}', 'stats': stats})
+
+
+def search_groups(request):
+    """
+    Finds the study groups whose name starts with the ``q`` query parameter, for the group picker
+
+    The comparison ignores case and repeated spaces and is served by the index on
+    ``StudyGroup.name_key``. At most ``GROUP_SEARCH_LIMIT`` groups are returned
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+
+    :return: JSON response with the 'results', each holding the 'id' and the 'name' of a group,
+             ordered by name
+    :rtype: django.http.JsonResponse
+    """
+    query = StudyGroup.normalize(request.GET.get('q', ''))
+    groups = (StudyGroup.objects.filter(name_key__startswith=query).order_by('name_key')
+              .values_list('pk', 'name')[:settings.GROUP_SEARCH_LIMIT])
+    return JsonResponse({'results': [{'id': pk, 'name': name} for pk, name in groups]})
 
 
 def register(request):
@@ -205,12 +897,11 @@ def register(request):
         user_form = UserRegistrationForm(request.POST)
         profile_form = UserProfileForm(request.POST)
         if user_form.is_valid() and profile_form.is_valid():
-            user = user_form.save()
-            user.set_password(user_form.cleaned_data['password'])
-            user.save()
-            profile = profile_form.save(commit=False)
-            profile.user = user
-            profile.save()
+            with transaction.atomic():
+                user = user_form.save()
+                profile = profile_form.save(commit=False)
+                profile.user = user
+                profile.save()
             login(request, user)
             return redirect('home')
     else:
@@ -219,7 +910,7 @@ def register(request):
     return render(request, 'registration/register.html', {'user_form': user_form, 'profile_form': profile_form})
 
 
-def profile(request):
+async def profile(request):
     """
     Displays and handles updates to the user's profile
 
@@ -231,17 +922,53 @@ def profile(request):
              Otherwise, renders the profile form with the user's current profile data
     :rtype: django.http.HttpRequest
     """
-    user_profile = UserProfile.objects.get(user=request.user)
+    user_profile = await request.aprofile()
     if request.method == 'POST':
-        form = UserProfileForm(request.POST, instance=user_profile)
-        if form.is_valid():
-            # Обновляем данные профиля пользователя
-            user_profile = form.save(commit=False)
-            user = request.user
-            user.username = form.cleaned_data['username']
-            user.save()
-            user_profile.save()
-            return redirect('user_profile')
-    else:
-        form = UserProfileForm(instance=user_profile, initial={'username': request.user.username})
+        return await sync_to_async(update_profile)(request, user_profile)
+    form = UserProfileForm(instance=user_profile, initial={'username': request.user.username})
+    # The choices of the group field are queried while rendering, so it is done in a thread
+    return await sync_to_async(render)(request, 'app_queue/profile.html', {'form': form})
+
+
+def update_profile(request, user_profile):
+    """
+    Handles the POST request of :func:`profile`
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+    :param user_profile: Profile of the currently logged-in user
+    :type user_profile: app_queue.models.UserProfile
+
+    :return: If the form is valid, updates the user's profile data and redirects to the
+             'user_profile' page. Otherwise, renders the profile form with the submitted data
+    :rtype: django.http.HttpRequest
+    """
+    form = UserProfileForm(request.POST, instance=user_profile)
+    if form.is_valid():
+        # Обновляем данные профиля пользователя
+        user_profile = form.save(commit=False)
+        user = request.user
+        user.username = form.cleaned_data['username']
+        user.save()
+        user_profile.save()
+        return redirect('user_profile')
     return render(request, 'app_queue/profile.html', {'form': form})
+
+
+def metrics(request):
+    """
+    Exposes the performance metrics of the application in the Prometheus text format
+
+    Only staff users and the addresses listed in the ``METRICS_ALLOWED_IPS`` setting
+    (e.g. the Prometheus server) may read the metrics. The addresses are matched against
+    ``REMOTE_ADDR``, which is the address of the proxy for requests coming through one
+
+    :param request: Django HttpRequest object
+    :type request: django.http.HttpRequest
+
+    :return: HttpResponse object with the metrics. Other clients get an HTTP 403 Forbidden error
+    :rtype: django.http.HttpResponse
+    """
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS and not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,48 @@
+"""
+Gunicorn configuration for serving web_queue in production.
+
+Run it from the repository root with::
+
+    gunicorn -c web_queue/gunicorn.conf.py
+
+Every option can be overridden through the environment:
+
+- ``WEB_BIND``: address to listen on (default ``0.0.0.0:8000``)
+- ``WEB_CONCURRENCY``: number of worker processes (default ``2 * CPUs + 1``)
+- ``WEB_THREADS``: threads per worker process (default ``4``)
+- ``WEB_SERVER``: ``wsgi`` for threaded WSGI workers or ``asgi`` for Uvicorn workers serving
+  ``web_queue.asgi``, which the queue event streams need (default ``wsgi``)
+- ``WEB_TIMEOUT``: seconds before a silent worker is restarted (default ``30``)
+- ``WEB_MAX_REQUESTS``: requests served by a worker before it is recycled, 0 to disable
+  (default ``2000``)
+
+Sending ``SIGHUP`` to the master process reloads the configuration and the code: new workers
+are started and the old ones finish their requests before exiting, so no request is dropped.
+"""
+import multiprocessing
+import os
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+
+bind = os.environ.get('WEB_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 4))
+
+if os.environ.get('WEB_SERVER', 'wsgi') == 'asgi':
+    wsgi_app = 'web_queue.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'web_queue.wsgi:application'
+    worker_class = 'gthread'
+
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+graceful_timeout = timeout
+keepalive = 5
+
+# Recycling workers now and then bounds the memory a worker can leak; the jitter keeps
+# them from restarting all at once
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
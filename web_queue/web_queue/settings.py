@@ -10,21 +10,57 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import multiprocessing
+import os
+import sys
+import tempfile
+from importlib.util import find_spec
 from pathlib import Path
 
+import django
+
+
+def env_bool(name, default=False):
+    """
+    Reads a boolean from an environment variable ('1', 'true', 'yes' and 'on' are true)
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_list(name, default):
+    """
+    Reads a comma-separated list from an environment variable
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-# Quick-start development settings - unsuitable for production
+# Every deployment-specific setting below is read from the environment, with defaults
+# suitable for production except for the secret key.
 # See https://docs.djangoproject.com/en/5.0/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'django-insecure-!03^t(irk0hzr%#5zb6n$0(+kd_o=alr82p97$6f@r1wf4l(z='
+SECRET_KEY = (
+    os.environ.get('DJANGO_SECRET_KEY')
+    or 'django-insecure-!03^t(irk0hzr%#5zb6n$0(+kd_o=alr82p97$6f@r1wf4l(z='
+)
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# Debug mode also keeps every SQL query of a request in memory.
+DEBUG = env_bool('DJANGO_DEBUG')
+
+# Whether the process runs the test suite
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
 
-ALLOWED_HOSTS = ['*']
+ALLOWED_HOSTS = env_list('DJANGO_ALLOWED_HOSTS', ['*'])
 
 # Application definition
 
@@ -41,10 +77,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'app_queue.middleware.StaticFilesMiddleware',
+    'app_queue.middleware.InstrumentationMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'app_queue.middleware.ProfileMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'app_queue.middleware.LoginRequiredMiddleware',
@@ -52,22 +91,38 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'web_queue.urls'
 
+# Templates are read from the res directory and from the apps. In production the compiled
+# templates are kept by the cached loader for the lifetime of the worker; in debug mode
+# they are read again on every render, so edits show up without a restart
+
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': ['/app/web_queue/res'],
-        'APP_DIRS': True,
+        'BACKEND': 'app_queue.templating.InstrumentedDjangoTemplates',
+        'DIRS': [BASE_DIR / 'res'],
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'app_queue.templating.fragment_cache',
             ],
+            'loaders': TEMPLATE_LOADERS if DEBUG else [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)],
         },
     },
 ]
 
+# How long (in seconds) the template fragments of the pages may be cached: the page chrome
+# and the rows of the queue pages, which are keyed by the queue versions. They are stored
+# in the 'template_fragments' cache if it is configured, otherwise in the default one
+
+TEMPLATE_FRAGMENT_CACHE_TIMEOUT = int(os.environ.get('DJANGO_TEMPLATE_FRAGMENT_CACHE_TIMEOUT', 300))
+
 WSGI_APPLICATION = 'web_queue.wsgi.application'
 
 # Database
@@ -76,14 +131,73 @@ WSGI_APPLICATION = 'web_queue.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'db_queue',
-        'USER': 'admin',
-        'PASSWORD': 'admin',
-        'HOST': 'db',
-        'PORT': '5432',
+        'NAME': os.environ.get('POSTGRES_DB', 'db_queue'),
+        'USER': os.environ.get('POSTGRES_USER', 'admin'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', 'admin'),
+        'HOST': os.environ.get('POSTGRES_HOST', 'db'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        # Keep connections open between requests instead of connecting for every request,
+        # and check them before reuse so a connection dropped by the server is replaced.
+        # Under ASGI every request gets a new thread and thus a new connection anyway,
+        # so they default to off there.
+        'CONN_MAX_AGE': int(os.environ.get('DJANGO_CONN_MAX_AGE', 0 if os.environ.get('WEB_SERVER') == 'asgi' else 60)),
+        'CONN_HEALTH_CHECKS': env_bool('DJANGO_CONN_HEALTH_CHECKS', True),
     }
 }
 
+# A real connection pool shared by the threads of a worker (Django 5.1+ with psycopg 3
+# and psycopg-pool installed); it replaces the persistent connections above
+
+if env_bool('DJANGO_DB_POOL') and django.VERSION >= (5, 1):
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.environ.get('DJANGO_DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ.get('DJANGO_DB_POOL_MAX_SIZE', 10)),
+            'timeout': int(os.environ.get('DJANGO_DB_POOL_TIMEOUT', 10)),
+        },
+    }
+
+# Caches: the default one is local to every worker process. Sessions and queue snapshots are
+# cached in files shared by the workers of a host, so a change seen by one worker is seen by
+# all; with several hosts point DJANGO_SESSION_CACHE_LOCATION and DJANGO_SNAPSHOT_CACHE_LOCATION
+# to shared directories or use a shared cache server instead
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('DJANGO_SESSION_CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'web_queue_sessions')),
+        'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('DJANGO_SESSION_CACHE_MAX_ENTRIES', 20000))},
+    },
+    'snapshots': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('DJANGO_SNAPSHOT_CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'web_queue_snapshots')),
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('DJANGO_SNAPSHOT_CACHE_MAX_ENTRIES', 10000))},
+    },
+}
+
+if TESTING:
+    # The test runs keep their caches in memory, so they share no state through the temp directory
+    for alias in ('sessions', 'snapshots'):
+        CACHES[alias] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': alias,
+                         'TIMEOUT': CACHES[alias].get('TIMEOUT', 300)}
+
+# Sessions: DJANGO_SESSION_ENGINE selects a backend of django.contrib.sessions.
+# 'cached_db' (the default) reads sessions from the 'sessions' cache and only queries the
+# session table on a miss, so the cache may lose entries; 'db' queries the table on every
+# authenticated request; 'signed_cookies' keeps the session in the cookie without any query,
+# but a session cannot be revoked before it expires; 'cache' and 'file' are also accepted.
+# Expired sessions are deleted by 'manage.py clearsessions' (the 'sessions' service of
+# docker-compose runs it daily)
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.' + os.environ.get('DJANGO_SESSION_ENGINE', 'cached_db')
+
+SESSION_CACHE_ALIAS = 'sessions'
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -102,6 +216,36 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing. New passwords are hashed by the hasher selected by DJANGO_PASSWORD_HASHER:
+# 'argon2' (the default when the argon2-cffi package is installed) or 'pbkdf2'. Hashes made by
+# the other hashers or with other costs are still accepted and rehashed when their user logs
+# in. Every hash takes the CPU of the request for a while (see 'benchmark auth'): lowering the
+# costs speeds up registrations and logins at the price of cheaper brute force of leaked hashes
+
+PASSWORD_HASHER = os.environ.get('DJANGO_PASSWORD_HASHER') or ('argon2' if find_spec('argon2') else 'pbkdf2')
+
+PASSWORD_HASHERS = [
+    'app_queue.hashers.Argon2PasswordHasher',
+    'app_queue.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+if PASSWORD_HASHER == 'pbkdf2':
+    PASSWORD_HASHERS[:2] = reversed(PASSWORD_HASHERS[:2])
+
+# Number of PBKDF2 iterations, 0 for the default of Django
+
+PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('DJANGO_PBKDF2_ITERATIONS', 0))
+
+# Argon2 costs: passes over the memory, memory per hash in KiB and lanes (the defaults of Django)
+
+PASSWORD_ARGON2_TIME_COST = int(os.environ.get('DJANGO_ARGON2_TIME_COST', 2))
+
+PASSWORD_ARGON2_MEMORY_COST = int(os.environ.get('DJANGO_ARGON2_MEMORY_COST', 102400))
+
+PASSWORD_ARGON2_PARALLELISM = int(os.environ.get('DJANGO_ARGON2_PARALLELISM', 8))
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
 
@@ -118,6 +262,20 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# collectstatic gathers the static files here, from where WhiteNoise serves them
+# compressed and with far-future cache headers, without going through the views
+
+STATIC_ROOT = Path(os.environ.get('DJANGO_STATIC_ROOT', BASE_DIR / 'staticfiles'))
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -125,3 +283,84 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'home'
+
+# Paths reachable without logging in, besides the login and registration pages
+# (see app_queue.middleware.LoginRequiredMiddleware); the group search is used by the
+# registration page
+
+LOGIN_REQUIRED_ALLOWED_PREFIXES = ['/' + STATIC_URL, '/admin/', '/metrics/', '/groups/search/']
+
+LOGIN_REQUIRED_ALLOWED_PATTERNS = []
+
+# Request instrumentation (see app_queue.middleware.InstrumentationMiddleware): requests
+# running more queries than the threshold are logged, and the metrics endpoint is open to
+# staff users and to these addresses. The addresses are compared with REMOTE_ADDR, so none are
+# allowed by default: behind a reverse proxy on the same host every client has its address
+
+INSTRUMENTATION_QUERY_WARNING_THRESHOLD = int(os.environ.get('DJANGO_QUERY_WARNING_THRESHOLD', 20))
+
+METRICS_ALLOWED_IPS = env_list('DJANGO_METRICS_ALLOWED_IPS', [])
+
+# Queue listing: number of queues per page and how long (in seconds) a page may be
+# cached, 0 disables the cache (see app_queue.caching)
+
+QUEUES_PAGE_SIZE = 50
+
+QUEUES_LIST_CACHE_TIMEOUT = 0
+
+# How long (in seconds) the profile of a user may be cached across requests, 0 loads it once
+# per request (see app_queue.middleware.ProfileMiddleware)
+
+PROFILE_CACHE_TIMEOUT = int(os.environ.get('DJANGO_PROFILE_CACHE_TIMEOUT', 0))
+
+# Number of rows the exports read from the database at a time (see app_queue.exports)
+
+EXPORT_CHUNK_SIZE = 2000
+
+# Maximum number of study groups returned by the group picker search
+
+GROUP_SEARCH_LIMIT = 20
+
+# Maximum number of users chosen at once by the multi-queue scheduler (see app_queue.scheduling)
+
+NEXT_UP_LIMIT = 50
+
+# Number of hours listed by the wait-time analytics dashboards by default and at most
+# (see app_queue.analytics)
+
+ANALYTICS_HOURS = 24
+
+ANALYTICS_MAX_HOURS = 24 * 31
+
+# Live queue updates, streamed only when served over ASGI: the broadcast backend delivering
+# changes to the event streams, the interval of keepalive comments and the lifetime of a
+# stream, in seconds. The local backend only reaches streams served by the same process, so
+# the streams are turned off when WEB_WORKERS, the number of worker processes as configured
+# for Gunicorn, is above 1. The queue page polls for changes every QUEUE_POLL_INTERVAL seconds,
+# also as a fallback while it streams them
+
+WEB_WORKERS = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+QUEUE_BROADCAST_BACKEND = 'app_queue.broadcast.LocalBroadcast'
+
+QUEUE_EVENTS_KEEPALIVE = 15
+
+QUEUE_EVENTS_MAX_AGE = 300
+
+QUEUE_POLL_INTERVAL = int(os.environ.get('DJANGO_QUEUE_POLL_INTERVAL', 5))
+
+# Cache of queue snapshots read by the queue page (see app_queue.caching). In production
+# the snapshots are kept in the 'snapshots' cache shared by the worker processes, so a change
+# made through one worker is seen by all. The local backend, used in debug mode and by the
+# tests, only sees the writes of its own process, so its snapshots expire after a few seconds
+
+if DEBUG or TESTING:
+    QUEUE_SNAPSHOT_CACHE = {
+        'BACKEND': 'app_queue.caching.LocMemSnapshotBackend',
+        'OPTIONS': {'max_entries': 1000, 'timeout': 5},
+    }
+else:
+    QUEUE_SNAPSHOT_CACHE = {
+        'BACKEND': 'app_queue.caching.DjangoCacheSnapshotBackend',
+        'OPTIONS': {'alias': 'snapshots'},
+    }